@@ -0,0 +1,278 @@
+'''Нагрузочные сценарии для перенаправления, создания и статистики ссылок.
+
+Примеры запуска (из корня репозитория):
+
+    # приложение в том же процессе через httpx.ASGITransport (нужны Postgres и Redis из .env)
+    python -m benchmarks.bench_links --output bench.json
+
+    # то же, но с fakeredis вместо Redis (если пакет установлен)
+    python -m benchmarks.bench_links --fake-redis
+
+    # запущенный uvicorn
+    python -m benchmarks.bench_links --url http://localhost:8000
+
+    # сравнение с сохранённым результатом: код возврата 1 при регрессии
+    python -m benchmarks.bench_links --baseline bench.json --tolerance 0.15
+'''
+import argparse
+import asyncio
+import bisect
+import itertools
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from collections import Counter
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, List, Optional, Sequence
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+RequestFactory = Callable[[httpx.AsyncClient, int], Awaitable[httpx.Response]]
+
+
+def percentile(sorted_values: Sequence[float], fraction: float) -> float:
+    '''Перцентиль методом ближайшего ранга по отсортированной выборке'''
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(fraction * len(sorted_values) + 0.5 - 1e-9)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class ZipfSampler:
+    '''Выбор индексов 0..n-1 по закону Ципфа: индекс k выпадает с вероятностью ~ 1 / (k + 1)^s'''
+
+    def __init__(self, n: int, s: float = 1.1, seed: Optional[int] = None):
+        weights = [1.0 / (k + 1) ** s for k in range(n)]
+        self._cumulative = list(itertools.accumulate(weights))
+        self._random = random.Random(seed)
+
+    def sample(self) -> int:
+        point = self._random.random() * self._cumulative[-1]
+        return bisect.bisect_left(self._cumulative, point)
+
+
+def summarize(latencies: List[float], statuses: Counter, elapsed: float) -> Dict[str, object]:
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "elapsed_seconds": round(elapsed, 4),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed > 0 else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+    }
+
+
+async def run_scenario(
+    client: httpx.AsyncClient, make_request: RequestFactory, total: int, concurrency: int
+) -> Dict[str, object]:
+    '''Выполняет total запросов в concurrency параллельных потоков и возвращает сводку'''
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+    counter = itertools.count()
+
+    async def worker():
+        while True:
+            index = next(counter)
+            if index >= total:
+                return
+            started = time.perf_counter()
+            try:
+                response = await make_request(client, index)
+                statuses[response.status_code] += 1
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, statuses, time.perf_counter() - started)
+
+
+def compare_results(current: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    '''Список регрессий: p95 выросла или пропускная способность упала больше чем на tolerance'''
+    regressions = []
+    for name, result in current["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous:
+            continue
+        if previous["p95_ms"] and result["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {previous['p95_ms']}ms -> {result['p95_ms']}ms")
+        if previous["throughput_rps"] and result["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: throughput {previous['throughput_rps']} rps -> {result['throughput_rps']} rps"
+            )
+    return regressions
+
+
+async def create_links(client: httpx.AsyncClient, prefix: str, count: int) -> List[str]:
+    '''Создаёт count ссылок пакетным эндпоинтом и возвращает их короткие коды'''
+    codes: List[str] = []
+    for start in range(0, count, 1000):
+        items = [{"original_link": f"https://bench.example.com/{prefix}/{index}"}
+                 for index in range(start, min(start + 1000, count))]
+        response = await client.post("/links/shorten/batch", json=items)
+        response.raise_for_status()
+        codes.extend(item["short_url"] for item in response.json() if item["status"] == "created")
+    return codes
+
+
+async def run_benchmarks(client: httpx.AsyncClient, args: argparse.Namespace) -> Dict[str, Dict]:
+    prefix = uuid.uuid4().hex[:8]
+    scenarios: Dict[str, Dict] = {}
+    selected = set(args.scenarios)
+
+    async def redirect(code: str):
+        return await client.get(f"/links/{code}", follow_redirects=False)
+
+    if "redirect_cold" in selected:
+        # Каждый код запрашивается один раз, поэтому каждый запрос – промах кэша
+        cold_codes = await create_links(client, f"{prefix}-cold", args.requests)
+        scenarios["redirect_cold"] = await run_scenario(
+            client, lambda c, i: redirect(cold_codes[i % len(cold_codes)]), len(cold_codes), args.concurrency
+        )
+
+    if "redirect_hot" in selected:
+        hot_code = (await create_links(client, f"{prefix}-hot", 1))[0]
+        for _ in range(args.warmup):
+            await redirect(hot_code)
+        scenarios["redirect_hot"] = await run_scenario(
+            client, lambda c, i: redirect(hot_code), args.requests, args.concurrency
+        )
+
+    if "redirect_zipf" in selected:
+        zipf_codes = await create_links(client, f"{prefix}-zipf", args.links)
+        sampler = ZipfSampler(len(zipf_codes), s=args.zipf_s, seed=args.seed)
+        scenarios["redirect_zipf"] = await run_scenario(
+            client, lambda c, i: redirect(zipf_codes[sampler.sample()]), args.requests, args.concurrency
+        )
+
+    if "stats" in selected:
+        stats_code = (await create_links(client, f"{prefix}-stats", 1))[0]
+        scenarios["stats"] = await run_scenario(
+            client, lambda c, i: c.get(f"/links/{stats_code}/stats"), args.requests, args.concurrency
+        )
+
+    if "shorten_bulk" in selected:
+        batch_size = args.batch_size
+
+        async def shorten_batch(c: httpx.AsyncClient, index: int):
+            items = [{"original_link": f"https://bench.example.com/{prefix}/bulk/{index}/{item}"}
+                     for item in range(batch_size)]
+            return await c.post("/links/shorten/batch", json=items)
+
+        total_batches = max(1, args.requests // batch_size)
+        result = await run_scenario(client, shorten_batch, total_batches, args.concurrency)
+        result["links_per_second"] = round(result["throughput_rps"] * batch_size, 2)  # type: ignore
+        scenarios["shorten_bulk"] = result
+
+    if "create_contention" in selected:
+        # Параллельные создания с пересекающимися alias и URL: проверяем задержку и отсутствие 500
+        aliases = [f"{prefix}c{index}" for index in range(max(1, args.requests // 10))]
+
+        async def contended_create(c: httpx.AsyncClient, index: int):
+            alias = aliases[index % len(aliases)]
+            return await c.post("/links/shorten", params={
+                "original_link": f"https://bench.example.com/{prefix}/contention/{alias}",
+                "custom_alias": alias,
+            })
+
+        scenarios["create_contention"] = await run_scenario(
+            client, contended_create, args.requests, args.concurrency
+        )
+
+    return scenarios
+
+
+def use_fake_redis() -> None:
+    '''Подменяет общий клиент Redis приложения на fakeredis (нужен пакет fakeredis)'''
+    from fakeredis import FakeAsyncRedis
+    import src.redis_pool
+
+    original = src.redis_pool.redis_client
+    fake = FakeAsyncRedis()
+    # Модули получили клиент через from-импорт (main, links.response_cache, links.write_behind
+    # и другие, в том числе под обоими путями импорта links.* и src.links.*), поэтому заменяем
+    # ссылку на общий клиент в каждом загруженном модуле, а не по списку имён
+    for module in list(sys.modules.values()):
+        if getattr(module, "redis_client", None) is original:
+            module.redis_client = fake
+
+
+@asynccontextmanager
+async def open_client(args: argparse.Namespace):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=30) as client:
+            yield client
+        return
+
+    sys.path.insert(0, os.path.join(ROOT, "src"))
+    sys.path.insert(0, ROOT)
+    from src.main import app
+
+    if args.fake_redis:
+        use_fake_redis()
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=30) as client:
+            yield client
+
+
+SCENARIOS = ("redirect_cold", "redirect_hot", "redirect_zipf", "stats", "shorten_bulk", "create_contention")
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmarks for the links API")
+    parser.add_argument("--url", help="Base URL of a running server; by default the app runs in process")
+    parser.add_argument("--fake-redis", action="store_true", help="Use fakeredis in the in-process mode")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=2000, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--links", type=int, default=1000, help="Links in the Zipf scenario")
+    parser.add_argument("--zipf-s", type=float, default=1.1)
+    parser.add_argument("--warmup", type=int, default=20, help="Warm-up redirects before the hot scenario")
+    parser.add_argument("--batch-size", type=int, default=500, help="Items per request in shorten_bulk")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--baseline", help="Compare with a previous JSON result")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed relative regression")
+    return parser.parse_args(argv)
+
+
+async def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = parse_args(argv)
+    async with open_client(args) as client:
+        scenarios = await run_benchmarks(client, args)
+
+    result = {
+        "meta": {
+            "target": args.url or ("in-process+fakeredis" if args.fake_redis else "in-process"),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "timestamp": time.time(),
+        },
+        "scenarios": scenarios,
+    }
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(result, output, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare_results(result, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
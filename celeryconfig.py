@@ -1,8 +1,22 @@
 from celery.schedules import crontab
 
 beat_schedule = {
-    'delete-expired-links-every-minute': {
+    # Просроченные ссылки отклоняются при чтении, поэтому очистка только освобождает место
+    'delete-expired-links-every-hour': {
         'task': 'tasks.tasks.delete_expired_links',
-        'schedule': crontab(minute='*'),
+        'schedule': crontab(minute=0),
+    },
+    'flush-click-counters-every-10-seconds': {
+        'task': 'tasks.tasks.flush_click_counters',
+        'schedule': 10.0,
+    },
+    'aggregate-click-events-every-30-seconds': {
+        'task': 'tasks.tasks.aggregate_click_events',
+        'schedule': 30.0,
+    },
+    # Ссылки, созданные в режиме отложенной записи, попадают в базу с задержкой не больше секунды
+    'persist-queued-links-every-second': {
+        'task': 'tasks.tasks.persist_queued_links',
+        'schedule': 1.0,
     },
 }
@@ -14,4 +14,124 @@ TEST_DB_NAME = os.getenv("TEST_DB_NAME")
 
 SECRET = "YOUR_SECRET_HERE"
 # import os, base64
-# print(base64.urlsafe_b64encode(os.urandom(32)).decode())
\ No newline at end of file
+# print(base64.urlsafe_b64encode(os.urandom(32)).decode())
+
+# Общий пул соединений Redis для всех модулей приложения и задач Celery
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/1")
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "100"))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", "5"))
+# Ключей в одной команде MGET/MSET/DEL при пакетных операциях
+REDIS_BATCH_SIZE = int(os.getenv("REDIS_BATCH_SIZE", "1000"))
+
+# Кэш проверенных JWT-токенов (токен -> id пользователя) и пользователей (id -> пользователь)
+AUTH_TOKEN_CACHE_MAX_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_MAX_SIZE", "10000"))
+AUTH_TOKEN_CACHE_TTL = float(os.getenv("AUTH_TOKEN_CACHE_TTL", "300"))
+AUTH_USER_CACHE_TTL = float(os.getenv("AUTH_USER_CACHE_TTL", "60"))
+
+# Локальный (в памяти процесса) кэш коротких кодов перед Redis
+L1_CACHE_MAX_SIZE = int(os.getenv("L1_CACHE_MAX_SIZE", "10000"))
+L1_CACHE_TTL = float(os.getenv("L1_CACHE_TTL", "60"))
+
+# Политика допуска ссылок в кэш Redis cached_link:*
+CACHE_ADMISSION_THRESHOLD = int(os.getenv("CACHE_ADMISSION_THRESHOLD", "5"))
+CACHE_SKETCH_WIDTH = int(os.getenv("CACHE_SKETCH_WIDTH", "4096"))
+CACHE_SKETCH_DEPTH = int(os.getenv("CACHE_SKETCH_DEPTH", "4"))
+# Через сколько учтённых переходов счётчики скетча делятся пополам
+CACHE_SKETCH_RESET_AFTER = int(os.getenv("CACHE_SKETCH_RESET_AFTER", str(CACHE_SKETCH_WIDTH * 10)))
+# Время жизни записи cached_link:* в Redis, секунды
+CACHED_LINK_TTL = int(os.getenv("CACHED_LINK_TTL", "3600"))
+# Время жизни отрицательной записи (код не найден) в Redis, секунды
+NEGATIVE_CACHE_TTL = int(os.getenv("NEGATIVE_CACHE_TTL", "30"))
+# Блокировка заполнения кэша между воркерами: время жизни блокировки и сколько
+# остальные воркеры ждут появления записи, прежде чем идти в базу сами, секунды
+CACHE_FILL_LOCK_TTL = float(os.getenv("CACHE_FILL_LOCK_TTL", "2"))
+CACHE_FILL_MAX_WAIT = float(os.getenv("CACHE_FILL_MAX_WAIT", "0.5"))
+CACHE_FILL_POLL_INTERVAL = float(os.getenv("CACHE_FILL_POLL_INTERVAL", "0.02"))
+
+# Время жизни ответов поиска и статистики в кэше FastAPICache, секунды. Записи устаревают
+# раньше при смене поколения (создание, изменение, удаление ссылок, сброс переходов)
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "300"))
+
+# Прогрев кэша при старте воркера: сколько популярных ссылок загрузить, за какой
+# период учитывать последние переходы (дни) и сколько секунд максимум на это тратить
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+WARMUP_TOP_N = int(os.getenv("WARMUP_TOP_N", "1000"))
+WARMUP_RECENT_DAYS = float(os.getenv("WARMUP_RECENT_DAYS", "7"))
+WARMUP_TIME_BUDGET = float(os.getenv("WARMUP_TIME_BUDGET", "10"))
+
+# Быстрый путь перенаправления по кэшу в обход маршрутизации и зависимостей FastAPI
+REDIRECT_FAST_LANE = os.getenv("REDIRECT_FAST_LANE", "false").lower() == "true"
+
+# Генератор коротких кодов: "counter" (последовательность Postgres, выдаётся блоками) или "random".
+# Размер блока – шаг последовательности, он применяется при её создании
+SHORT_CODE_GENERATOR = os.getenv("SHORT_CODE_GENERATOR", "counter")
+SHORT_CODE_MIN_LENGTH = int(os.getenv("SHORT_CODE_MIN_LENGTH", "6"))
+SHORT_CODE_BLOCK_SIZE = int(os.getenv("SHORT_CODE_BLOCK_SIZE", "1000"))
+# Первый номер последовательности при её создании. Если раньше работал счётчик в Redis
+# (ключ short_code_counter), укажите его значение, чтобы не повторять уже выданные коды
+SHORT_CODE_COUNTER_START = int(os.getenv("SHORT_CODE_COUNTER_START", "0"))
+
+# Число секций таблицы links, секционированной по хэшу shortened_link, при её создании;
+# 0 – обычная таблица. Существующая таблица переводится в секционированную src.links.partitioning
+LINKS_PARTITIONS = int(os.getenv("LINKS_PARTITIONS", "0"))
+
+# Пакетное создание ссылок: максимум элементов в запросе и строк в одном INSERT
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "50000"))
+BATCH_INSERT_CHUNK_SIZE = int(os.getenv("BATCH_INSERT_CHUNK_SIZE", "1000"))
+
+# Отложенная запись новых ссылок: POST /links/shorten резервирует код в Redis и ставит ссылку
+# в очередь, в базу её пишет задача persist_queued_links. Время жизни резервирования (секунды),
+# ссылок в одном INSERT и пачек за запуск, попыток записи до переноса в очередь ошибок
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "false").lower() == "true"
+WRITE_BEHIND_RESERVATION_TTL = int(os.getenv("WRITE_BEHIND_RESERVATION_TTL", "86400"))
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "1000"))
+WRITE_BEHIND_MAX_BATCHES = int(os.getenv("WRITE_BEHIND_MAX_BATCHES", "20"))
+WRITE_BEHIND_MAX_ATTEMPTS = int(os.getenv("WRITE_BEHIND_MAX_ATTEMPTS", "5"))
+
+# Список ссылок пользователя (/links/mine): размер страницы и строк в пачке при потоковой выдаче
+MY_LINKS_PAGE_SIZE = int(os.getenv("MY_LINKS_PAGE_SIZE", "50"))
+MY_LINKS_MAX_PAGE_SIZE = int(os.getenv("MY_LINKS_MAX_PAGE_SIZE", "1000"))
+MY_LINKS_STREAM_CHUNK_SIZE = int(os.getenv("MY_LINKS_STREAM_CHUNK_SIZE", "1000"))
+
+# Поиск ссылок (/links/search): размер страницы и максимальное смещение
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "50"))
+SEARCH_MAX_PAGE_SIZE = int(os.getenv("SEARCH_MAX_PAGE_SIZE", "500"))
+SEARCH_MAX_OFFSET = int(os.getenv("SEARCH_MAX_OFFSET", "10000"))
+
+# Выгрузка и загрузка таблицы links: строк в пачке серверного курсора и в одном COPY
+TRANSFER_STREAM_CHUNK_SIZE = int(os.getenv("TRANSFER_STREAM_CHUNK_SIZE", "5000"))
+TRANSFER_CHUNK_SIZE = int(os.getenv("TRANSFER_CHUNK_SIZE", "10000"))
+
+# Очистка просроченных ссылок: строк в одном DELETE и максимум пачек за запуск задачи;
+# если все пачки запуска были полными, задача сразу ставит в очередь следующий запуск
+SWEEP_BATCH_SIZE = int(os.getenv("SWEEP_BATCH_SIZE", "1000"))
+SWEEP_MAX_BATCHES = int(os.getenv("SWEEP_MAX_BATCHES", "100"))
+
+# Блокировка периодических задач Celery (сброс переходов, агрегация): время жизни в секундах,
+# больше самого долгого запуска, иначе следующий запуск начнётся раньше окончания текущего
+TASK_LOCK_TTL = int(os.getenv("TASK_LOCK_TTL", "300"))
+# Сколько дней хранятся идентификаторы применённых сбросов переходов
+CLICK_FLUSH_HISTORY_DAYS = int(os.getenv("CLICK_FLUSH_HISTORY_DAYS", "1"))
+
+# Поток событий переходов для аналитики: приблизительная максимальная длина
+CLICK_EVENTS_STREAM_MAXLEN = int(os.getenv("CLICK_EVENTS_STREAM_MAXLEN", "1000000"))
+# Сколько событий потока обрабатывать за один запуск агрегации
+CLICK_EVENTS_BATCH_SIZE = int(os.getenv("CLICK_EVENTS_BATCH_SIZE", "10000"))
+CLICK_EVENTS_MAX_BATCHES = int(os.getenv("CLICK_EVENTS_MAX_BATCHES", "20"))
+
+# Пул соединений для записи (основной сервер) и для чтения (может указывать на реплику)
+DB_WRITE_POOL_SIZE = int(os.getenv("DB_WRITE_POOL_SIZE", "5"))
+DB_WRITE_MAX_OVERFLOW = int(os.getenv("DB_WRITE_MAX_OVERFLOW", "10"))
+DB_WRITE_POOL_TIMEOUT = float(os.getenv("DB_WRITE_POOL_TIMEOUT", "30"))
+DB_WRITE_STATEMENT_CACHE_SIZE = int(os.getenv("DB_WRITE_STATEMENT_CACHE_SIZE", "100"))
+
+DB_READ_HOST = os.getenv("DB_READ_HOST", DB_HOST)
+DB_READ_PORT = os.getenv("DB_READ_PORT", DB_PORT)
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", "10"))
+DB_READ_MAX_OVERFLOW = int(os.getenv("DB_READ_MAX_OVERFLOW", "20"))
+DB_READ_POOL_TIMEOUT = float(os.getenv("DB_READ_POOL_TIMEOUT", "5"))
+DB_READ_STATEMENT_CACHE_SIZE = int(os.getenv("DB_READ_STATEMENT_CACHE_SIZE", "500"))
+
+# Эндпоинт /debug/profile с сэмплирующим профилировщиком (включать осознанно)
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "false").lower() == "true"
+PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", "30"))
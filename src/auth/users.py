@@ -1,19 +1,45 @@
+import time
 import uuid
-from typing import Optional
-from fastapi import Depends, Request
+from typing import Any, Dict, Optional
+import jwt
+from fastapi import Depends, HTTPException, Request
 # Импорт базовых классов для управления пользователями из fastapi-users
-from fastapi_users import BaseUserManager, FastAPIUsers, UUIDIDMixin, models
+from fastapi_users import BaseUserManager, FastAPIUsers, UUIDIDMixin, exceptions, models
 from fastapi_users.authentication import (
     AuthenticationBackend,
     BearerTransport,
     JWTStrategy,
 )
 from fastapi_users.db import SQLAlchemyUserDatabase
+from fastapi_users.jwt import decode_jwt
+from sqlalchemy import inspect
+from config import AUTH_TOKEN_CACHE_MAX_SIZE, AUTH_TOKEN_CACHE_TTL, AUTH_USER_CACHE_TTL
+from src.local_cache import LRUTTLCache, listen_for_invalidations
+from src.redis_pool import redis_client
 
 from .db import User, get_user_db  # Импорт модели пользователя и функции доступа к базе данных
 
 SECRET = "SECRET"  # Секрет, используемый для подписывания JWT-токенов и генерации токенов сброса пароля
 
+# Канал Redis pub/sub, через который воркеры сообщают об изменённых пользователях
+USER_INVALIDATION_CHANNEL = "auth_user:invalidate"
+
+# Проверенные токены: токен -> id пользователя; запись живёт не дольше самого токена
+verified_tokens = LRUTTLCache(max_size=AUTH_TOKEN_CACHE_MAX_SIZE, ttl=AUTH_TOKEN_CACHE_TTL)
+# Активные пользователи: id -> копия пользователя, не привязанная к сессии
+cached_users = LRUTTLCache(max_size=AUTH_TOKEN_CACHE_MAX_SIZE, ttl=AUTH_USER_CACHE_TTL)
+
+
+async def invalidate_cached_user(user_id: uuid.UUID) -> None:
+    '''Удаляет пользователя из кэша во всех воркерах: следующий запрос перечитает его из базы'''
+    cached_users.delete(user_id)
+    await redis_client.publish(USER_INVALIDATION_CHANNEL, str(user_id))
+
+
+async def listen_for_user_invalidations() -> None:
+    '''Фоновая задача: удаляет из кэша пользователей, изменённых в других воркерах'''
+    await listen_for_invalidations(redis_client, USER_INVALIDATION_CHANNEL, cached_users, parse_key=uuid.UUID)
+
 # Определяем менеджер пользователей, реализующий необходимую логику
 class UserManager(UUIDIDMixin, BaseUserManager[User, uuid.UUID]):
     # Секреты для токенов сброса пароля и верификации нового пользователя
@@ -36,6 +62,16 @@ class UserManager(UUIDIDMixin, BaseUserManager[User, uuid.UUID]):
     ):
         print(f"Verification requested for user {user.id}. Verification token: {token}")
 
+    # Методы, вызываемые после изменения и удаления пользователя: кэш пользователей
+    # не должен пропускать деактивированного или удалённого пользователя
+    async def on_after_update(
+        self, user: User, update_dict: Dict[str, Any], request: Optional[Request] = None
+    ):
+        await invalidate_cached_user(user.id)
+
+    async def on_after_delete(self, user: User, request: Optional[Request] = None):
+        await invalidate_cached_user(user.id)
+
 # Функция-зависимость для получения инстанса менеджера пользователей
 async def get_user_manager(user_db: SQLAlchemyUserDatabase = Depends(get_user_db)):
     yield UserManager(user_db)
@@ -63,14 +99,58 @@ auth_backend = AuthenticationBackend(
 # - [auth_backend]: список бекендов аутентификации, которые будут использоваться
 fastapi_users = FastAPIUsers[User, uuid.UUID](get_user_manager, [auth_backend])
 
+def verify_token(token: str) -> Optional[uuid.UUID]:
+    '''Проверяет подпись и срок действия JWT и возвращает id пользователя; результат кэшируется'''
+    user_id = verified_tokens.get(token)
+    if user_id is not None:
+        return user_id
+    strategy = get_jwt_strategy()
+    try:
+        data = decode_jwt(token, strategy.decode_key, strategy.token_audience, algorithms=[strategy.algorithm])
+        user_id = uuid.UUID(data["sub"])
+    except (jwt.PyJWTError, KeyError, ValueError):
+        return None
+    ttl = min(AUTH_TOKEN_CACHE_TTL, data["exp"] - time.time()) if "exp" in data else AUTH_TOKEN_CACHE_TTL
+    if ttl > 0:
+        verified_tokens.set(token, user_id, ttl=ttl)
+    return user_id
+
+
+def _detached_copy(user: User) -> User:
+    return User(**{attr.key: getattr(user, attr.key) for attr in inspect(User).column_attrs})
+
+
+async def get_optional_current_user(
+    token: Optional[str] = Depends(bearer_transport.scheme),
+    user_manager: UserManager = Depends(get_user_manager),
+) -> Optional[User]:
+    '''Текущий активный пользователь или None для анонимного запроса.
+
+    Без заголовка Authorization ни токен, ни база не проверяются. Проверенные токены
+    и активные пользователи кэшируются в памяти воркера, поэтому повторные запросы
+    с тем же токеном не декодируют JWT и не читают таблицу пользователей (сессия
+    базы создаётся лениво и соединение из пула не берёт).
+    '''
+    if not token:
+        return None
+    user_id = verify_token(token)
+    if user_id is None:
+        return None
+
+    user = cached_users.get(user_id)
+    if user is None:
+        try:
+            user = await user_manager.get(user_id)
+        except exceptions.UserNotExists:
+            return None
+        if user.is_active:
+            cached_users.set(user_id, _detached_copy(user))
+    return user if user.is_active else None
+
+
 # Зависимость, возвращающая текущего активного пользователя.
 # Может использоваться в роутерах для защиты эндпоинтов.
-current_active_user = fastapi_users.current_user(active=True)
-
-async def get_optional_current_user(request: Request) -> Optional[User]:
-    try:
-        # Пытаемся получить текущего активного пользователя.
-        return await current_active_user(request)
-    except Exception:
-        # Если аутентификация не прошла, возвращаем None
-        return None
\ No newline at end of file
+async def current_active_user(user: Optional[User] = Depends(get_optional_current_user)) -> User:
+    if user is None:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    return user
@@ -3,35 +3,86 @@ from dotenv import load_dotenv
 load_dotenv()  # Загружаем переменные окружения из файла .env
 import pytest
 import pytest_asyncio
-from typing import AsyncGenerator
+from typing import AsyncGenerator, Dict
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from config import DB_USER, DB_PASS, DB_HOST, DB_PORT, DB_NAME, TEST_DB_NAME
+from config import (
+    DB_WRITE_POOL_SIZE, DB_WRITE_MAX_OVERFLOW, DB_WRITE_POOL_TIMEOUT, DB_WRITE_STATEMENT_CACHE_SIZE,
+    DB_READ_HOST, DB_READ_PORT, DB_READ_POOL_SIZE, DB_READ_MAX_OVERFLOW, DB_READ_POOL_TIMEOUT,
+    DB_READ_STATEMENT_CACHE_SIZE,
+)
 from sqlalchemy import create_engine
 from contextlib import asynccontextmanager
+from src.metrics import instrument_engine
 
 # Для синхронного подключения используем драйвер psycopg2:
 SYNC_DATABASE_URL = f"postgresql+psycopg2://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+# Чтение может идти с реплики; по умолчанию это тот же сервер, но отдельный пул
+READ_DATABASE_URL = f"postgresql+asyncpg://{DB_USER}:{DB_PASS}@{DB_READ_HOST}:{DB_READ_PORT}/{DB_NAME}"
+# Чтение идёт с реплики, которая может отставать от основного сервера
+READ_FROM_REPLICA = (DB_READ_HOST, str(DB_READ_PORT)) != (DB_HOST, str(DB_PORT))
 
 synchronized_engine = create_engine(SYNC_DATABASE_URL)
 SyncSessionMaker = sessionmaker(bind=synchronized_engine, autocommit=False, autoflush=False)
 
-# Настройка асинхронного движка с параметрами пула соединений
-engine = create_async_engine(
-    DATABASE_URL,
-    pool_size=5,
-    max_overflow=10,
-    pool_pre_ping=True,
-    pool_recycle=3600  # Закрываем неактивные соединения, чтобы избежать аварийного разрыва
+
+def create_pooled_engine(url: str, pool_size: int, max_overflow: int, pool_timeout: float, statement_cache_size: int) -> AsyncEngine:
+    '''Асинхронный движок с собственным пулом соединений и кэшем подготовленных запросов'''
+    return create_async_engine(
+        f"{url}?prepared_statement_cache_size={statement_cache_size}",
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=pool_timeout,
+        pool_pre_ping=True,
+        pool_recycle=3600  # Закрываем неактивные соединения, чтобы избежать аварийного разрыва
+    )
+
+
+# Пул для записи: создание, изменение и удаление ссылок, таблицы fastapi-users
+write_engine = create_pooled_engine(
+    DATABASE_URL, DB_WRITE_POOL_SIZE, DB_WRITE_MAX_OVERFLOW, DB_WRITE_POOL_TIMEOUT, DB_WRITE_STATEMENT_CACHE_SIZE
+)
+# Пул для чтения: перенаправления, поиск и статистика не конкурируют за соединения с записью
+read_engine = create_pooled_engine(
+    READ_DATABASE_URL, DB_READ_POOL_SIZE, DB_READ_MAX_OVERFLOW, DB_READ_POOL_TIMEOUT, DB_READ_STATEMENT_CACHE_SIZE
 )
-async_session_maker = async_sessionmaker(engine, expire_on_commit=False)
+instrument_engine(write_engine, "write")
+instrument_engine(read_engine, "read")
+engine = write_engine
+async_session_maker = async_sessionmaker(write_engine, expire_on_commit=False)
+read_session_maker = async_sessionmaker(read_engine, expire_on_commit=False)
 
 async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
     async with async_session_maker() as session:
         yield session  # Гарантированное закрытие сессии
-        
 
+# Сессия основного сервера; отдельное имя для наглядности в роутерах
+get_write_session = get_async_session
+
+async def get_read_session() -> AsyncGenerator[AsyncSession, None]:
+    async with read_session_maker() as session:
+        yield session
+
+
+def pool_status() -> Dict[str, Dict[str, float]]:
+    '''Состояние пулов соединений: занято, свободно, переполнение и доля занятых от максимума'''
+    status = {}
+    for name, pooled_engine in (("write", write_engine), ("read", read_engine)):
+        pool = pooled_engine.sync_engine.pool
+        capacity = pool.size() + pool._max_overflow  # type: ignore
+        checked_out = pool.checkedout()  # type: ignore
+        status[name] = {
+            "size": pool.size(),  # type: ignore
+            "checked_out": checked_out,
+            "checked_in": pool.checkedin(),  # type: ignore
+            "overflow": pool.overflow(),  # type: ignore
+            "capacity": capacity,
+            "saturation": checked_out / capacity if capacity else 0.0,
+        }
+    return status
+        
     
 # test_engine = create_async_engine(
 #     TEST_DATABASE_URL,
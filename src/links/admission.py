@@ -0,0 +1,77 @@
+from array import array
+from typing import Hashable, List
+from config import (
+    CACHE_ADMISSION_THRESHOLD,
+    CACHE_SKETCH_DEPTH,
+    CACHE_SKETCH_WIDTH,
+    CACHE_SKETCH_RESET_AFTER,
+)
+
+
+class CountMinSketch:
+    '''Вероятностный счётчик частот (Count-Min Sketch) со старением, как в TinyLFU.
+
+    После reset_after увеличений все счётчики делятся пополам, поэтому оценка
+    отражает недавнюю популярность ключа, а не накопленную за всё время.
+    '''
+
+    def __init__(self, width: int, depth: int, reset_after: int):
+        self.width = width
+        self.depth = depth
+        self.reset_after = reset_after
+        self._rows: List[array] = [array("I", [0]) * width for _ in range(depth)]
+        self._additions = 0
+
+    def _indexes(self, key: Hashable) -> List[int]:
+        # Двойное хэширование: depth независимых позиций из двух значений хэша
+        h1 = hash(key)
+        h2 = hash((key, 0x9E3779B9)) | 1
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def estimate(self, key: Hashable) -> int:
+        return min(row[index] for row, index in zip(self._rows, self._indexes(key)))
+
+    def increment(self, key: Hashable) -> int:
+        '''Увеличивает частоту ключа и возвращает новую оценку'''
+        indexes = self._indexes(key)
+        current = min(row[index] for row, index in zip(self._rows, indexes))
+        # Консервативное обновление: увеличиваем только минимальные счётчики,
+        # это заметно снижает переоценку частот редких ключей
+        for row, index in zip(self._rows, indexes):
+            if row[index] == current:
+                row[index] = current + 1
+        self._additions += 1
+        if self._additions >= self.reset_after:
+            self._age()
+            return self.estimate(key)
+        return current + 1
+
+    def _age(self) -> None:
+        for row in self._rows:
+            for index in range(self.width):
+                row[index] >>= 1
+        self._additions = 0
+
+
+class HotLinkAdmission:
+    '''Политика допуска коротких кодов в кэш cached_link:* по недавней частоте переходов'''
+
+    def __init__(self, sketch: CountMinSketch, threshold: int):
+        self.sketch = sketch
+        self.threshold = threshold
+
+    def record(self, short_code: str) -> int:
+        return self.sketch.increment(short_code)
+
+    def should_admit(self, short_code: str) -> bool:
+        return self.sketch.estimate(short_code) >= self.threshold
+
+
+hot_link_admission = HotLinkAdmission(
+    CountMinSketch(
+        width=CACHE_SKETCH_WIDTH,
+        depth=CACHE_SKETCH_DEPTH,
+        reset_after=CACHE_SKETCH_RESET_AFTER,
+    ),
+    threshold=CACHE_ADMISSION_THRESHOLD,
+)
@@ -0,0 +1,134 @@
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Mapping, Optional, Tuple
+from urllib.parse import urlsplit
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from .models import LinkClickRollup
+
+# Поток Redis с событиями переходов и группа его потребителей (задача aggregate_click_events)
+CLICK_EVENTS_STREAM = "link_click_events"
+CLICK_EVENTS_GROUP = "click_rollups"
+
+GRANULARITIES = ("hour", "day")
+
+# Измерения, по которым ведутся агрегаты; у "total" значение всегда пустое
+DIMENSION_TOTAL = "total"
+DIMENSION_REFERRER = "referrer"
+DIMENSION_AGENT = "agent"
+
+_BOT_MARKERS = ("bot", "crawler", "spider", "slurp", "curl", "wget", "python-", "httpx", "go-http-client", "java/")
+_TABLET_MARKERS = ("ipad", "tablet")
+_MOBILE_MARKERS = ("mobi", "iphone", "android")
+
+RollupKey = Tuple[str, str, datetime, str, str]
+
+
+def classify_user_agent(user_agent: Optional[str]) -> str:
+    '''Грубый класс клиента по заголовку User-Agent: bot, tablet, mobile, desktop или other'''
+    if not user_agent:
+        return "other"
+    user_agent = user_agent.lower()
+    if any(marker in user_agent for marker in _BOT_MARKERS):
+        return "bot"
+    if any(marker in user_agent for marker in _TABLET_MARKERS):
+        return "tablet"
+    if any(marker in user_agent for marker in _MOBILE_MARKERS):
+        return "mobile"
+    if "mozilla" in user_agent:
+        return "desktop"
+    return "other"
+
+
+def referrer_host(referrer: Optional[str]) -> str:
+    '''Хост из заголовка Referer; "direct", если заголовка нет или он некорректен'''
+    if not referrer:
+        return "direct"
+    try:
+        host = urlsplit(referrer).hostname
+    except ValueError:
+        return "direct"
+    return host.lower() if host else "direct"
+
+
+def to_local_naive(moment: Optional[datetime]) -> Optional[datetime]:
+    '''Время с часовым поясом (например, "2024-05-01T10:00:00Z" в запросе) – в наивное
+    локальное время сервера, в котором хранятся агрегаты; наивное время не меняется'''
+    if moment is None or moment.tzinfo is None:
+        return moment
+    return moment.astimezone().replace(tzinfo=None)
+
+
+def bucket_start(moment: datetime, granularity: str) -> datetime:
+    if granularity == "hour":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def click_event(short_code: str, moment: datetime, referrer: Optional[str], user_agent: Optional[str]) -> Dict[str, str]:
+    '''Компактное событие перехода для потока Redis'''
+    return {
+        "c": short_code,
+        "t": str(int(moment.timestamp())),
+        "r": referrer_host(referrer),
+        "a": classify_user_agent(user_agent),
+    }
+
+
+def aggregate_click_events(events: Iterable[Mapping]) -> Dict[RollupKey, int]:
+    '''Сворачивает события переходов в счётчики по часовым и дневным интервалам'''
+    rollups: Counter = Counter()
+    for event in events:
+        fields = {
+            (key.decode() if isinstance(key, bytes) else key): (value.decode() if isinstance(value, bytes) else value)
+            for key, value in event.items()
+        }
+        moment = datetime.fromtimestamp(int(fields["t"]))
+        for granularity in GRANULARITIES:
+            start = bucket_start(moment, granularity)
+            rollups[(fields["c"], granularity, start, DIMENSION_TOTAL, "")] += 1
+            rollups[(fields["c"], granularity, start, DIMENSION_REFERRER, fields["r"])] += 1
+            rollups[(fields["c"], granularity, start, DIMENSION_AGENT, fields["a"])] += 1
+    return dict(rollups)
+
+
+# Период по умолчанию для гистограммы, если границы не заданы
+DEFAULT_HISTOGRAM_PERIOD = {"hour": timedelta(hours=48), "day": timedelta(days=30)}
+
+
+async def get_click_histogram(
+    session: AsyncSession,
+    short_code: str,
+    granularity: str,
+    start: datetime,
+    end: datetime,
+) -> Dict[str, object]:
+    '''Гистограмма переходов, источники и классы клиентов за период – из предагрегированных интервалов'''
+    query = (
+        select(LinkClickRollup.bucket_start, LinkClickRollup.dimension, LinkClickRollup.value, LinkClickRollup.clicks)
+        .where(
+            LinkClickRollup.short_code == short_code,
+            LinkClickRollup.granularity == granularity,
+            LinkClickRollup.bucket_start >= bucket_start(start, granularity),
+            LinkClickRollup.bucket_start <= end,
+        )
+        .order_by(LinkClickRollup.bucket_start)
+    )
+    histogram = []
+    referrers: Counter = Counter()
+    user_agents: Counter = Counter()
+    for row in (await session.execute(query)).all():
+        if row.dimension == DIMENSION_TOTAL:
+            histogram.append({"bucket_start": row.bucket_start, "clicks": row.clicks})
+        elif row.dimension == DIMENSION_REFERRER:
+            referrers[row.value] += row.clicks
+        elif row.dimension == DIMENSION_AGENT:
+            user_agents[row.value] += row.clicks
+    return {
+        "granularity": granularity,
+        "from": start,
+        "to": end,
+        "clicks": histogram,
+        "referrers": dict(referrers.most_common()),
+        "user_agents": dict(user_agents.most_common()),
+    }
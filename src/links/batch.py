@@ -0,0 +1,177 @@
+import json
+import uuid
+from typing import Dict, List, Optional, Tuple
+from fastapi import HTTPException, Request
+from pydantic import ValidationError
+from sqlalchemy import select, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from config import BATCH_MAX_ITEMS, BATCH_INSERT_CHUNK_SIZE
+from .codegen import code_generator
+from .models import Link
+from .schemas import LinkBatchItem, LinkBatchResult, LinkCreate
+from .urls import url_digest
+
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+# Сколько раз пробуем заново вставить элементы, сгенерированный код которых оказался занят
+GENERATED_CODE_MAX_ATTEMPTS = 3
+
+ParsedItem = Tuple[int, Optional[LinkBatchItem], Optional[str]]
+
+
+def _parse_item(index: int, raw_item) -> ParsedItem:
+    try:
+        return index, LinkBatchItem.model_validate(raw_item), None
+    except ValidationError as e:
+        return index, None, str(e)
+
+
+async def read_batch_items(request: Request) -> List[ParsedItem]:
+    '''Читает элементы пакета из JSON-массива или из NDJSON-потока (по одному объекту в строке).
+
+    NDJSON разбирается по мере поступления тела запроса, без чтения его целиком в память.
+    '''
+    items: List[ParsedItem] = []
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+
+    if content_type in NDJSON_CONTENT_TYPES:
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    items.append(_parse_ndjson_line(len(items), line))
+            if len(items) > BATCH_MAX_ITEMS:
+                raise HTTPException(status_code=413, detail=f"Batch is limited to {BATCH_MAX_ITEMS} items")
+        if buffer.strip():
+            items.append(_parse_ndjson_line(len(items), buffer))
+        return items
+
+    try:
+        raw_items = json.loads(await request.body())
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Request body must be a JSON array or NDJSON")
+    if not isinstance(raw_items, list):
+        raise HTTPException(status_code=422, detail="Request body must be a JSON array or NDJSON")
+    if len(raw_items) > BATCH_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Batch is limited to {BATCH_MAX_ITEMS} items")
+    return [_parse_item(index, raw_item) for index, raw_item in enumerate(raw_items)]
+
+
+def _parse_ndjson_line(index: int, line: bytes) -> ParsedItem:
+    try:
+        return _parse_item(index, json.loads(line))
+    except ValueError as e:
+        return index, None, f"Invalid JSON: {e}"
+
+
+async def create_links_batch(
+    session: AsyncSession,
+    parsed_items: List[ParsedItem],
+    user_id: Optional[uuid.UUID],
+) -> List[LinkBatchResult]:
+    '''Создаёт ссылки пакетом: многострочные INSERT ... ON CONFLICT DO NOTHING по чанкам'''
+    results: Dict[int, LinkBatchResult] = {}
+    pending: List[Tuple[int, LinkBatchItem]] = []
+    seen_originals = set()
+    seen_aliases = set()
+
+    for index, item, error in parsed_items:
+        if item is None:
+            results[index] = LinkBatchResult(index=index, status="invalid", detail=error)
+        elif url_digest(item.original_link) in seen_originals:
+            results[index] = LinkBatchResult(
+                index=index, original_link=item.original_link, status="conflict",
+                detail="Duplicate original link in batch"
+            )
+        elif item.custom_alias and item.custom_alias in seen_aliases:
+            results[index] = LinkBatchResult(
+                index=index, original_link=item.original_link, status="conflict",
+                detail="Duplicate custom alias in batch"
+            )
+        else:
+            seen_originals.add(url_digest(item.original_link))
+            if item.custom_alias:
+                seen_aliases.add(item.custom_alias)
+            pending.append((index, item))
+
+    for start in range(0, len(pending), BATCH_INSERT_CHUNK_SIZE):
+        await _insert_chunk(session, pending[start:start + BATCH_INSERT_CHUNK_SIZE], user_id, results)
+
+    return [results[index] for index in sorted(results)]
+
+
+async def _insert_chunk(
+    session: AsyncSession,
+    chunk: List[Tuple[int, LinkBatchItem]],
+    user_id: Optional[uuid.UUID],
+    results: Dict[int, LinkBatchResult],
+) -> None:
+    for _ in range(GENERATED_CODE_MAX_ATTEMPTS):
+        generated_codes = iter(await code_generator.next_codes(session, sum(1 for _, item in chunk if not item.custom_alias)))
+        codes = [item.custom_alias or next(generated_codes) for _, item in chunk]
+        links = [
+            LinkCreate(
+                user_id=user_id,
+                original_link=item.original_link,
+                shortened_link=code,
+                custom_alias=bool(item.custom_alias),
+                expires_at=item.expires_at.replace(second=0, microsecond=0) if item.expires_at else None,
+            )
+            for (_, item), code in zip(chunk, codes)
+        ]
+        statement = (
+            pg_insert(Link)
+            .values([link.model_dump() for link in links])
+            .on_conflict_do_nothing()
+            .returning(Link.original_link_hash)
+        )
+        inserted = set((await session.execute(statement)).scalars().all())
+        await session.commit()
+
+        rejected = []
+        for (index, item), link in zip(chunk, links):
+            if link.original_link_hash in inserted:
+                results[index] = LinkBatchResult(
+                    index=index, original_link=item.original_link, status="created", short_url=link.shortened_link
+                )
+            else:
+                rejected.append((index, item, link))
+        if not rejected:
+            return
+
+        # Одним запросом выясняем причины конфликтов для всех невставленных элементов
+        query = select(Link.original_link_hash, Link.shortened_link).where(or_(
+            Link.original_link_hash.in_([link.original_link_hash for _, _, link in rejected]),
+            Link.shortened_link.in_([link.shortened_link for _, _, link in rejected]),
+        ))
+        existing_originals = {
+            row.original_link_hash: row.shortened_link for row in (await session.execute(query)).all()
+        }
+
+        chunk = []
+        for index, item, link in rejected:
+            if link.original_link_hash in existing_originals:
+                results[index] = LinkBatchResult(
+                    index=index, original_link=item.original_link, status="conflict",
+                    short_url=existing_originals[link.original_link_hash], detail="Short code already exists"
+                )
+            elif item.custom_alias:
+                results[index] = LinkBatchResult(
+                    index=index, original_link=item.original_link, status="conflict",
+                    detail="Custom alias provided already exists"
+                )
+            else:
+                # Сгенерированный код занят ранее заданным alias – повторим со следующим кодом
+                chunk.append((index, item))
+        if not chunk:
+            return
+        await code_generator.discard_block()
+
+    for index, item in chunk:
+        results[index] = LinkBatchResult(
+            index=index, original_link=item.original_link, status="conflict",
+            detail="Could not allocate a free short code"
+        )
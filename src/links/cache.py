@@ -0,0 +1,210 @@
+import asyncio
+import json
+import struct
+import uuid
+from datetime import datetime
+from typing import Iterable, NamedTuple, Optional
+from config import (
+    L1_CACHE_MAX_SIZE, L1_CACHE_TTL, CACHED_LINK_TTL, NEGATIVE_CACHE_TTL,
+    CACHE_FILL_LOCK_TTL, CACHE_FILL_MAX_WAIT, CACHE_FILL_POLL_INTERVAL,
+)
+from src.local_cache import LRUTTLCache, listen_for_invalidations
+from src.metrics import CACHE_LOOKUPS
+from src.redis_pool import redis_client, set_many, delete_many
+from .models import Link
+
+CACHE_KEY_PREFIX = "cached_link:"
+# Блокировка, которую держит воркер, загружающий ссылку из базы в кэш
+FILL_LOCK_KEY_PREFIX = "cached_link_lock:"
+
+# Канал Redis pub/sub, через который воркеры сообщают друг другу об устаревших кодах
+INVALIDATION_CHANNEL = "cached_link:invalidate"
+
+# Кэш первого уровня: short_code -> CachedLink в памяти текущего процесса
+local_link_cache = LRUTTLCache(max_size=L1_CACHE_MAX_SIZE, ttl=L1_CACHE_TTL)
+
+
+class CachedLink(NamedTuple):
+    original_link: Optional[str]
+    expires_at: Optional[datetime]
+
+    def is_expired(self, now: Optional[datetime] = None) -> bool:
+        return is_expired(self.expires_at, now)
+
+    def is_missing(self) -> bool:
+        return self.original_link is None
+
+
+# Отрицательная запись: кода нет в базе
+MISSING_LINK = CachedLink(None, None)
+
+
+def is_expired(expires_at: Optional[datetime], now: Optional[datetime] = None) -> bool:
+    return expires_at is not None and expires_at <= (now or datetime.now())
+
+
+def ttl_until_expiry(expires_at: Optional[datetime], ttl: float, now: Optional[datetime] = None) -> float:
+    '''Время жизни записи кэша: не дольше ttl и не дольше срока действия самой ссылки'''
+    if expires_at is None:
+        return ttl
+    return min(ttl, (expires_at - (now or datetime.now())).total_seconds())
+
+
+def cache_key(short_code: str) -> str:
+    return f"{CACHE_KEY_PREFIX}{short_code}"
+
+
+# Компактный формат значения cached_link:*: байт версии, срок действия (unix time,
+# 0 – бессрочная ссылка, 8 байт) и original_link в UTF-8. Отрицательная запись – один байт.
+# Значения в старом формате JSON ("{...}") по-прежнему читаются, пока не истекут.
+_LINK_FORMAT = b"\x01"
+_MISSING_FORMAT = b"\x00"
+_EXPIRES_AT = struct.Struct(">q")
+
+
+def encode_cached_link(original_link: str, expires_at: Optional[datetime]) -> bytes:
+    expires_ts = int(expires_at.timestamp()) if expires_at else 0
+    return _LINK_FORMAT + _EXPIRES_AT.pack(expires_ts) + original_link.encode("utf-8")
+
+
+def decode_cached_link(cached_data: bytes) -> CachedLink:
+    if cached_data[:1] == _MISSING_FORMAT:
+        return MISSING_LINK
+    if cached_data[:1] == _LINK_FORMAT:
+        (expires_ts,) = _EXPIRES_AT.unpack_from(cached_data, 1)
+        return CachedLink(
+            cached_data[1 + _EXPIRES_AT.size:].decode("utf-8"),
+            datetime.fromtimestamp(expires_ts) if expires_ts else None,
+        )
+    data = json.loads(cached_data)
+    if data.get("missing"):
+        return MISSING_LINK
+    expires_at = data.get("expires_at")
+    return CachedLink(data["original_link"], datetime.fromisoformat(expires_at) if expires_at else None)
+
+
+async def get_cached_link(short_code: str) -> Optional[CachedLink]:
+    '''Возвращает ссылку из локального кэша или Redis, либо None, если записи нет.
+
+    Для кодов, которых нет в базе, возвращается MISSING_LINK.
+    '''
+    cached_link = local_link_cache.get(short_code)
+    if cached_link is not None:
+        CACHE_LOOKUPS.inc(tier="local", result="hit")
+        return cached_link
+    CACHE_LOOKUPS.inc(tier="local", result="miss")
+
+    cached_data = await redis_client.get(cache_key(short_code))
+    if not cached_data:
+        CACHE_LOOKUPS.inc(tier="redis", result="miss")
+        return None
+    cached_link = decode_cached_link(cached_data)
+    if cached_link.is_missing():
+        # Отрицательные записи живут только в Redis: при создании кода их достаточно удалить
+        # одной командой, без рассылки инвалидации по воркерам
+        CACHE_LOOKUPS.inc(tier="redis", result="negative")
+        return cached_link
+    CACHE_LOOKUPS.inc(tier="redis", result="hit")
+    ttl = ttl_until_expiry(cached_link.expires_at, L1_CACHE_TTL)
+    if ttl > 0:
+        local_link_cache.set(short_code, cached_link, ttl=ttl)
+    return cached_link
+
+
+async def cache_link(link: Link) -> None:
+    '''Сохраняет ссылку в кэш Redis и в локальный кэш; записи живут не дольше срока действия ссылки'''
+    ttl = ttl_until_expiry(link.expires_at, CACHED_LINK_TTL)  # type: ignore
+    if ttl <= 0:
+        return
+    await redis_client.set(
+        cache_key(link.shortened_link),  # type: ignore
+        encode_cached_link(link.original_link, link.expires_at),  # type: ignore
+        px=max(1, int(ttl * 1000)),
+    )
+    local_link_cache.set(
+        link.shortened_link,
+        CachedLink(link.original_link, link.expires_at),  # type: ignore
+        ttl=ttl_until_expiry(link.expires_at, L1_CACHE_TTL),  # type: ignore
+    )
+
+
+async def cache_links_bulk(links: Iterable, fill_local: bool = True) -> int:
+    '''Сохраняет пачку ссылок (shortened_link, original_link, expires_at) в Redis одним конвейером'''
+    items = {}
+    for link in links:
+        ttl = ttl_until_expiry(link.expires_at, CACHED_LINK_TTL)
+        if ttl <= 0:
+            continue
+        items[cache_key(link.shortened_link)] = (
+            encode_cached_link(link.original_link, link.expires_at), max(1, int(ttl * 1000))
+        )
+        if fill_local:
+            local_link_cache.set(
+                link.shortened_link,
+                CachedLink(link.original_link, link.expires_at),
+                ttl=ttl_until_expiry(link.expires_at, L1_CACHE_TTL),
+            )
+    await set_many(items)
+    return len(items)
+
+
+async def cache_missing_link(short_code: str) -> None:
+    '''Запоминает в Redis, что кода нет в базе: повторные запросы несуществующих кодов не идут в базу'''
+    await redis_client.set(cache_key(short_code), _MISSING_FORMAT, ex=NEGATIVE_CACHE_TTL)
+
+
+async def forget_missing_links(*short_codes: str) -> None:
+    '''Удаляет отрицательные записи для только что созданных кодов'''
+    await delete_many([cache_key(code) for code in short_codes])
+
+
+async def acquire_fill_lock(short_code: str) -> Optional[str]:
+    '''Пытается взять блокировку заполнения кэша для кода; возвращает токен или None, если она занята'''
+    token = uuid.uuid4().hex
+    acquired = await redis_client.set(
+        f"{FILL_LOCK_KEY_PREFIX}{short_code}", token, nx=True, px=int(CACHE_FILL_LOCK_TTL * 1000)
+    )
+    return token if acquired else None
+
+
+# Снимаем блокировку, только если она всё ещё наша (могла истечь и достаться другому воркеру)
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+async def release_fill_lock(short_code: str, token: str) -> None:
+    await redis_client.eval(_RELEASE_LOCK_SCRIPT, 1, f"{FILL_LOCK_KEY_PREFIX}{short_code}", token)  # type: ignore
+
+
+async def wait_for_cached_link(short_code: str) -> Optional[CachedLink]:
+    '''Ждёт, пока воркер, держащий блокировку, заполнит кэш; None, если не дождались'''
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + CACHE_FILL_MAX_WAIT
+    while loop.time() < deadline:
+        await asyncio.sleep(CACHE_FILL_POLL_INTERVAL)
+        cached_data = await redis_client.get(cache_key(short_code))
+        if cached_data:
+            return decode_cached_link(cached_data)
+    return None
+
+
+async def invalidate_cached_link(*short_codes: str) -> None:
+    '''Удаляет записи кэша для переданных коротких кодов во всех воркерах'''
+    if not short_codes:
+        return
+    for code in short_codes:
+        local_link_cache.delete(code)
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.delete(*(cache_key(code) for code in short_codes))
+        for code in short_codes:
+            pipe.publish(INVALIDATION_CHANNEL, code)
+        await pipe.execute()
+
+
+async def listen_for_link_invalidations() -> None:
+    '''Фоновая задача: удаляет из локального кэша коды, инвалидированные другими воркерами'''
+    await listen_for_invalidations(redis_client, INVALIDATION_CHANNEL, local_link_cache)
@@ -0,0 +1,76 @@
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+from config import CLICK_EVENTS_STREAM_MAXLEN
+from .analytics import CLICK_EVENTS_STREAM, click_event
+from src.redis_pool import redis_client
+
+# Все переходы накапливаются в одном хэше Redis: поле "c:<код>" хранит число
+# переходов, поле "t:<код>" – время последнего перехода (unix timestamp).
+# Один хэш позволяет атомарно забрать весь буфер командой RENAME при сбросе в базу.
+PENDING_CLICKS_KEY = "link_clicks:pending"
+FLUSHING_CLICKS_KEY = "link_clicks:flushing"
+# Идентификатор сброса буфера FLUSHING_CLICKS_KEY (см. ClickFlush)
+FLUSH_ID_KEY = "link_clicks:flush_id"
+
+COUNT_FIELD_PREFIX = "c:"
+LAST_USED_FIELD_PREFIX = "t:"
+
+
+async def record_click(
+    short_code: str,
+    referrer: Optional[str] = None,
+    user_agent: Optional[str] = None,
+) -> int:
+    '''Учитывает переход по ссылке в буфере Redis, возвращает число ещё не сброшенных переходов.
+
+    Событие перехода для аналитики добавляется в поток Redis в том же конвейере,
+    поэтому переход по-прежнему стоит одного обращения к Redis.
+    '''
+    now = datetime.now()
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.hincrby(PENDING_CLICKS_KEY, f"{COUNT_FIELD_PREFIX}{short_code}", 1)
+        pipe.hset(PENDING_CLICKS_KEY, f"{LAST_USED_FIELD_PREFIX}{short_code}", now.timestamp())
+        pipe.xadd(
+            CLICK_EVENTS_STREAM,
+            click_event(short_code, now, referrer, user_agent),  # type: ignore
+            maxlen=CLICK_EVENTS_STREAM_MAXLEN,
+            approximate=True,
+        )
+        pending_count, _, _ = await pipe.execute()
+    return int(pending_count)
+
+
+async def get_pending_clicks(short_code: str) -> Tuple[int, Optional[datetime]]:
+    '''Возвращает число переходов и время последнего перехода, ещё не записанные в базу'''
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for key in (PENDING_CLICKS_KEY, FLUSHING_CLICKS_KEY):
+            pipe.hmget(key, f"{COUNT_FIELD_PREFIX}{short_code}", f"{LAST_USED_FIELD_PREFIX}{short_code}")
+        results = await pipe.execute()
+
+    pending_count = 0
+    last_used = None
+    for count, timestamp in results:
+        if count:
+            pending_count += int(count)
+        if timestamp:
+            used_at = datetime.fromtimestamp(float(timestamp))
+            last_used = max(last_used, used_at) if last_used else used_at
+    return pending_count, last_used
+
+
+def parse_clicks_buffer(buffer: Dict[bytes, bytes]) -> Dict[str, Tuple[int, datetime]]:
+    '''Преобразует содержимое хэша буфера в словарь {код: (число переходов, последний переход)}'''
+    counts: Dict[str, int] = {}
+    timestamps: Dict[str, datetime] = {}
+    for raw_field, raw_value in buffer.items():
+        field = raw_field.decode() if isinstance(raw_field, bytes) else raw_field
+        if field.startswith(COUNT_FIELD_PREFIX):
+            counts[field[len(COUNT_FIELD_PREFIX):]] = int(raw_value)
+        elif field.startswith(LAST_USED_FIELD_PREFIX):
+            timestamps[field[len(LAST_USED_FIELD_PREFIX):]] = datetime.fromtimestamp(float(raw_value))
+
+    return {
+        short_code: (count, timestamps.get(short_code, datetime.now()))
+        for short_code, count in counts.items()
+        if count
+    }
@@ -0,0 +1,121 @@
+import asyncio
+import random
+import string
+from typing import List
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from config import SHORT_CODE_GENERATOR, SHORT_CODE_MIN_LENGTH, SHORT_CODE_BLOCK_SIZE
+from .models import SHORT_CODE_SEQUENCE
+
+BASE62_ALPHABET = string.digits + string.ascii_letters
+
+# Множитель перестановки: взаимно прост с 62 (нечётный и не делится на 31),
+# поэтому n -> n * MULTIPLIER mod 62^L – биекция на кодах длины L
+_PERMUTATION_MULTIPLIER = 0x5DEECE66D
+_PERMUTATION_INCREMENT = 0xB
+
+
+def base62_encode(number: int, length: int) -> str:
+    '''Кодирует неотрицательное число в base62, дополняя слева до length символов'''
+    chars = []
+    while number:
+        number, remainder = divmod(number, 62)
+        chars.append(BASE62_ALPHABET[remainder])
+    return ''.join(reversed(chars)).rjust(length, BASE62_ALPHABET[0])
+
+
+def counter_to_code(counter: int, min_length: int = SHORT_CODE_MIN_LENGTH) -> str:
+    '''Взаимно однозначно переводит номер кода в короткий код.
+
+    Первые 62^min_length номеров дают коды длины min_length, следующие 62^(min_length + 1) –
+    на символ длиннее и т.д. Внутри каждой длины номера перемешиваются, чтобы
+    соседние коды не были предсказуемыми.
+    '''
+    length = min_length
+    while counter >= 62 ** length:
+        counter -= 62 ** length
+        length += 1
+    space = 62 ** length
+    return base62_encode((counter * _PERMUTATION_MULTIPLIER + _PERMUTATION_INCREMENT) % space, length)
+
+
+# Генерация сокращённой ссылки
+def generate_short_url():
+    return ''.join(random.choices(string.ascii_letters + string.digits, k=6))
+
+
+class RandomCodeGenerator:
+    '''Случайные коды фиксированной длины; уникальность не гарантируется'''
+
+    async def next_code(self, session: AsyncSession) -> str:
+        return generate_short_url()
+
+    async def next_codes(self, session: AsyncSession, count: int) -> List[str]:
+        return [generate_short_url() for _ in range(count)]
+
+    async def discard_block(self) -> None:
+        pass
+
+
+class CounterCodeGenerator:
+    '''Коды из глобального счётчика – последовательности Postgres, выделяемой воркеру блоками.
+
+    Один nextval резервирует блок номеров, поэтому обращение к базе нужно раз в блок
+    созданных ссылок, а коды разных воркеров не пересекаются. Счётчик хранится вместе
+    с самими ссылками: перезапуск или очистка Redis не приводят к повторной выдаче кодов.
+    Последовательность создаёт create_links_db_and_tables; nextval выполняется в сессии
+    записи обработчика, поэтому тесты с подменённой сессией работают со своей базой.
+    '''
+
+    def __init__(self, block_size: int = SHORT_CODE_BLOCK_SIZE, min_length: int = SHORT_CODE_MIN_LENGTH):
+        self.block_size = block_size
+        self.min_length = min_length
+        self._next = 0
+        self._end = 0
+        self._lock = asyncio.Lock()
+
+    async def _next_block(self, session: AsyncSession) -> range:
+        statement = text(
+            f"SELECT nextval('{SHORT_CODE_SEQUENCE}'), "
+            f"(SELECT increment_by FROM pg_sequences WHERE sequencename = '{SHORT_CODE_SEQUENCE}')"
+        )
+        start, increment = (await session.execute(statement)).one()
+        # Размер блока берётся из самой последовательности: у всех воркеров он одинаковый
+        return range(start, start + increment)
+
+    async def _reserve(self, session: AsyncSession, count: int) -> range:
+        async with self._lock:
+            if self._next >= self._end:
+                block = await self._next_block(session)
+                self._next, self._end = block.start, block.stop
+            reserved = range(self._next, min(self._next + count, self._end))
+            self._next = reserved.stop
+            return reserved
+
+    async def discard_block(self) -> None:
+        '''Отказывается от остатка текущего блока: следующий код берётся из нового блока.
+
+        Вызывается, когда сгенерированный код оказался занят (кастомным alias или случайным
+        кодом, выданным до перехода на счётчик) – такие совпадения редки, и новый блок
+        дешевле, чем перебор соседних номеров.'''
+        async with self._lock:
+            self._next = self._end
+
+    async def next_code(self, session: AsyncSession) -> str:
+        counter = (await self._reserve(session, 1))[0]
+        return counter_to_code(counter, self.min_length)
+
+    async def next_codes(self, session: AsyncSession, count: int) -> List[str]:
+        codes: List[str] = []
+        while len(codes) < count:
+            reserved = await self._reserve(session, count - len(codes))
+            codes.extend(counter_to_code(counter, self.min_length) for counter in reserved)
+        return codes
+
+
+CODE_GENERATORS = {
+    "counter": CounterCodeGenerator,
+    "random": RandomCodeGenerator,
+}
+
+code_generator = CODE_GENERATORS[SHORT_CODE_GENERATOR]()
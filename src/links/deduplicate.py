@@ -0,0 +1,103 @@
+'''Разовая миграция: слияние ссылок, оригинальные URL которых совпадают после нормализации.
+
+Раньше уникальность держало ограничение на исходную строку original_link, теперь – индекс
+по хэшу нормализованного URL. Ссылки на "HTTP://A.com" и "http://a.com/" получают один хэш,
+и пока такие строки есть, upgrade_links_table не создаёт уникальный индекс.
+
+    python -m src.links.deduplicate            # только список совпадений
+    python -m src.links.deduplicate --merge    # слияние
+
+При слиянии остаётся самая старая ссылка группы; к ней прибавляются переходы остальных,
+остальные удаляются (их коды перестают перенаправлять). После слияния уникальный индекс
+создаётся при следующем запуске приложения.
+'''
+import argparse
+import itertools
+import sys
+from typing import List, Optional, Sequence, Tuple
+from sqlalchemy import delete, func, select, update
+from src.database import synchronized_engine
+from src.redis_pool import sync_redis_client
+from .cache import cache_key, INVALIDATION_CHANNEL
+from .models import Link
+from .response_cache import SEARCH_GENERATION_KEY, GENERATION_TTL, new_generation, stats_generation_key
+
+DUPLICATE_COLUMNS = (
+    Link.id, Link.original_link_hash, Link.shortened_link, Link.original_link,
+    Link.created_at, Link.last_used, Link.used_count,
+)
+
+
+def plan_merges(rows: Sequence) -> List[Tuple[object, List]]:
+    '''Группирует строки по original_link_hash: [(остающаяся строка, удаляемые строки)] для групп
+    из нескольких строк. Остаётся самая старая ссылка (created_at, затем id).'''
+    ordered = sorted(rows, key=lambda row: (row.original_link_hash, row.created_at, str(row.id)))
+    merges = []
+    for _, group in itertools.groupby(ordered, key=lambda row: row.original_link_hash):
+        survivor, *duplicates = group
+        if duplicates:
+            merges.append((survivor, duplicates))
+    return merges
+
+
+def find_duplicates(connection) -> List:
+    duplicated_hashes = (
+        select(Link.original_link_hash)
+        .group_by(Link.original_link_hash)
+        .having(func.count() > 1)
+    )
+    return connection.execute(
+        select(*DUPLICATE_COLUMNS).where(Link.original_link_hash.in_(duplicated_hashes))
+    ).all()
+
+
+def merge_group(connection, survivor, duplicates) -> None:
+    connection.execute(
+        update(Link)
+        .where(Link.id == survivor.id)
+        .values(
+            used_count=Link.used_count + sum(row.used_count for row in duplicates),
+            last_used=func.greatest(Link.last_used, max(row.last_used for row in duplicates)),
+        )
+    )
+    connection.execute(delete(Link).where(Link.id.in_([row.id for row in duplicates])))
+
+
+def invalidate(short_codes: List[str]) -> None:
+    '''Удалённые коды не должны перенаправлять из кэша, а поиск и статистика – показывать их'''
+    generation = new_generation()
+    with sync_redis_client.pipeline(transaction=False) as pipe:
+        pipe.delete(*(cache_key(code) for code in short_codes))
+        for code in short_codes:
+            pipe.publish(INVALIDATION_CHANNEL, code)
+            pipe.set(stats_generation_key(code), generation, ex=GENERATION_TTL)
+        pipe.set(SEARCH_GENERATION_KEY, generation, ex=GENERATION_TTL)
+        pipe.execute()
+
+
+def deduplicate(merge: bool = False) -> int:
+    '''Печатает группы совпадающих ссылок и с merge=True сливает каждую отдельной транзакцией;
+    возвращает число групп'''
+    with synchronized_engine.connect() as connection:
+        merges = plan_merges(find_duplicates(connection))
+    for survivor, duplicates in merges:
+        codes = ", ".join(row.shortened_link for row in duplicates)
+        print(f"{survivor.shortened_link} {survivor.original_link}: duplicated by {codes}", file=sys.stderr)
+        if merge:
+            with synchronized_engine.begin() as connection:
+                merge_group(connection, survivor, duplicates)
+            invalidate([row.shortened_link for row in duplicates])
+    action = "Merged" if merge else "Found"
+    print(f"{action} {len(merges)} groups of links with the same normalized URL", file=sys.stderr)
+    return len(merges)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Merge links whose original URLs are equal after normalization")
+    parser.add_argument("--merge", action="store_true", help="Merge the groups instead of only listing them")
+    args = parser.parse_args(argv)
+    deduplicate(args.merge)
+
+
+if __name__ == "__main__":
+    main()
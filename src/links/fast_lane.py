@@ -0,0 +1,85 @@
+import logging
+from urllib.parse import quote
+from .admission import hot_link_admission
+from .cache import get_cached_link
+from .clicks import record_click
+
+logger = logging.getLogger(__name__)
+
+PATH_PREFIX = "/links/"
+
+# GET-маршруты роутера ссылок с тем же шаблоном пути, что и перенаправление
+RESERVED_CODES = frozenset({"search", "mine", "export", "shorten"})
+
+# Ключ scope["state"], в котором быстрый путь передаёт redirect_to_original результат своего
+# обращения к кэшу (код, запись или None): обычный путь не повторяет его и не учитывает
+# промах в метриках CACHE_LOOKUPS второй раз
+CACHE_PROBE_STATE = "redirect_cache_probe"
+
+# Заголовки ответа, кроме Location, закодированы один раз
+_STATIC_HEADERS = [(b"content-length", b"0")]
+_EMPTY_BODY = {"type": "http.response.body", "body": b"", "more_body": False}
+
+
+class _Route:
+    '''Шаблон маршрута для MetricsMiddleware: запросы быстрого пути учитываются вместе с обычными'''
+    path = "/links/{short_code}"
+
+
+class RedirectFastLaneMiddleware:
+    '''ASGI middleware: перенаправление по коду, найденному в кэше, без маршрутизации FastAPI,
+    зависимостей и сессии базы данных.
+
+    Промах кэша, неизвестный или просроченный код и любая ошибка передаются дальше в
+    приложение, то есть в обычный redirect_to_original с его семантикой и ответами.
+    Результат обращения к кэшу передаётся туда же через scope["state"] (CACHE_PROBE_STATE).
+    '''
+
+    route = _Route()
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET" or not scope["path"].startswith(PATH_PREFIX):
+            await self.app(scope, receive, send)
+            return
+        short_code = scope["path"][len(PATH_PREFIX):]
+        if not short_code or "/" in short_code or short_code in RESERVED_CODES:
+            await self.app(scope, receive, send)
+            return
+
+        probe = None
+        try:
+            cached_link = await get_cached_link(short_code)
+            probe = (short_code, cached_link)
+            hit = cached_link is not None and not cached_link.is_missing() and not cached_link.is_expired()
+            if hit:
+                hot_link_admission.record(short_code)
+                headers = dict(scope["headers"])
+                referrer = headers.get(b"referer")
+                user_agent = headers.get(b"user-agent")
+                await record_click(
+                    short_code,
+                    referrer.decode("latin-1") if referrer else None,
+                    user_agent.decode("latin-1") if user_agent else None,
+                )
+        except Exception:
+            # Ошибка Redis: обычный путь вернёт ту же ошибку в принятом в API формате
+            logger.exception("Fast lane redirect failed, falling back: ")
+            hit = False
+        if not hit:
+            if probe is not None:
+                scope.setdefault("state", {})[CACHE_PROBE_STATE] = probe
+            await self.app(scope, receive, send)
+            return
+
+        scope["route"] = self.route
+        # То же кодирование Location, что и в starlette.responses.RedirectResponse
+        location = quote(cached_link.original_link, safe=":/%#?=@[]!$&'()*+,;").encode("latin-1")  # type: ignore
+        await send({
+            "type": "http.response.start",
+            "status": 307,
+            "headers": [(b"location", location), *_STATIC_HEADERS],
+        })
+        await send(_EMPTY_BODY)
@@ -0,0 +1,76 @@
+import base64
+import json
+import uuid
+from datetime import datetime
+from typing import AsyncIterator, Optional, Tuple
+from fastapi import HTTPException
+from sqlalchemy import Select, select, tuple_
+from config import MY_LINKS_STREAM_CHUNK_SIZE
+from src.database import read_session_maker
+from .models import Link
+from .schemas import LinkListItem
+
+SORT_COLUMNS = {"created_at": Link.created_at, "used_count": Link.used_count}
+
+# Колонки списка: без original_link_hash и прочего, чтобы строки оставались компактными
+LIST_COLUMNS = (
+    Link.id, Link.shortened_link, Link.original_link, Link.created_at,
+    Link.last_used, Link.used_count, Link.custom_alias, Link.expires_at,
+)
+
+
+def encode_cursor(sort: str, order: str, value, link_id: uuid.UUID) -> str:
+    '''Непрозрачный курсор: позиция последней отданной строки в порядке (колонка сортировки, id)'''
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    payload = json.dumps([sort, order, value, str(link_id)], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort: str, order: str) -> Tuple[object, uuid.UUID]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_sort, cursor_order, value, link_id = json.loads(base64.urlsafe_b64decode(padded))
+        if (cursor_sort, cursor_order) != (sort, order):
+            raise ValueError("cursor was issued for another sort order")
+        if sort == "created_at":
+            value = datetime.fromisoformat(value)
+        elif not isinstance(value, int):
+            raise ValueError("used_count cursor must be an integer")
+        return value, uuid.UUID(link_id)
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=422, detail=f"Invalid cursor: {e}")
+
+
+def user_links_query(user_id: uuid.UUID, sort: str, order: str, cursor: Optional[str]) -> Select:
+    '''Ссылки пользователя в порядке (sort, id) начиная после курсора.
+
+    Условие по курсору – сравнение кортежей, поэтому для created_at запрос идёт диапазоном
+    по индексу (user_id, created_at, id) и не зависит от номера страницы, в отличие от OFFSET.
+    Для used_count индекса нет (колонку постоянно обновляет сброс переходов): строки
+    пользователя выбираются по тому же индексу и сортируются, что ограничено числом его ссылок.
+    '''
+    column = SORT_COLUMNS[sort]
+    query = select(*LIST_COLUMNS).where(Link.user_id == user_id)
+    if cursor:
+        value, link_id = decode_cursor(cursor, sort, order)
+        position = tuple_(column, Link.id)
+        query = query.where(position < tuple_(value, link_id) if order == "desc" else position > tuple_(value, link_id))
+    if order == "desc":
+        return query.order_by(column.desc(), Link.id.desc())
+    return query.order_by(column.asc(), Link.id.asc())
+
+
+def next_cursor(row, sort: str, order: str) -> str:
+    return encode_cursor(sort, order, getattr(row, sort), row.id)
+
+
+async def stream_links_ndjson(query: Select) -> AsyncIterator[str]:
+    '''Отдаёт ссылки построчно в NDJSON через серверный курсор: память не растёт с числом ссылок.
+
+    Поток живёт дольше обработчика запроса, поэтому открывает собственную сессию чтения.
+    '''
+    async with read_session_maker() as session:
+        result = await session.stream(query.execution_options(yield_per=MY_LINKS_STREAM_CHUNK_SIZE))
+        async for rows in result.partitions():
+            yield "".join(LinkListItem.model_validate(row, from_attributes=True).model_dump_json() + "\n" for row in rows)
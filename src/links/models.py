@@ -1,29 +1,342 @@
+import logging
 import uuid
+from typing import Callable, List
 from sqlalchemy.orm import declarative_base
-from sqlalchemy import Column, Integer, DateTime, String, Boolean
+from sqlalchemy import Column, Integer, DateTime, String, Boolean, LargeBinary, Index, func, literal_column, select, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.dialects import postgresql
 from datetime import datetime
 from sqlalchemy.dialects.postgresql import UUID
 import test
 from src.database import engine
+from config import LINKS_PARTITIONS, SHORT_CODE_BLOCK_SIZE, SHORT_CODE_COUNTER_START
+from .urls import url_digest, domain_key
 import pytest
 
+logger = logging.getLogger(__name__)
+
 Base = declarative_base()
 
+# Длина начала original_link в индексе поиска по префиксу: btree не принимает ключи длиннее
+# ~2,7 КБ, а индекс по всей строке не давал бы вставить длинный URL
+PREFIX_INDEX_LENGTH = 255
+
+
+def original_link_prefix(column):
+    '''Выражение индекса ix_links_original_link_prefix: начало URL в нижнем регистре. Длина –
+    литерал, а не параметр, иначе выражение в запросе не совпадёт с выражением индекса'''
+    return func.lower(func.left(column, literal_column(str(PREFIX_INDEX_LENGTH))))
+
+
 class Link(Base):
     __tablename__ = "links"
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id = Column(UUID(as_uuid=True), nullable=True)
-    original_link = Column(String, unique=True, nullable=False)
+    original_link = Column(String, nullable=False)
+    # SHA-256 нормализованного original_link: уникальность и поиск по оригинальному URL
+    # идут по этому ключу фиксированной длины, а не по самой (неограниченной) строке
+    original_link_hash = Column(LargeBinary(32), unique=True, index=True, nullable=False)
+    # Хост original_link с метками в обратном порядке ("com.example.www."): поиск по домену
+    # и его поддоменам – поиск по префиксу этой колонки
+    original_domain = Column(String, nullable=False, default="")
     shortened_link = Column(String, unique=True, nullable=False)
     created_at = Column(DateTime, default=datetime.now, nullable=False)
     last_used = Column(DateTime, default=datetime.now, nullable=False)
     custom_alias = Column(Boolean, default=False)
     expires_at = Column(DateTime, nullable=True)
-    used_count = Column(Integer, default=1)
+    used_count = Column(Integer, default=1, nullable=False)
+
+    __table_args__ = (
+        # Частичный индекс только по ссылкам со сроком действия: по нему работает
+        # очистка просроченных ссылок, а бессрочные ссылки его не раздувают
+        Index("ix_links_expires_at", "expires_at", postgresql_where=text("expires_at IS NOT NULL")),
+        # Список ссылок пользователя с постраничной выдачей по ключу (сортировка, id)
+        # Индекса по (user_id, used_count) нет намеренно: used_count меняется при каждом сбросе
+        # переходов, и индекс по нему лишил бы эти UPDATE режима HOT (запись во все индексы)
+        Index("ix_links_user_created_at", "user_id", "created_at", "id"),
+        # Поиск по префиксу домена и URL: text_pattern_ops позволяет использовать btree для LIKE 'abc%'
+        Index("ix_links_original_domain", "original_domain", postgresql_ops={"original_domain": "text_pattern_ops"}),
+        Index(
+            "ix_links_original_link_prefix", original_link_prefix(original_link).label("original_link_prefix"),
+            postgresql_ops={"original_link_prefix": "text_pattern_ops"},
+        ),
+    )
+
+class LinkClickRollup(Base):
+    '''Предагрегированные счётчики переходов по часовым и дневным интервалам.
+
+    Первичный ключ начинается с (short_code, granularity, bucket_start), поэтому
+    статистика за период читается диапазоном по ключу за O(число интервалов).
+    '''
+    __tablename__ = "link_click_rollups"
+    short_code = Column(String, primary_key=True)
+    granularity = Column(String(8), primary_key=True)  # "hour" или "day"
+    bucket_start = Column(DateTime, primary_key=True)
+    dimension = Column(String(16), primary_key=True)  # "total", "referrer" или "agent"
+    value = Column(String, primary_key=True, default="")
+    clicks = Column(Integer, nullable=False, default=0)
+
+class ClickFlush(Base):
+    '''Сбросы буфера переходов, уже применённые к links.
+
+    Идентификатор сброса записывается в той же транзакции, что и счётчики: буфер, который
+    остался в Redis после сбоя между коммитом и его удалением, не применяется повторно.
+    '''
+    __tablename__ = "click_flushes"
+    flush_id = Column(String, primary_key=True)
+    flushed_at = Column(DateTime, default=datetime.now, nullable=False)
+
+# Размер пачки при заполнении новых вычисляемых колонок в существующей таблице
+BACKFILL_BATCH_SIZE = 1000
+
+def _add_computed_column(connection, column_name: str, column_type: str, compute: Callable[[str], object]) -> None:
+    '''Добавляет колонку, вычисляемую из original_link, заполняет её пачками и делает NOT NULL'''
+    nullable = connection.execute(text(
+        "SELECT is_nullable FROM information_schema.columns "
+        "WHERE table_name = 'links' AND column_name = :column"
+    ), {"column": column_name}).scalar_one_or_none()
+    if nullable is None:
+        connection.execute(text(f"ALTER TABLE links ADD COLUMN {column_name} {column_type}"))
+    if nullable == "NO":
+        return
+    table = Link.__table__
+    while True:
+        rows = connection.execute(
+            select(table.c.id, table.c.original_link)
+            .where(table.c[column_name].is_(None))
+            .limit(BACKFILL_BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        connection.execute(
+            text(f"UPDATE links SET {column_name} = :value WHERE id = :id"),
+            [{"id": row.id, "value": compute(row.original_link)} for row in rows],
+        )
+    connection.execute(text(f"ALTER TABLE links ALTER COLUMN {column_name} SET NOT NULL"))
+
+
+TRIGRAM_INDEX_NAME = "ix_links_original_link_trgm"
+
+
+def _create_trigram_index(connection, table: str = "links", suffix: str = "") -> None:
+    '''GIN-индекс по триграммам original_link для поиска подстроки; без расширения pg_trgm
+    (нет прав на CREATE EXTENSION) поиск подстроки недоступен, остальное работает'''
+    try:
+        with connection.begin_nested():
+            connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    except DBAPIError:
+        logger.warning("pg_trgm is not available, substring search will not be indexed")
+        return
+    connection.execute(text(
+        f"CREATE INDEX IF NOT EXISTS {TRIGRAM_INDEX_NAME}{suffix} ON {table} USING gin (original_link gin_trgm_ops)"
+    ))
+
+
+# Секционированная таблица links (LINKS_PARTITIONS > 0 или src.links.partitioning).
+# Уникальный индекс секционированной таблицы обязан включать ключ секционирования, поэтому
+# уникальность original_link_hash держит таблица-страж и триггеры на links
+ORIGINAL_HASH_GUARD_TABLE = "link_original_hashes"
+
+# Хэш свободен – занимаем его. Занят – ждём транзакцию, которая его заняла, и проверяем
+# саму таблицу: хэш мог осиротеть (строка не вставилась из-за конфликта по коду, секция
+# удалена целиком). Если ссылка с этим хэшем есть, строка пропускается (RETURN NULL) –
+# так же, как INSERT ... ON CONFLICT DO NOTHING пропускает её для уникального индекса
+_GUARD_INSERT_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION link_original_hash_insert() RETURNS trigger LANGUAGE plpgsql AS $$
+DECLARE
+    taken boolean;
+BEGIN
+    INSERT INTO {ORIGINAL_HASH_GUARD_TABLE} (original_link_hash) VALUES (NEW.original_link_hash)
+    ON CONFLICT DO NOTHING;
+    IF FOUND THEN
+        RETURN NEW;
+    END IF;
+    PERFORM 1 FROM {ORIGINAL_HASH_GUARD_TABLE} WHERE original_link_hash = NEW.original_link_hash FOR UPDATE;
+    EXECUTE 'SELECT EXISTS (SELECT 1 FROM ' || CAST(pg_partition_root(TG_RELID) AS text) || ' WHERE original_link_hash = $1)'
+    INTO taken USING NEW.original_link_hash;
+    IF taken THEN
+        RETURN NULL;
+    END IF;
+    RETURN NEW;
+END $$
+"""
+
+_GUARD_DELETE_FUNCTION = f"""
+CREATE OR REPLACE FUNCTION link_original_hash_delete() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    DELETE FROM {ORIGINAL_HASH_GUARD_TABLE} WHERE original_link_hash = OLD.original_link_hash;
+    RETURN NULL;
+END $$
+"""
+
+# UPDATE ключа секционирования перенёс бы строку в другую секцию в обход стража;
+# код ссылки меняется через DELETE и INSERT (src.links.partitioning.rename_short_code)
+_FORBID_KEY_UPDATE_FUNCTION = """
+CREATE OR REPLACE FUNCTION links_forbid_key_update() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    RAISE EXCEPTION 'shortened_link and original_link_hash of a partitioned links table are changed by DELETE and INSERT';
+END $$
+"""
+
+
+def partitioned_links_ddl(table: str, partitions: int) -> List[str]:
+    '''CREATE TABLE для таблицы с колонками модели Link, секционированной по хэшу shortened_link, и её секций'''
+    dialect = postgresql.dialect()
+    columns = ",\n    ".join(
+        f"{column.name} {column.type.compile(dialect=dialect)}{'' if column.nullable else ' NOT NULL'}"
+        for column in Link.__table__.columns
+    )
+    statements = [
+        f"CREATE TABLE {table} (\n    {columns},\n    PRIMARY KEY (id, shortened_link),\n"
+        f"    UNIQUE (shortened_link)\n) PARTITION BY HASH (shortened_link)"
+    ]
+    statements += [
+        f"CREATE TABLE {table}_p{remainder} PARTITION OF {table} "
+        f"FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder})"
+        for remainder in range(partitions)
+    ]
+    return statements
+
+
+def partitioned_index_ddl(table: str, suffix: str = "") -> List[str]:
+    '''CREATE INDEX для индексов модели Link на секционированной таблице; индекс по
+    original_link_hash неуникальный – уникальность держит таблица-страж'''
+    statements = []
+    for index in sorted(Link.__table__.indexes, key=lambda index: index.name):
+        ddl = str(CreateIndex(index).compile(dialect=postgresql.dialect())).replace("CREATE UNIQUE INDEX", "CREATE INDEX", 1)
+        statements.append(ddl.replace(f" {index.name} ON links ", f" IF NOT EXISTS {index.name}{suffix} ON {table} ", 1))
+    return statements
+
+
+def original_hash_guard_ddl(table: str) -> List[str]:
+    '''Таблица-страж и триггеры уникальности original_link_hash для секционированной таблицы'''
+    return [
+        f"CREATE TABLE IF NOT EXISTS {ORIGINAL_HASH_GUARD_TABLE} (original_link_hash BYTEA PRIMARY KEY)",
+        _GUARD_INSERT_FUNCTION,
+        _GUARD_DELETE_FUNCTION,
+        _FORBID_KEY_UPDATE_FUNCTION,
+        f"CREATE TRIGGER links_original_hash_insert BEFORE INSERT ON {table} "
+        f"FOR EACH ROW EXECUTE FUNCTION link_original_hash_insert()",
+        f"CREATE TRIGGER links_original_hash_delete AFTER DELETE ON {table} "
+        f"FOR EACH ROW EXECUTE FUNCTION link_original_hash_delete()",
+        f"CREATE TRIGGER links_forbid_key_update BEFORE UPDATE OF shortened_link, original_link_hash ON {table} "
+        f"FOR EACH ROW WHEN (OLD.shortened_link IS DISTINCT FROM NEW.shortened_link "
+        f"OR OLD.original_link_hash IS DISTINCT FROM NEW.original_link_hash) "
+        f"EXECUTE FUNCTION links_forbid_key_update()",
+    ]
+
+
+def is_partitioned(connection, table: str = "links") -> bool:
+    return connection.execute(
+        text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:table)"), {"table": table}
+    ).scalar_one_or_none() is True
+
+
+def create_partitioned_links_table(connection, partitions: int, table: str = "links", suffix: str = "") -> bool:
+    '''Создаёт секционированную таблицу с индексами и стражем уникальности, если её ещё нет.
+    suffix добавляется к именам индексов (таблица-копия при миграции, см. src.links.partitioning)'''
+    if connection.execute(text("SELECT to_regclass(:table)"), {"table": table}).scalar_one_or_none():
+        return False
+    for statement in partitioned_links_ddl(table, partitions) + partitioned_index_ddl(table, suffix) + original_hash_guard_ddl(table):
+        connection.execute(text(statement))
+    _create_trigram_index(connection, table, suffix)
+    return True
+
+
+def _create_unique_hash_index(connection) -> bool:
+    '''Создаёт уникальный индекс по original_link_hash, если его ещё нет; False, если мешают дубликаты.
+
+    Прежнее ограничение уникальности было по исходной строке, а хэш считается по
+    нормализованному URL: строки, отличающиеся только нормализацией ("HTTP://A.com" и
+    "http://a.com/"), получают одинаковый хэш. Их слияние – отдельная разовая миграция
+    (python -m src.links.deduplicate), а не DDL при каждом запуске приложения, поэтому
+    до неё индекс не создаётся, а старое ограничение остаётся.
+    '''
+    exists = connection.execute(text(
+        "SELECT 1 FROM pg_indexes WHERE tablename = 'links' AND indexname = 'ix_links_original_link_hash'"
+    )).scalar_one_or_none()
+    if exists:
+        return True
+    duplicates = connection.execute(text(
+        "SELECT count(*) FROM (SELECT 1 FROM links GROUP BY original_link_hash HAVING count(*) > 1) AS groups"
+    )).scalar_one()
+    if duplicates:
+        logger.error(
+            f"{duplicates} original URLs are stored more than once after normalization; "
+            f"ix_links_original_link_hash is not created until they are merged: "
+            f"python -m src.links.deduplicate --merge"
+        )
+        return False
+    connection.execute(text("CREATE UNIQUE INDEX ix_links_original_link_hash ON links (original_link_hash)"))
+    return True
+
+
+def upgrade_links_table(connection) -> None:
+    '''Доводит существующую таблицу links до текущей модели (create_all не меняет существующие таблицы)'''
+    _add_computed_column(connection, "original_link_hash", "BYTEA", url_digest)
+    _add_computed_column(connection, "original_domain", "VARCHAR", domain_key)
+    # В секционированной таблице индекс по хэшу неуникальный (см. original_hash_guard_ddl)
+    partitioned = is_partitioned(connection)
+    hash_index_ready = partitioned or _create_unique_hash_index(connection)
+    if partitioned:
+        connection.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_links_original_link_hash ON links (original_link_hash)"
+        ))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_links_expires_at ON links (expires_at) WHERE expires_at IS NOT NULL"
+    ))
+    # Сортировка по used_count в списке ссылок требует значения в каждой строке
+    used_count_nullable = connection.execute(text(
+        "SELECT is_nullable FROM information_schema.columns "
+        "WHERE table_name = 'links' AND column_name = 'used_count'"
+    )).scalar_one()
+    if used_count_nullable != "NO":
+        connection.execute(text("UPDATE links SET used_count = 1 WHERE used_count IS NULL"))
+        connection.execute(text("ALTER TABLE links ALTER COLUMN used_count SET NOT NULL"))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_links_user_created_at ON links (user_id, created_at, id)"
+    ))
+    connection.execute(text("DROP INDEX IF EXISTS ix_links_user_used_count"))
+    connection.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_links_original_domain ON links (original_domain text_pattern_ops)"
+    ))
+    # Прежний индекс по всей строке original_link заменяется индексом по её началу
+    prefix_index = connection.execute(text(
+        "SELECT indexdef FROM pg_indexes WHERE tablename = 'links' AND indexname = 'ix_links_original_link_prefix'"
+    )).scalar_one_or_none()
+    if prefix_index is not None and "lower(" not in prefix_index:
+        connection.execute(text("DROP INDEX ix_links_original_link_prefix"))
+    connection.execute(text(
+        f"CREATE INDEX IF NOT EXISTS ix_links_original_link_prefix "
+        f"ON links (lower(left(original_link, {PREFIX_INDEX_LENGTH})) text_pattern_ops)"
+    ))
+    _create_trigram_index(connection)
+    # Уникальный btree по самой строке original_link больше не нужен – но только когда
+    # уникальность уже держит индекс по хэшу
+    if hash_index_ready:
+        connection.execute(text("ALTER TABLE links DROP CONSTRAINT IF EXISTS links_original_link_key"))
     
+# Последовательность Postgres, из которой генератор кодов выделяет блоки номеров (см. codegen)
+SHORT_CODE_SEQUENCE = "short_code_counter"
+
+
+def short_code_sequence_ddl(start: int = SHORT_CODE_COUNTER_START, block_size: int = SHORT_CODE_BLOCK_SIZE) -> str:
+    '''Шаг последовательности – размер блока; у существующей последовательности он не меняется'''
+    return (
+        f"CREATE SEQUENCE IF NOT EXISTS {SHORT_CODE_SEQUENCE} MINVALUE 0 "
+        f"START WITH {start} INCREMENT BY {block_size}"
+    )
+
+
 async def create_links_db_and_tables():
     async with engine.begin() as conn:
+        if LINKS_PARTITIONS:
+            # create_all не создаёт секционированные таблицы; существующую таблицу не трогаем
+            await conn.run_sync(create_partitioned_links_table, LINKS_PARTITIONS)
         await conn.run_sync(Link.metadata.create_all)
+        await conn.run_sync(upgrade_links_table)
+        await conn.execute(text(short_code_sequence_ddl()))
         
 
     
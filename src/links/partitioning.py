@@ -0,0 +1,194 @@
+'''Перевод существующей таблицы links в секционированную по хэшу shortened_link без остановки.
+
+    python -m src.links.partitioning prepare --partitions 16
+    python -m src.links.partitioning copy --checkpoint links_partitioning.ckpt
+    python -m src.links.partitioning swap
+
+prepare создаёт таблицу links_partitioned (индексы с суффиксом _new) и триггер на links,
+который повторяет в ней каждое изменение. copy переносит существующие строки пачками в
+порядке id, каждая пачка – отдельная короткая транзакция; строки пачки блокируются FOR SHARE,
+чтобы их изменение не разошлось с копией. swap под короткой блокировкой переименовывает
+таблицы и индексы: links становится links_unpartitioned (её можно удалить после проверки).
+'''
+import argparse
+import sys
+import time
+from typing import List, Optional, Tuple
+from sqlalchemy import delete, insert, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.database import synchronized_engine
+from .models import Link, TRIGRAM_INDEX_NAME, create_partitioned_links_table, is_partitioned
+from .transfer import load_checkpoint, save_checkpoint
+
+SOURCE_TABLE = "links"
+TARGET_TABLE = "links_partitioned"
+RETIRED_TABLE = "links_unpartitioned"
+# Суффикс имён индексов новой таблицы до переключения: имена индексов уникальны в схеме
+NEW_INDEX_SUFFIX = "_new"
+MIRROR_TRIGGER = "links_mirror_to_partitioned"
+
+COLUMNS = [column.name for column in Link.__table__.columns]
+INDEX_NAMES = sorted(index.name for index in Link.__table__.indexes) + [TRIGRAM_INDEX_NAME]
+
+# Пачка строк, копируемая одной транзакцией
+DEFAULT_CHUNK_SIZE = 5000
+MIN_UUID = "00000000-0000-0000-0000-000000000000"
+
+
+def mirror_function_ddl(target: str = TARGET_TABLE) -> str:
+    '''Триггерная функция, повторяющая изменения links в новой таблице.
+
+    Строка, которую ещё не скопировали, не обновляется (UPDATE не находит её) – её
+    позже перенесёт copy уже с новыми значениями. Смена кода или URL – DELETE и INSERT,
+    так как в новой таблице это ключ секционирования и уникальность через стража.
+    '''
+    columns = ", ".join(COLUMNS)
+    new_values = ", ".join(f"NEW.{column}" for column in COLUMNS)
+    return f"""
+CREATE OR REPLACE FUNCTION {MIRROR_TRIGGER}() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND OLD.shortened_link = NEW.shortened_link AND OLD.original_link_hash = NEW.original_link_hash THEN
+        UPDATE {target} SET ({columns}) = ({new_values})
+        WHERE shortened_link = OLD.shortened_link AND id = OLD.id;
+        RETURN NULL;
+    END IF;
+    IF TG_OP <> 'INSERT' THEN
+        DELETE FROM {target} WHERE shortened_link = OLD.shortened_link AND id = OLD.id;
+    END IF;
+    IF TG_OP <> 'DELETE' THEN
+        INSERT INTO {target} ({columns}) VALUES ({new_values}) ON CONFLICT DO NOTHING;
+    END IF;
+    RETURN NULL;
+END $$
+"""
+
+
+def prepare(partitions: int) -> None:
+    '''Создаёт секционированную копию и включает зеркалирование изменений – одной транзакцией,
+    поэтому ни одно изменение links не проходит мимо и триггера, и последующего копирования'''
+    with synchronized_engine.begin() as connection:
+        if is_partitioned(connection, SOURCE_TABLE):
+            raise SystemExit("links is already partitioned")
+        create_partitioned_links_table(connection, partitions, TARGET_TABLE, NEW_INDEX_SUFFIX)
+        connection.execute(text(mirror_function_ddl()))
+        connection.execute(text(f"DROP TRIGGER IF EXISTS {MIRROR_TRIGGER} ON {SOURCE_TABLE}"))
+        connection.execute(text(
+            f"CREATE TRIGGER {MIRROR_TRIGGER} AFTER INSERT OR UPDATE OR DELETE ON {SOURCE_TABLE} "
+            f"FOR EACH ROW EXECUTE FUNCTION {MIRROR_TRIGGER}()"
+        ))
+    print(f"Created {TARGET_TABLE} with {partitions} partitions, mirroring changes from {SOURCE_TABLE}", file=sys.stderr)
+
+
+def copy_chunk(connection, after_id: str, chunk_size: int) -> Optional[Tuple[str, int]]:
+    '''Копирует следующую пачку строк после after_id; возвращает (id последней строки, число строк) или None в конце'''
+    ids = connection.execute(
+        text(f"SELECT id FROM {SOURCE_TABLE} WHERE id > CAST(:after AS uuid) ORDER BY id LIMIT :limit FOR SHARE"),
+        {"after": after_id, "limit": chunk_size},
+    ).scalars().all()
+    if not ids:
+        return None
+    columns = ", ".join(COLUMNS)
+    # Строки, уже попавшие в новую таблицу через триггер, пропускаются по конфликту
+    connection.execute(
+        text(
+            f"INSERT INTO {TARGET_TABLE} ({columns}) SELECT {columns} FROM {SOURCE_TABLE} "
+            f"WHERE id > CAST(:after AS uuid) AND id <= CAST(:last AS uuid) ON CONFLICT DO NOTHING"
+        ),
+        {"after": after_id, "last": str(ids[-1])},
+    )
+    return str(ids[-1]), len(ids)
+
+
+def copy_rows(chunk_size: int = DEFAULT_CHUNK_SIZE, checkpoint_path: Optional[str] = None, pause: float = 0.0) -> int:
+    '''Переносит строки links в новую таблицу пачками; с checkpoint_path продолжает с последней пачки.
+    pause – пауза между пачками, чтобы копирование не вытесняло рабочую нагрузку.'''
+    state = load_checkpoint(checkpoint_path)
+    after_id = state.get("after_id", MIN_UUID)
+    started = time.monotonic()
+    while True:
+        with synchronized_engine.begin() as connection:
+            chunk = copy_chunk(connection, after_id, chunk_size)
+        if chunk is None:
+            break
+        after_id, rows = chunk
+        state["rows"] += rows
+        state["after_id"] = after_id
+        save_checkpoint(checkpoint_path, state)
+        if pause:
+            time.sleep(pause)
+
+    with synchronized_engine.connect() as connection:
+        source_rows = connection.execute(text(f"SELECT count(*) FROM {SOURCE_TABLE}")).scalar_one()
+        target_rows = connection.execute(text(f"SELECT count(*) FROM {TARGET_TABLE}")).scalar_one()
+    elapsed = time.monotonic() - started
+    print(f"Copied up to {after_id} in {elapsed:.1f}s: {SOURCE_TABLE} has {source_rows} rows, "
+          f"{TARGET_TABLE} has {target_rows}", file=sys.stderr)
+    return target_rows
+
+
+def swap_statements(partitions: List[str]) -> List[str]:
+    statements = [
+        f"DROP TRIGGER {MIRROR_TRIGGER} ON {SOURCE_TABLE}",
+        f"ALTER TABLE {SOURCE_TABLE} RENAME TO {RETIRED_TABLE}",
+    ]
+    statements += [f"ALTER INDEX IF EXISTS {name} RENAME TO {name}_unpartitioned" for name in INDEX_NAMES]
+    statements.append(f"ALTER TABLE {TARGET_TABLE} RENAME TO {SOURCE_TABLE}")
+    statements += [f"ALTER INDEX IF EXISTS {name}{NEW_INDEX_SUFFIX} RENAME TO {name}" for name in INDEX_NAMES]
+    statements += [
+        f"ALTER TABLE {partition} RENAME TO {SOURCE_TABLE}{partition[len(TARGET_TABLE):]}"
+        for partition in partitions
+    ]
+    return statements
+
+
+def swap(lock_timeout: str = "5s") -> None:
+    '''Переключает приложение на новую таблицу. Блокировка links держится только на время
+    переименований; если её не удалось взять за lock_timeout, ничего не меняется'''
+    with synchronized_engine.begin() as connection:
+        connection.execute(text(f"SET LOCAL lock_timeout = '{lock_timeout}'"))
+        connection.execute(text(f"LOCK TABLE {SOURCE_TABLE}, {TARGET_TABLE} IN ACCESS EXCLUSIVE MODE"))
+        partitions = connection.execute(text(
+            "SELECT CAST(CAST(inhrelid AS regclass) AS text) FROM pg_inherits "
+            "WHERE inhparent = CAST(:table AS regclass) ORDER BY 1"
+        ), {"table": TARGET_TABLE}).scalars().all()
+        for statement in swap_statements(partitions):
+            connection.execute(text(statement))
+    print(f"{SOURCE_TABLE} is now partitioned; the old table is kept as {RETIRED_TABLE}", file=sys.stderr)
+
+
+async def rename_short_code(session: AsyncSession, link: Link, short_code: str) -> None:
+    '''Меняет код ссылки через DELETE и INSERT вместо UPDATE: в секционированной таблице код –
+    ключ секционирования, и строка переходит в другую секцию (см. links_forbid_key_update).
+    Оба запроса ищут строку по коду, поэтому затрагивают одну секцию.'''
+    values = {column.name: getattr(link, column.key) for column in Link.__table__.columns}
+    values["shortened_link"] = short_code
+    await session.execute(delete(Link).where(Link.shortened_link == link.shortened_link))
+    await session.execute(insert(Link).values(**values))
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Move the links table to hash partitions online")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    prepare_parser = commands.add_parser("prepare")
+    prepare_parser.add_argument("--partitions", type=int, required=True)
+
+    copy_parser = commands.add_parser("copy")
+    copy_parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    copy_parser.add_argument("--checkpoint", help="Progress file for resuming an interrupted copy")
+    copy_parser.add_argument("--pause", type=float, default=0.0, help="Seconds to sleep between chunks")
+
+    swap_parser = commands.add_parser("swap")
+    swap_parser.add_argument("--lock-timeout", default="5s")
+
+    args = parser.parse_args(argv)
+    if args.command == "prepare":
+        prepare(args.partitions)
+    elif args.command == "copy":
+        copy_rows(args.chunk_size, args.checkpoint, args.pause)
+    else:
+        swap(args.lock_timeout)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+'''Кэш ответов поиска и статистики в бэкенде FastAPICache и условные GET (ETag/304).
+
+Ответы не удаляются по одному: ключ записи включает поколение, и запись устаревает,
+когда поколение меняется. Поколение поиска общее (новая или изменённая ссылка может
+попасть в любую выдачу), поколение статистики – своё у каждого кода. Поколения
+меняют обработчики записи и задачи Celery, сбрасывающие переходы и агрегаты.
+'''
+import hashlib
+import json
+import time
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Dict, Optional
+from fastapi import Request, Response
+from fastapi_cache import FastAPICache
+from config import RESPONSE_CACHE_TTL
+from src.redis_pool import redis_client
+
+SEARCH_GENERATION_KEY = "response_cache:search_generation"
+STATS_GENERATION_PREFIX = "response_cache:stats_generation:"
+
+# Ключ поколения живёт дольше любой записи, выданной при нём: когда он истекает и
+# поколение читается как "0", записей со старыми поколениями уже нет
+GENERATION_TTL = RESPONSE_CACHE_TTL * 2
+
+
+def stats_generation_key(short_code: str) -> str:
+    return f"{STATS_GENERATION_PREFIX}{short_code}"
+
+
+def new_generation() -> int:
+    '''Поколение – время в наносекундах, а не INCR: после истечения ключа поколения
+    значения не повторяются и не совпадают с ключами ещё живых записей'''
+    return time.time_ns()
+
+
+def _backend():
+    try:
+        return FastAPICache.get_backend()
+    except AssertionError:
+        # FastAPICache не инициализирован (приложение запущено без lifespan) – без кэша
+        return None
+
+
+async def _generation(key: str) -> str:
+    value = await redis_client.get(key)
+    return value.decode() if value else "0"
+
+
+async def search_cache_key(mode: str, value: str, limit: int, offset: int) -> str:
+    generation = await _generation(SEARCH_GENERATION_KEY)
+    digest = hashlib.sha1(value.encode()).hexdigest()
+    return f"{FastAPICache.get_prefix()}:search:{generation}:{mode}:{limit}:{offset}:{digest}"
+
+
+async def stats_cache_key(short_code: str, granularity, start, end) -> str:
+    generation = await _generation(stats_generation_key(short_code))
+    period = ":".join(value.isoformat() if value else "" for value in (start, end))
+    return f"{FastAPICache.get_prefix()}:stats:{short_code}:{generation}:{granularity or ''}:{period}"
+
+
+async def bump_search_generation() -> None:
+    await redis_client.set(SEARCH_GENERATION_KEY, new_generation(), ex=GENERATION_TTL)
+
+
+async def bump_stats_generation(*short_codes: str) -> None:
+    if not short_codes:
+        return
+    generation = new_generation()
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for short_code in short_codes:
+            pipe.set(stats_generation_key(short_code), generation, ex=GENERATION_TTL)
+        await pipe.execute()
+
+
+async def load_cached(key: str) -> Optional[Dict[str, Any]]:
+    backend = _backend()
+    if backend is None:
+        return None
+    value = await backend.get(key)
+    return json.loads(value) if value else None
+
+
+async def store_cached(key: str, entry: Dict[str, Any]) -> None:
+    backend = _backend()
+    if backend is not None:
+        await backend.set(key, dump_json(entry).encode(), expire=RESPONSE_CACHE_TTL)
+
+
+def dump_json(content: Any) -> str:
+    '''Сериализация, как у JSONResponse FastAPI: тело ответа из кэша совпадает с обычным'''
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":"))
+
+
+def compute_etag(body: bytes) -> str:
+    return f'W/"{hashlib.sha1(body).hexdigest()}"'
+
+
+def http_date(moment: datetime) -> str:
+    # Наивное время в базе – локальное время сервера (datetime.now())
+    return format_datetime(moment.astimezone(timezone.utc).replace(microsecond=0), usegmt=True)
+
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[datetime]) -> bool:
+    '''Проверка условного GET: If-None-Match имеет приоритет над If-Modified-Since (RFC 9110)'''
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or etag.removeprefix("W/") in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        return last_modified.astimezone(timezone.utc).replace(microsecond=0) <= since
+    return False
+
+
+def conditional_response(request: Request, body: str, last_modified: Optional[datetime] = None) -> Response:
+    '''JSON-ответ с ETag и Last-Modified; 304 без тела, если у клиента актуальная версия'''
+    content = body.encode()
+    etag = compute_etag(content)
+    # no-cache: клиент может хранить ответ, но перепроверяет его условным запросом
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    if is_not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+    return Response(content=content, media_type="application/json", headers=headers)
@@ -1,22 +1,45 @@
 from math import e
 from os import replace
 from urllib import response
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query
-from src.database import get_async_session
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Request, Response
+from src.database import get_read_session, get_write_session, async_session_maker, read_session_maker, READ_FROM_REPLICA
 from sqlalchemy.ext.asyncio import AsyncSession
-from fastapi.responses import RedirectResponse
-from typing import Optional, List
-from sqlalchemy import select, insert, delete, update
+from fastapi.responses import RedirectResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
+from typing import Optional, List, Literal
+from sqlalchemy import select, delete, or_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+import uuid
 from datetime import datetime
-from .schemas import LinkCreate, LinkResponse
+from .schemas import LinkCreate, LinkResponse, LinkBatchResult, LinkListItem, LinkPage
 from .models import Link
-import random
-import string
 from celery import Celery
-from redis.asyncio import Redis
-import json 
+from .codegen import code_generator, generate_short_url
+from .batch import read_batch_items, create_links_batch
+from .urls import url_digest
+from .listing import user_links_query, next_cursor, stream_links_ndjson
+from .transfer import export_links, MEDIA_TYPES
+from .search import search_query
+from .partitioning import rename_short_code
+from .cache import (
+    CachedLink, MISSING_LINK, cache_link, get_cached_link, invalidate_cached_link,
+    cache_missing_link, forget_missing_links, acquire_fill_lock, release_fill_lock, wait_for_cached_link,
+)
+from .admission import hot_link_admission
+from .fast_lane import CACHE_PROBE_STATE
+from .clicks import record_click, get_pending_clicks
+from .analytics import get_click_histogram, to_local_naive, DEFAULT_HISTOGRAM_PERIOD
+from .response_cache import (
+    search_cache_key, stats_cache_key, load_cached, store_cached, dump_json, conditional_response,
+    bump_search_generation, bump_stats_generation,
+)
+from .write_behind import (
+    RESERVED, reserve_link, enqueue_link, get_reserved_link, link_creation_status, queue_stats,
+)
+from src.single_flight import SingleFlight
 from auth.db import User
 from auth.users import current_active_user, get_optional_current_user
+from config import WRITE_BEHIND_ENABLED, MY_LINKS_PAGE_SIZE, MY_LINKS_MAX_PAGE_SIZE, SEARCH_PAGE_SIZE, SEARCH_MAX_PAGE_SIZE, SEARCH_MAX_OFFSET
 
 app = FastAPI()
 
@@ -26,72 +49,96 @@ router = APIRouter(
     tags=["Links"]
 )
 
-redis_client = Redis(host='localhost', port=6379, db=1)
+# Сколько раз пробуем вставить ссылку со следующим сгенерированным кодом,
+# если код уже занят кастомным alias
+SHORT_CODE_MAX_ATTEMPTS = 3
 
-# Генерация сокращённой ссылки
-def generate_short_url():
-    return ''.join(random.choices(string.ascii_letters + string.digits, k=6))
+# Одновременные промахи кэша по одному коду в воркере выполняют один запрос к базе
+link_lookups = SingleFlight()
 
 @router.post("/shorten")
 async def shorten_url(
     original_link: str, 
-    session: AsyncSession = Depends(get_async_session),
+    response: Response,
+    session: AsyncSession = Depends(get_write_session),
     custom_alias: Optional[str] = None,
     expires_at: Optional[datetime] = None,
     user: Optional[User] = Depends(get_optional_current_user)  # опционально получаем авторизованного пользователя
 ):
     try:
-        #проверяем, есть ли оригинальная ссылка в базе данных
-        query = select(Link).where(Link.original_link == original_link)
-        result = await session.execute(query)
-        original_url_existing = result.scalar_one_or_none()
-        
-        if original_url_existing:
-            # Если оригинальная ссылка уже есть в базе данных, возвращаем существующую укороченную ссылку
-            raise HTTPException(
-                status_code=409,
-                detail={
-                    "status": "error",
-                    "error": {
-                        "message": "Short code already exists",
-                        "short_code": original_url_existing.shortened_link
-                    }
-                }
+        # Ссылка добавляется одним INSERT ... ON CONFLICT DO NOTHING RETURNING: проверки
+        # уникальности оригинального URL и короткого кода выполняет сама база по своим
+        # уникальным ограничениям, поэтому между проверкой и вставкой нет окна для гонки.
+        # Сгенерированные коды уникальны по построению; конфликт по коду возможен только
+        # с ранее заданным кастомным alias или старым случайным кодом – тогда берём следующий код
+        for _ in range(SHORT_CODE_MAX_ATTEMPTS):
+            short_url = custom_alias or await code_generator.next_code(session)
+            
+            # пока только 1 версия схемы данных для добавления для гостей 
+            new_link = LinkCreate(
+                user_id=user.id if user else None,
+                original_link=original_link, 
+                shortened_link=short_url,
+                custom_alias=True if custom_alias else False,
+                expires_at=expires_at.replace(second=0,microsecond=0) if expires_at else None
             )
             
-        if custom_alias:
-            short_url = custom_alias
-        else:
-            # Проверяем, содержится сгенерированная укороченная ссылка в таблице links
-            short_url = generate_short_url()
-        query = select(Link).where(Link.shortened_link == short_url)
-        result = await session.execute(query)
-        
-        existing = result.scalar_one_or_none()
-        while existing:
+            if WRITE_BEHIND_ENABLED:
+                # Отложенная запись: код и URL резервируются в Redis, в базу ссылку
+                # запишет задача persist_queued_links
+                reservation, existing_short_code = await reserve_link(session, new_link)
+                if reservation == RESERVED:
+                    await enqueue_link(new_link)
+                    break
+            else:
+                # Добавляем новую ссылку в базу данных
+                statement = (
+                    pg_insert(Link)
+                    .values(**new_link.model_dump())
+                    .on_conflict_do_nothing()
+                    .returning(Link.shortened_link)
+                )
+                result = await session.execute(statement)
+                inserted = result.scalar_one_or_none()
+                await session.commit()
+                if inserted:
+                    break
+                
+                # Вставка не произошла – выясняем, какое ограничение сработало
+                query = select(Link.original_link_hash, Link.shortened_link).where(
+                    or_(Link.original_link_hash == new_link.original_link_hash, Link.shortened_link == short_url)
+                )
+                conflicts = (await session.execute(query)).all()
+                existing_short_code = next(
+                    (row.shortened_link for row in conflicts if row.original_link_hash == new_link.original_link_hash), None
+                )
+            if existing_short_code:
+                # Если оригинальная ссылка уже есть в базе данных, возвращаем существующую укороченную ссылку
+                raise HTTPException(
+                    status_code=409,
+                    detail={
+                        "status": "error",
+                        "error": {
+                            "message": "Short code already exists",
+                            "short_code": existing_short_code
+                        }
+                    }
+                )
             if custom_alias:
                 raise HTTPException(status_code=409, detail="Custom alias provided already exists")
-            short_url = generate_short_url()
-            query = select(Link).where(Link.shortened_link == short_url)
-            result = await session.execute(query)
-            existing = result.scalar_one_or_none()
-
+            # Сгенерированный код занят – берём код из следующего блока, а не соседний
+            await code_generator.discard_block()
+        else:
+            raise HTTPException(status_code=503, detail="Could not allocate a free short code")
         
+        if WRITE_BEHIND_ENABLED:
+            # Ссылка уже в кэше и перенаправляет; запись в базу – GET /links/shorten/status/{short_code}
+            response.status_code = 202
+            return {"status": "queued", "short_url": short_url}
         
-        # пока только 1 версия схемы данных для добавления для гостей 
-        new_link = LinkCreate(
-            user_id=user.id if user else None,
-            original_link=original_link, 
-            shortened_link=short_url,
-            custom_alias=True if custom_alias else False,
-            expires_at=expires_at.replace(second=0,microsecond=0) if expires_at else None
-        )
-        
-        # Добавляем новую ссылку в базу данных
-        new_link_dict = new_link.model_dump()
-        statement = insert(Link).values(**new_link_dict)
-        await session.execute(statement)
-        await session.commit()
+        # Код мог быть запрошен до создания – убираем отрицательную запись кэша
+        await forget_missing_links(short_url)
+        await bump_search_generation()
         
         return {"status": "success", "short_url": short_url}
     except HTTPException as e:
@@ -102,31 +149,95 @@ async def shorten_url(
             "error": str(e)
         })
 
+@router.post("/shorten/batch", response_model=List[LinkBatchResult])
+async def shorten_urls_batch(
+    request: Request,
+    session: AsyncSession = Depends(get_write_session),
+    user: Optional[User] = Depends(get_optional_current_user)  # опционально получаем авторизованного пользователя
+):
+    '''Пакетное создание ссылок из JSON-массива или NDJSON элементов {original_link, custom_alias, expires_at}'''
+    try:
+        parsed_items = await read_batch_items(request)
+        results = await create_links_batch(session, parsed_items, user.id if user else None)
+        await forget_missing_links(*(result.short_url for result in results if result.status == "created"))  # type: ignore
+        await bump_search_generation()
+        return results
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail={
+            "status": "error",
+            "error": str(e)
+        })
+
+@router.get("/shorten/queue")
+async def get_write_queue_stats():
+    '''Состояние очереди отложенной записи ссылок'''
+    try:
+        return await queue_stats()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail={
+            "status": "error",
+            "error": str(e)
+        })
+
+@router.get("/shorten/status/{short_code}")
+async def get_creation_status(short_code: str, session: AsyncSession = Depends(get_read_session)):
+    '''Записана ли в базу ссылка, созданная в режиме отложенной записи'''
+    try:
+        status = await link_creation_status(short_code)
+        if status is not None:
+            return status
+        query = select(Link.id).where(Link.shortened_link == short_code)
+        if (await session.execute(query)).first() is None:
+            raise HTTPException(status_code=404, detail="Short code not found")
+        return {"status": "persisted"}
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail={
+            "status": "error",
+            "error": str(e)
+        })
+
 @router.get("/search", response_model=List[LinkResponse])
 async def search_links(
+    request: Request,
     original_url: str = Query(..., description="Оригинальный URL для поиска"),
-    session: AsyncSession = Depends(get_async_session)
+    mode: Literal["exact", "prefix", "domain", "substring"] = Query(
+        "exact", description="exact – точное совпадение, prefix – URL начинается с, domain – домен и поддомены, substring – подстрока"
+    ),
+    limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=SEARCH_MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0, le=SEARCH_MAX_OFFSET),
+    session: AsyncSession = Depends(get_read_session)
 ):
     try:
-        '''Поиск укороченных ссылок по оригинальному URL'''
-        query = select(Link).where(Link.original_link == original_url)
-        result = await session.execute(query)
-        links = result.scalars().all()
+        '''Поиск укороченных ссылок по оригинальному URL: результаты ранжированы и выдаются постранично'''
+        # Выдача кэшируется целиком (включая пустую) до смены поколения поиска
+        cache_key = await search_cache_key(mode, original_url, limit, offset)
+        cached = await load_cached(cache_key)
+        if cached is None:
+            query = search_query(mode, original_url).limit(limit).offset(offset)
+            result = await session.execute(query)
+            links = result.scalars().all()
+            
+            link_responses = [
+                LinkResponse(
+                    original_link=link.original_link,
+                    shortened_link=link.shortened_link,
+                    last_used=link.last_used,
+                    custom_alias=link.custom_alias
+                )
+                for link in links
+            ]
+            cached = {"body": dump_json(jsonable_encoder(link_responses)), "built_at": datetime.now().isoformat()}
+            await store_cached(cache_key, cached)
         
-        if not links:
+        if cached["body"] == "[]":
             raise HTTPException(status_code=404, detail="No records found with the provided original URL") 
         
-        link_responses = [
-            LinkResponse(
-                original_link=link.original_link,
-                shortened_link=link.shortened_link,
-                last_used=link.last_used,
-                custom_alias=link.custom_alias
-            )
-            for link in links
-        ]
-        
-        return link_responses
+        # Last-Modified – момент построения выдачи: раньше неё данные не менялись
+        return conditional_response(request, cached["body"], datetime.fromisoformat(cached["built_at"]))
     
     except HTTPException as e:
         raise e
@@ -137,7 +248,53 @@ async def search_links(
             detail=str(e)
         )
     
-async def get_link_by_short_code(short_code: str, session: AsyncSession = Depends(get_async_session)) -> Link:
+@router.get("/mine", response_model=LinkPage)
+async def list_my_links(
+    sort: Literal["created_at", "used_count"] = "created_at",
+    order: Literal["desc", "asc"] = "desc",
+    limit: int = Query(MY_LINKS_PAGE_SIZE, ge=1, le=MY_LINKS_MAX_PAGE_SIZE),
+    cursor: Optional[str] = Query(None, description="next_cursor из предыдущей страницы"),
+    format: Literal["json", "ndjson"] = Query("json", description="ndjson – все ссылки от курсора потоком"),
+    user: User = Depends(current_active_user),
+    session: AsyncSession = Depends(get_read_session)
+):
+    '''Ссылки текущего пользователя с постраничной выдачей по курсору (keyset pagination)'''
+    try:
+        query = user_links_query(user.id, sort, order, cursor)
+        if format == "ndjson":
+            return StreamingResponse(stream_links_ndjson(query), media_type="application/x-ndjson")
+        
+        # Берём на одну строку больше страницы: так без COUNT понятно, есть ли следующая
+        rows = (await session.execute(query.limit(limit + 1))).all()
+        page = rows[:limit]
+        return LinkPage(
+            items=[LinkListItem.model_validate(row, from_attributes=True) for row in page],
+            next_cursor=next_cursor(page[-1], sort, order) if len(rows) > limit else None,
+        )
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        raise HTTPException(status_code=500, detail={
+            "status": "error",
+            "error": str(e)
+        })
+
+@router.get("/export")
+async def export_all_links(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    after_id: Optional[uuid.UUID] = Query(None, description="Продолжить выгрузку после этого id"),
+    user: User = Depends(current_active_user)
+):
+    '''Потоковая выгрузка всей таблицы ссылок в порядке id (только для суперпользователей)'''
+    if not user.is_superuser:
+        raise HTTPException(status_code=403, detail="Export is available to superusers only")
+    return StreamingResponse(
+        export_links(format, after_id),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="links.{format}"'},
+    )
+
+async def get_link_by_short_code(short_code: str, session: AsyncSession = Depends(get_read_session)) -> Link:
     try:
         '''Получение объекта ссылки по укороченному коду'''
         query = select(Link).where(Link.shortened_link == short_code)
@@ -157,47 +314,82 @@ async def get_link_by_short_code(short_code: str, session: AsyncSession = Depend
             "error": str(e)
         })
 
+async def load_link(short_code: str, fill_cache: bool) -> CachedLink:
+    '''Загружает ссылку из базы при промахе кэша.
+
+    Если ссылку нужно положить в кэш, загрузку координирует блокировка в Redis: пока
+    один воркер читает базу, остальные ждут появления записи в кэше. Отсутствующий
+    код запоминается отрицательной записью.
+
+    Загрузку разделяют одновременные запросы (link_lookups), поэтому она открывает свою
+    сессию, а не использует сессию первого из них: та закрывается вместе с его запросом.
+    '''
+    lock_token = await acquire_fill_lock(short_code) if fill_cache else None
+    if fill_cache and lock_token is None:
+        cached_link = await wait_for_cached_link(short_code)
+        if cached_link is not None:
+            return cached_link
+    try:
+        query = select(Link).where(Link.shortened_link == short_code)
+        async with read_session_maker() as session:
+            link = (await session.execute(query)).scalar_one_or_none()
+        if link is None and READ_FROM_REPLICA:
+            # Реплика может ещё не получить только что созданную ссылку: прежде чем
+            # запомнить код отсутствующим, проверяем основной сервер
+            async with async_session_maker() as primary_session:
+                link = (await primary_session.execute(query)).scalar_one_or_none()
+        if link is None:
+            # Ссылка могла быть создана, но ещё не записана в базу из очереди
+            reserved_link = await get_reserved_link(short_code) if WRITE_BEHIND_ENABLED else None
+            if reserved_link is not None:
+                return reserved_link
+            await cache_missing_link(short_code)
+            return MISSING_LINK
+        if fill_cache:
+            await cache_link(link)
+        return CachedLink(link.original_link, link.expires_at)  # type: ignore
+    finally:
+        if lock_token:
+            await release_fill_lock(short_code, lock_token)
+
 @router.get("/{short_code}")
 async def redirect_to_original(
     short_code: str, 
-    session: AsyncSession = Depends(get_async_session)
+    request: Request,
 ):
     '''Перенаправление на оригинальную ссылку'''
     try:
-        # Получаем объект ссылки для обновления счётчика
-        original_link_object = await get_link_by_short_code(short_code, session)
+        # Учитываем переход в скетче частот: по нему решается, допускать ли ссылку в кэш
+        hot_link_admission.record(short_code)
         
-        # Увеличиваем счётчик использования и обновляем время последнего использования
-        original_link_object.used_count += 1 #type: ignore
-        original_link_object.last_used = datetime.now() #type: ignore
-        await session.commit()
-        
-        # Сначала пытаемся получить кэшированные данные из Redis
-        cached_data = await redis_client.get(f"cached_link:{short_code}")
-        if cached_data:
-            data = json.loads(cached_data)
-            """#Выводим оригинальный URL из кэша для Swagger UI
-            return {
-                "status": "success",
-                "original_link": data["original_link"],
-                "cached": True
-            }"""
-            #делаем редирект по оригинальному URL из кэша (работает в клиенте браузера)
-            return RedirectResponse(url=data["original_link"])
+        # Сначала пытаемся получить оригинальный URL из кэша Redis:
+        # при попадании в кэш запрос не обращается к базе данных вовсе.
+        # Если кэш уже проверил быстрый путь (REDIRECT_FAST_LANE), берём его результат
+        probe = getattr(request.state, CACHE_PROBE_STATE, None)
+        if probe is not None and probe[0] == short_code:
+            cached_link = probe[1]
+        else:
+            cached_link = await get_cached_link(short_code)
+        if cached_link is None:
+            # Кэш не найден – читаем базу. Если ссылку недавно часто открывали, она
+            # попадёт в кэш Redis; одновременные промахи по коду объединяются в один запрос
+            fill_cache = hot_link_admission.should_admit(short_code)
+            cached_link = await link_lookups.do(short_code, lambda: load_link(short_code, fill_cache))
         
-        # Если кэш не найден – редирект по оригинальному URL из базы
-        original_url = original_link_object.original_link
+        if cached_link.is_missing():
+            raise HTTPException(status_code=404, detail="Short code not found")
+        # Запись кэша хранит срок действия ссылки, поэтому просроченная ссылка
+        # отклоняется сразу, не дожидаясь очистки и без запроса к базе
+        if cached_link.is_expired():
+            raise HTTPException(status_code=404, detail="Short code has expired")
         
-        # если used_count равен 5, сохранить данные в кэш Redis
-        if original_link_object.used_count == 5: #type: ignore
-            data = {
-                "original_link": original_link_object.original_link,
-                "shortened_link": original_link_object.shortened_link,
-                "cached_at": datetime.now().isoformat()
-            }
-            redis_client.set(f"cached_link:{short_code}", json.dumps(data))
+        # Счётчик использования и время последнего использования не обновляются в строке
+        # links на каждый переход: переход попадает в буфер Redis, который периодически
+        # сбрасывает в базу задача flush_click_counters
+        await record_click(short_code, request.headers.get("referer"), request.headers.get("user-agent"))
         
-        return RedirectResponse(url=original_url) #type: ignore
+        #делаем редирект по оригинальному URL (работает в клиенте браузера)
+        return RedirectResponse(url=cached_link.original_link)  # type: ignore
     
     except HTTPException as e:
         raise e
@@ -211,17 +403,19 @@ async def redirect_to_original(
 async def delete_short_code(
     short_code: str,
     user: User = Depends(current_active_user),  # только зарегистрированные пользователи могут удалять ссылки
-    original_link_object = Depends(get_link_by_short_code), 
-    session: AsyncSession = Depends(get_async_session)
+    session: AsyncSession = Depends(get_write_session)
 ):
     try:
-        # Удаляем запись по полю shortened_link, полученному из зависимости
+        # Ссылку ищем на основном сервере: на отстающей реплике её может ещё не быть
+        original_link_object = await get_link_by_short_code(short_code, session)
         query = delete(Link).where(Link.shortened_link == original_link_object.shortened_link)
         await session.execute(query)
         await session.commit()
         
-        # Чистим кэш для данного short_code
-        await redis_client.delete(f"cached_link:{short_code}")
+        # Чистим кэш для данного short_code и кэшированные ответы поиска и статистики
+        await invalidate_cached_link(short_code)
+        await bump_search_generation()
+        await bump_stats_generation(short_code)
         
         return {"status": "success"}
     
@@ -239,7 +433,7 @@ async def update_short_code(
     original_url: str, 
     short_code: str,
     user: User = Depends(current_active_user),# только зарегистрированные пользователи могут удалять ссылки
-    session: AsyncSession = Depends(get_async_session)
+    session: AsyncSession = Depends(get_write_session)
 ):
     try:
         # проверяем, есть ли укороченная ссылка в базе данных
@@ -250,19 +444,22 @@ async def update_short_code(
         if existing: # если укороченная ссылка уже существует
             raise HTTPException(status_code=409, detail="Short code already exists")
         #проверяем, есть ли оригинальная ссылка в базе данных
-        query = select(Link).where(Link.original_link == original_url)
+        query = select(Link).where(Link.original_link_hash == url_digest(original_url))
         result = await session.execute(query)
         original_url_existing = result.scalar_one_or_none()
         
         if not original_url_existing: 
             raise HTTPException(status_code=404, detail="Original URL provided not found")
+        previous_short_code = original_url_existing.shortened_link
         
-        query = update(Link).where(Link.original_link == original_url).values(shortened_link=short_code)
-        await session.execute(query)
+        await rename_short_code(session, original_url_existing, short_code)
         await session.commit()
         
-        # Чистим кэш для данного short_code
-        await redis_client.delete(f"cached_link:{short_code}")
+        # Чистим кэш для старого и нового short_code: иначе старый код
+        # продолжил бы перенаправлять из кэша, минуя базу данных
+        await invalidate_cached_link(previous_short_code, short_code) #type: ignore
+        await bump_search_generation()
+        await bump_stats_generation(previous_short_code, short_code) #type: ignore
         
         return {"status": "success"}
 
@@ -278,15 +475,49 @@ async def update_short_code(
 @router.get("/{short_code}/stats")
 async def get_stats(
     short_code: str,
-    original_link_object = Depends(get_link_by_short_code)
+    request: Request,
+    session: AsyncSession = Depends(get_read_session),
+    from_: Optional[datetime] = Query(None, alias="from", description="Начало периода гистограммы"),
+    to: Optional[datetime] = Query(None, description="Конец периода гистограммы"),
+    granularity: Optional[Literal["hour", "day"]] = Query(None, description="Шаг гистограммы")
 ):
     '''Получение статистики переходов по ссылке'''
-    return {
-        "original_link": original_link_object.original_link,
-        "created_at": original_link_object.created_at,
-        "used_count": original_link_object.used_count,
-        "last_used": original_link_object.last_used
-    }
+    # Наивное и "осведомлённое" время нельзя сравнивать: период приводится к времени базы
+    from_, to = to_local_naive(from_), to_local_naive(to)
+    # Значения из базы кэшируются до смены поколения кода: его меняют изменение и удаление
+    # ссылки, сброс переходов в базу и свёртка событий в агрегаты
+    cache_key = await stats_cache_key(short_code, granularity, from_, to)
+    stats = await load_cached(cache_key)
+    if stats is None:
+        original_link_object = await get_link_by_short_code(short_code, session)
+        stats = {
+            "original_link": original_link_object.original_link,
+            "created_at": original_link_object.created_at,
+            "used_count": original_link_object.used_count,
+            "last_used": original_link_object.last_used
+        }
+        
+        # Гистограмма строится по предагрегированным интервалам, только если её запросили
+        if granularity or from_ or to:
+            granularity = granularity or "hour"
+            end = to or datetime.now()
+            start = from_ or end - DEFAULT_HISTOGRAM_PERIOD[granularity]
+            if start > end:
+                raise HTTPException(status_code=422, detail="'from' must not be later than 'to'")
+            stats["analytics"] = await get_click_histogram(session, short_code, granularity, start, end)
+        stats = jsonable_encoder(stats)
+        await store_cached(cache_key, stats)
+    
+    # Добавляем к значениям из базы переходы, ещё не сброшенные из буфера: они не кэшируются
+    pending_count, pending_last_used = await get_pending_clicks(short_code)
+    last_used = datetime.fromisoformat(stats["last_used"])
+    if pending_last_used and pending_last_used > last_used:
+        last_used = pending_last_used
+    stats["used_count"] += pending_count
+    stats["last_used"] = last_used.isoformat()
+    
+    # Статистика меняется только с новыми переходами, поэтому Last-Modified – время последнего
+    return conditional_response(request, dump_json(stats), last_used)
 
 # Подключаем роутер к приложению
 app.include_router(router)
\ No newline at end of file
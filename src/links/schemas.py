@@ -1,7 +1,8 @@
 import uuid
 from datetime import datetime
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field, model_validator
+from typing import List, Optional
+from .urls import url_digest, domain_key
 
     
 class LinkCreate(BaseModel):
@@ -9,14 +10,56 @@ class LinkCreate(BaseModel):
     user_id: Optional[uuid.UUID] = None  # для гостей - будет сохраняться как NULL
     original_link: str
     shortened_link: str
-    created_at: datetime = datetime.now()
-    last_used: datetime = datetime.now()
+    created_at: datetime = Field(default_factory=datetime.now)
+    last_used: datetime = Field(default_factory=datetime.now)
     custom_alias: bool = False
     expires_at: Optional[datetime] = None
     used_count: int = 1
+    original_link_hash: Optional[bytes] = None  # вычисляется из original_link
+    original_domain: Optional[str] = None  # вычисляется из original_link
+    
+    @model_validator(mode="after")
+    def fill_original_link_hash(self):
+        if self.original_link_hash is None:
+            self.original_link_hash = url_digest(self.original_link)
+        if self.original_domain is None:
+            self.original_domain = domain_key(self.original_link)
+        return self
     
 class LinkResponse(BaseModel):
     original_link: str
     shortened_link: str
     last_used: datetime
-    custom_alias: Optional[bool] = False
\ No newline at end of file
+    custom_alias: Optional[bool] = False
+
+class LinkBatchItem(BaseModel):
+    '''Элемент пакетного создания ссылок'''
+    original_link: str
+    custom_alias: Optional[str] = None
+    expires_at: Optional[datetime] = None
+
+
+class LinkBatchResult(BaseModel):
+    '''Результат создания одной ссылки из пакета (в порядке элементов запроса)'''
+    index: int
+    original_link: Optional[str] = None
+    status: str  # "created", "conflict" или "invalid"
+    short_url: Optional[str] = None
+    detail: Optional[str] = None
+
+
+class LinkListItem(BaseModel):
+    '''Ссылка в списке ссылок пользователя'''
+    shortened_link: str
+    original_link: str
+    created_at: datetime
+    last_used: datetime
+    used_count: Optional[int] = None
+    custom_alias: Optional[bool] = False
+    expires_at: Optional[datetime] = None
+
+
+class LinkPage(BaseModel):
+    '''Страница списка ссылок; next_cursor передаётся в следующий запрос, None – страниц больше нет'''
+    items: List[LinkListItem]
+    next_cursor: Optional[str] = None
@@ -0,0 +1,66 @@
+from typing import List
+from fastapi import HTTPException
+from sqlalchemy import ColumnElement, Select, and_, func, or_, select
+from .models import Link, PREFIX_INDEX_LENGTH, original_link_prefix
+from .urls import domain_key, url_digest
+
+# Триграммный индекс не помогает для строк короче трёх символов
+SUBSTRING_MIN_LENGTH = 3
+
+
+def escape_like(value: str) -> str:
+    '''Экранирует служебные символы LIKE (экранирующий символ по умолчанию – обратная косая черта)'''
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def prefix_candidates(value: str) -> List[str]:
+    '''Префиксы URL для поиска: схема и хост в нижнем регистре; без схемы в запросе ищем
+    и по https://, и по http://'''
+    value = value.strip()
+    urls = [value] if "://" in value else [f"https://{value}", f"http://{value}"]
+    candidates = []
+    for url in urls:
+        scheme, _, rest = url.partition("://")
+        host, slash, path = rest.partition("/")
+        candidates.append(f"{scheme.lower()}://{host.lower()}{slash}{path}")
+    return candidates
+
+
+def prefix_condition(prefix: str) -> ColumnElement[bool]:
+    '''URL начинается с prefix без учёта регистра: ссылки хранятся в том виде, в каком их
+    прислали, и хост в них может быть в любом регистре. Индекс покрывает первые
+    PREFIX_INDEX_LENGTH символов, более длинный префикс дополнительно проверяется целиком'''
+    head = prefix[:PREFIX_INDEX_LENGTH].lower()
+    condition = original_link_prefix(Link.original_link).like(escape_like(head) + "%")
+    if len(prefix) > PREFIX_INDEX_LENGTH:
+        condition = and_(condition, Link.original_link.ilike(escape_like(prefix) + "%"))
+    return condition
+
+
+def search_query(mode: str, value: str) -> Select:
+    '''Запрос поиска ссылок в заданном режиме, упорядоченный по релевантности.
+
+    exact – по хэшу нормализованного URL (уникальный индекс);
+    prefix – LIKE 'префикс%' без учёта регистра по индексу начала original_link;
+    domain – домен и его поддомены, LIKE 'com.example.%' по индексу original_domain;
+    substring – ILIKE '%подстрока%' по GIN-индексу pg_trgm, ранжирование по similarity.
+    '''
+    query = select(Link)
+    if mode == "exact":
+        return query.where(Link.original_link_hash == url_digest(value))
+    if mode == "prefix":
+        condition = or_(*(prefix_condition(prefix) for prefix in prefix_candidates(value)))
+        return query.where(condition).order_by(Link.used_count.desc(), Link.id)
+    if mode == "domain":
+        key = domain_key(value)
+        if not key:
+            raise HTTPException(status_code=422, detail="Could not parse a domain from the query")
+        return query.where(Link.original_domain.like(escape_like(key) + "%")).order_by(Link.used_count.desc(), Link.id)
+    if len(value) < SUBSTRING_MIN_LENGTH:
+        raise HTTPException(
+            status_code=422, detail=f"Substring search needs at least {SUBSTRING_MIN_LENGTH} characters"
+        )
+    return (
+        query.where(Link.original_link.ilike("%" + escape_like(value) + "%"))
+        .order_by(func.similarity(Link.original_link, value).desc(), Link.used_count.desc(), Link.id)
+    )
@@ -0,0 +1,247 @@
+'''Потоковая выгрузка и загрузка таблицы links (NDJSON или CSV).
+
+Выгрузка идёт серверным курсором пачками, загрузка – через COPY во временную таблицу
+и INSERT ... ON CONFLICT DO NOTHING, поэтому память не зависит от числа строк.
+
+    python -m src.links.transfer export --format ndjson --output links.ndjson
+    python -m src.links.transfer import --input links.ndjson --checkpoint links.ckpt --warm-top 1000
+'''
+import argparse
+import asyncio
+import csv
+import io
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
+from sqlalchemy import select
+from config import DB_USER, DB_PASS, DB_HOST, DB_PORT, DB_NAME, TRANSFER_CHUNK_SIZE, TRANSFER_STREAM_CHUNK_SIZE
+from src.database import read_session_maker
+from .cache import invalidate_cached_link
+from .models import Link
+from .response_cache import bump_search_generation
+from .urls import url_digest, domain_key
+from .warmup import warm_top_links
+
+# Колонки выгрузки; original_link_hash и original_domain не выгружаются и вычисляются заново при загрузке
+EXPORT_COLUMNS = (
+    "id", "user_id", "original_link", "shortened_link", "created_at",
+    "last_used", "custom_alias", "expires_at", "used_count",
+)
+IMPORT_COLUMNS = EXPORT_COLUMNS + ("original_link_hash", "original_domain")
+FORMATS = ("ndjson", "csv")
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def _export_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, uuid.UUID):
+        return str(value)
+    return value
+
+
+def format_rows(rows, fmt: str) -> str:
+    '''Пачка строк выгрузки в NDJSON или CSV (без заголовка)'''
+    if fmt == "ndjson":
+        return "".join(
+            json.dumps({column: _export_value(getattr(row, column)) for column in EXPORT_COLUMNS}) + "\n"
+            for row in rows
+        )
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(["" if getattr(row, column) is None else _export_value(getattr(row, column))
+                         for column in EXPORT_COLUMNS])
+    return buffer.getvalue()
+
+
+async def export_links(fmt: str, after_id: Optional[uuid.UUID] = None) -> AsyncIterator[str]:
+    '''Выгружает ссылки в порядке id серверным курсором; after_id продолжает прерванную выгрузку.
+
+    Генератор открывает собственную сессию чтения, так как живёт дольше обработчика запроса.
+    '''
+    if fmt == "csv":
+        yield ",".join(EXPORT_COLUMNS) + "\r\n"
+    query = select(*(getattr(Link, column) for column in EXPORT_COLUMNS)).order_by(Link.id)
+    if after_id is not None:
+        query = query.where(Link.id > after_id)
+    async with read_session_maker() as session:
+        result = await session.stream(query.execution_options(yield_per=TRANSFER_STREAM_CHUNK_SIZE))
+        async for rows in result.partitions():
+            yield format_rows(rows, fmt)
+
+
+def _parse_datetime(value) -> Optional[datetime]:
+    return datetime.fromisoformat(value) if value else None
+
+
+def _parse_bool(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ("true", "1", "t", "yes")
+
+
+def row_to_record(row: Dict) -> Tuple:
+    '''Строка выгрузки (из NDJSON или CSV) -> кортеж значений в порядке IMPORT_COLUMNS для COPY'''
+    now = datetime.now()
+    return (
+        uuid.UUID(row["id"]) if row.get("id") else uuid.uuid4(),
+        uuid.UUID(row["user_id"]) if row.get("user_id") else None,
+        row["original_link"],
+        row["shortened_link"],
+        _parse_datetime(row.get("created_at")) or now,
+        _parse_datetime(row.get("last_used")) or now,
+        _parse_bool(row.get("custom_alias") or False),
+        _parse_datetime(row.get("expires_at")),
+        int(row.get("used_count") or 1),
+        url_digest(row["original_link"]),
+        domain_key(row["original_link"]),
+    )
+
+
+def read_rows(path: str, fmt: str) -> Iterator[Dict]:
+    '''Читает файл выгрузки построчно'''
+    with open(path, newline="") as source:
+        if fmt == "csv":
+            yield from csv.DictReader(source)
+        else:
+            for line in source:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def load_checkpoint(path: Optional[str]) -> Dict[str, int]:
+    if path and os.path.exists(path):
+        with open(path) as checkpoint:
+            return json.load(checkpoint)
+    return {"rows": 0, "inserted": 0, "skipped": 0}
+
+
+def save_checkpoint(path: Optional[str], state: Dict[str, int]) -> None:
+    '''Сохраняет прогресс атомарно: при сбое файл содержит последнее подтверждённое состояние'''
+    if not path:
+        return
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as checkpoint:
+        json.dump(state, checkpoint)
+    os.replace(temporary, path)
+
+
+async def copy_chunk(connection, records: List[Tuple]) -> List[str]:
+    '''Загружает пачку через COPY во временную таблицу и переносит в links, пропуская конфликты.
+
+    ON CONFLICT DO NOTHING без цели пропускает строки, конфликтующие по любому уникальному
+    ключу: shortened_link, original_link_hash или id. Возвращает коды вставленных строк.
+    '''
+    columns = ", ".join(IMPORT_COLUMNS)
+    async with connection.transaction():
+        await connection.execute(
+            "CREATE TEMP TABLE links_import (LIKE links INCLUDING DEFAULTS) ON COMMIT DROP"
+        )
+        await connection.copy_records_to_table("links_import", records=records, columns=list(IMPORT_COLUMNS))
+        rows = await connection.fetch(
+            f"INSERT INTO links ({columns}) SELECT {columns} FROM links_import ON CONFLICT DO NOTHING "
+            f"RETURNING shortened_link"
+        )
+    return [row["shortened_link"] for row in rows]
+
+
+async def import_chunk(connection, records: List[Tuple]) -> int:
+    '''Загружает пачку и сбрасывает кэши, которые могли запомнить её коды: отрицательные записи
+    (код запрашивали до загрузки) и ответы поиска. Возвращает число вставленных строк.'''
+    short_codes = await copy_chunk(connection, records)
+    if short_codes:
+        await invalidate_cached_link(*short_codes)
+        await bump_search_generation()
+    return len(short_codes)
+
+
+async def import_links(
+    path: str,
+    fmt: str,
+    chunk_size: int = TRANSFER_CHUNK_SIZE,
+    checkpoint_path: Optional[str] = None,
+) -> Dict[str, int]:
+    '''Загружает файл выгрузки пачками; с checkpoint_path продолжает с последней подтверждённой пачки.
+
+    Пачка и запись checkpoint не атомарны, но повтор пачки безопасен: уже вставленные
+    строки пропускаются по конфликту.
+    '''
+    import asyncpg
+
+    state = load_checkpoint(checkpoint_path)
+    connection = await asyncpg.connect(
+        user=DB_USER, password=DB_PASS, host=DB_HOST, port=DB_PORT, database=DB_NAME
+    )
+    started = time.monotonic()
+    try:
+        records: List[Tuple] = []
+        for position, row in enumerate(read_rows(path, fmt)):
+            if position < state["rows"]:
+                continue
+            records.append(row_to_record(row))
+            if len(records) >= chunk_size:
+                inserted = await import_chunk(connection, records)
+                state = {"rows": position + 1, "inserted": state["inserted"] + inserted,
+                         "skipped": state["skipped"] + len(records) - inserted}
+                save_checkpoint(checkpoint_path, state)
+                records = []
+        if records:
+            inserted = await import_chunk(connection, records)
+            state = {"rows": state["rows"] + len(records), "inserted": state["inserted"] + inserted,
+                     "skipped": state["skipped"] + len(records) - inserted}
+            save_checkpoint(checkpoint_path, state)
+    finally:
+        await connection.close()
+    elapsed = time.monotonic() - started
+    print(f"Imported {state['inserted']} links, skipped {state['skipped']} conflicts in {elapsed:.1f}s",
+          file=sys.stderr)
+    return state
+
+
+async def _export_to_file(fmt: str, output: Optional[str], after_id: Optional[uuid.UUID]) -> None:
+    target = open(output, "w", newline="") if output else sys.stdout
+    try:
+        async for chunk in export_links(fmt, after_id):
+            target.write(chunk)
+    finally:
+        if output:
+            target.close()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Export and import the links table")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export")
+    export_parser.add_argument("--format", choices=FORMATS, default="ndjson")
+    export_parser.add_argument("--output", help="File to write; stdout by default")
+    export_parser.add_argument("--after-id", type=uuid.UUID, help="Resume after this link id")
+
+    import_parser = commands.add_parser("import")
+    import_parser.add_argument("--input", required=True)
+    import_parser.add_argument("--format", choices=FORMATS, default="ndjson")
+    import_parser.add_argument("--chunk-size", type=int, default=TRANSFER_CHUNK_SIZE)
+    import_parser.add_argument("--checkpoint", help="Progress file for resuming an interrupted import")
+    import_parser.add_argument("--warm-top", type=int, default=0, help="Warm the Redis cache with the top N links")
+
+    args = parser.parse_args(argv)
+    if args.command == "export":
+        asyncio.run(_export_to_file(args.format, args.output, args.after_id))
+        return
+
+    async def run_import():
+        await import_links(args.input, args.format, args.chunk_size, args.checkpoint)
+        if args.warm_top:
+            warmed = await warm_top_links(args.warm_top, fill_local=False)
+            print(f"Warmed {warmed} cached links", file=sys.stderr)
+
+    asyncio.run(run_import())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import hashlib
+import re
+from urllib.parse import urlsplit, urlunsplit
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+_HOST_PATTERN = re.compile(r"[A-Za-z0-9._:-]+")
+
+
+def normalize_url(url: str) -> str:
+    '''Приводит URL к каноническому виду для сравнения: схема и хост в нижнем регистре,
+    без порта по умолчанию, пустой путь заменяется на "/". Запрос и фрагмент не меняются.
+    '''
+    try:
+        parts = urlsplit(url.strip())
+        port = parts.port
+    except ValueError:
+        return url.strip()
+    if not parts.scheme or not parts.hostname:
+        return url.strip()
+
+    scheme = parts.scheme.lower()
+    netloc = parts.hostname.lower()
+    if ":" in netloc:
+        netloc = f"[{netloc}]"  # IPv6-адрес
+    if parts.username is not None:
+        userinfo = parts.username + (f":{parts.password}" if parts.password is not None else "")
+        netloc = f"{userinfo}@{netloc}"
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        netloc = f"{netloc}:{port}"
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, parts.fragment))
+
+
+def url_digest(url: str) -> bytes:
+    '''SHA-256 от нормализованного URL: ключ фиксированной длины (32 байта) для индекса'''
+    return hashlib.sha256(normalize_url(url).encode("utf-8")).digest()
+
+
+def domain_key(url: str) -> str:
+    '''Хост URL с метками в обратном порядке и точкой в конце: "www.Example.com" -> "com.example.www.".
+
+    В таком виде ссылки домена и всех его поддоменов имеют общий префикс ("com.example."),
+    поэтому поиск по домену – диапазон по обычному btree-индексу. Пустая строка, если хоста нет.
+    '''
+    candidate = url.strip()
+    if "://" not in candidate:
+        candidate = f"http://{candidate}"
+    try:
+        host = urlsplit(candidate).hostname
+    except ValueError:
+        return ""
+    if not host or not _HOST_PATTERN.fullmatch(host):
+        return ""
+    return ".".join(reversed(host.rstrip(".").lower().split("."))) + "."
@@ -0,0 +1,49 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import select
+from src.database import read_session_maker
+from .cache import cache_links_bulk
+from .models import Link
+
+logger = logging.getLogger(__name__)
+
+
+async def warm_top_links(limit: int, recent_since: Optional[datetime] = None, fill_local: bool = True) -> int:
+    '''Загружает в кэш самые популярные ссылки: один запрос к базе и один конвейер Redis.
+
+    С recent_since учитываются только ссылки, по которым переходили после этого момента.
+    '''
+    query = (
+        select(Link.shortened_link, Link.original_link, Link.expires_at)
+        .order_by(Link.used_count.desc(), Link.last_used.desc())
+        .limit(limit)
+    )
+    if recent_since is not None:
+        query = query.where(Link.last_used >= recent_since)
+    async with read_session_maker() as session:
+        rows = (await session.execute(query)).all()
+    return await cache_links_bulk(rows, fill_local=fill_local)
+
+
+async def warm_up(limit: int, recent_days: float, time_budget: float) -> bool:
+    '''Прогрев кэша при старте воркера в пределах time_budget секунд.
+
+    Возвращает False, если прогрев не уложился в бюджет или завершился ошибкой: воркер
+    всё равно начинает работать, просто с холодным кэшем.
+    '''
+    started = time.monotonic()
+    try:
+        warmed = await asyncio.wait_for(
+            warm_top_links(limit, datetime.now() - timedelta(days=recent_days)), timeout=time_budget
+        )
+    except asyncio.TimeoutError:
+        logger.warning(f"Cache warm-up exceeded its {time_budget:.1f}s budget, continuing with a cold cache")
+        return False
+    except Exception:
+        logger.exception("Cache warm-up failed, continuing with a cold cache: ")
+        return False
+    logger.info(f"Warmed {warmed} cached links in {time.monotonic() - started:.3f}s")
+    return True
@@ -0,0 +1,134 @@
+'''Отложенная запись новых ссылок (WRITE_BEHIND_ENABLED).
+
+POST /links/shorten не ждёт коммита в Postgres: код и оригинальный URL резервируются
+в Redis одним скриптом, ссылка попадает в кэш перенаправлений и в поток Redis
+CREATE_QUEUE_STREAM. Задача persist_queued_links читает поток через группу
+потребителей и пишет ссылки в links пачками. Запись удаляется из потока только после
+коммита, поэтому после сбоя задачи она будет прочитана снова; ссылки, которые не удалось
+записать за WRITE_BEHIND_MAX_ATTEMPTS попыток или которые конфликтуют с уже
+существующими, переносятся в поток ошибок CREATE_DEAD_LETTER_STREAM.
+'''
+from typing import Dict, Optional, Tuple
+from redis.exceptions import ResponseError
+from sqlalchemy import or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from config import WRITE_BEHIND_RESERVATION_TTL
+from src.redis_pool import redis_client
+from .cache import CachedLink, cache_link, decode_cached_link, encode_cached_link
+from .models import Link
+from .schemas import LinkCreate
+
+CREATE_QUEUE_STREAM = "link_create_queue"
+CREATE_QUEUE_GROUP = "link_writers"
+CREATE_DEAD_LETTER_STREAM = "link_create_dead_letter"
+
+CODE_RESERVATION_PREFIX = "link_reservation:code:"
+URL_RESERVATION_PREFIX = "link_reservation:url:"
+# Причина, по которой ссылка не была записана (для GET /links/shorten/status)
+FAILED_PREFIX = "link_create_failed:"
+# Число неудачных попыток записи по id записи потока
+CREATE_ATTEMPTS_KEY = "link_create_attempts"
+
+# Результаты резервирования
+RESERVED = 0
+CODE_TAKEN = 1
+URL_TAKEN = 2
+
+# Код и URL резервируются вместе или не резервируются вовсе. Резервирование кода хранит
+# закодированную ссылку: по нему перенаправление работает и после вытеснения записи кэша.
+# Резервирование URL хранит код, который возвращается в ответе 409
+_RESERVE_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 1 then
+    return {1, ''}
+end
+local existing = redis.call('get', KEYS[2])
+if existing then
+    return {2, existing}
+end
+redis.call('set', KEYS[1], ARGV[1], 'px', ARGV[3])
+redis.call('set', KEYS[2], ARGV[2], 'px', ARGV[3])
+return {0, ''}
+"""
+
+
+def code_reservation_key(short_code: str) -> str:
+    return f"{CODE_RESERVATION_PREFIX}{short_code}"
+
+
+def url_reservation_key(original_link_hash: bytes) -> str:
+    return f"{URL_RESERVATION_PREFIX}{original_link_hash.hex()}"
+
+
+def encode_queued_link(link: LinkCreate) -> Dict[str, str]:
+    '''Поля записи потока; хэш и домен URL не передаются и вычисляются заново при чтении'''
+    return {"link": link.model_dump_json(exclude={"original_link_hash", "original_domain"})}
+
+
+def decode_queued_link(fields: Dict[bytes, bytes]) -> LinkCreate:
+    return LinkCreate.model_validate_json(fields[b"link"])
+
+
+async def reserve_link(session: AsyncSession, link: LinkCreate) -> Tuple[int, Optional[str]]:
+    '''Резервирует код и оригинальный URL новой ссылки.
+
+    Возвращает (RESERVED, None), (CODE_TAKEN, None) или (URL_TAKEN, код ссылки с этим URL).
+    Занятость проверяется и по базе (ссылки, записанные обычным путём), и по резервированиям
+    ссылок, ещё стоящих в очереди.
+    '''
+    query = select(Link.original_link_hash, Link.shortened_link).where(
+        or_(Link.original_link_hash == link.original_link_hash, Link.shortened_link == link.shortened_link)
+    )
+    conflicts = (await session.execute(query)).all()
+    for row in conflicts:
+        if row.original_link_hash == link.original_link_hash:
+            return URL_TAKEN, row.shortened_link
+    if conflicts:
+        return CODE_TAKEN, None
+
+    status, existing = await redis_client.eval(  # type: ignore
+        _RESERVE_SCRIPT, 2,
+        code_reservation_key(link.shortened_link), url_reservation_key(link.original_link_hash),  # type: ignore
+        encode_cached_link(link.original_link, link.expires_at), link.shortened_link,
+        WRITE_BEHIND_RESERVATION_TTL * 1000,
+    )
+    return int(status), existing.decode() if status == URL_TAKEN else None
+
+
+async def enqueue_link(link: LinkCreate) -> None:
+    '''Ставит зарезервированную ссылку в очередь записи и кладёт её в кэш перенаправлений'''
+    await redis_client.xadd(CREATE_QUEUE_STREAM, encode_queued_link(link))  # type: ignore
+    await cache_link(link)  # type: ignore
+
+
+async def get_reserved_link(short_code: str) -> Optional[CachedLink]:
+    '''Ссылка, ещё не записанная в базу, по её резервированию'''
+    value = await redis_client.get(code_reservation_key(short_code))
+    return decode_cached_link(value) if value else None
+
+
+async def link_creation_status(short_code: str) -> Optional[Dict[str, str]]:
+    '''Состояние отложенной записи: pending – в очереди, failed – перенесена в поток ошибок.
+    None, если код не резервировался или ссылка уже записана в базу.'''
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.exists(code_reservation_key(short_code))
+        pipe.get(f"{FAILED_PREFIX}{short_code}")
+        reserved, failed = await pipe.execute()
+    if reserved:
+        return {"status": "pending"}
+    if failed:
+        return {"status": "failed", "detail": failed.decode()}
+    return None
+
+
+async def queue_stats() -> Dict[str, int]:
+    '''queued – ещё не записанные ссылки, in_progress – выданные задаче и не подтверждённые,
+    dead_letter – перенесённые в поток ошибок'''
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.xlen(CREATE_QUEUE_STREAM)
+        pipe.xlen(CREATE_DEAD_LETTER_STREAM)
+        queued, dead_letter = await pipe.execute()
+    try:
+        in_progress = (await redis_client.xpending(CREATE_QUEUE_STREAM, CREATE_QUEUE_GROUP))["pending"]
+    except ResponseError:
+        in_progress = 0  # группа ещё не создана: задача не запускалась
+    return {"queued": queued, "in_progress": in_progress, "dead_letter": dead_letter}
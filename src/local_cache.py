@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class LRUTTLCache:
+    '''Ограниченный по размеру кэш в памяти процесса с вытеснением LRU и временем жизни записей.
+
+    Рассчитан на использование из одного event loop, поэтому не использует блокировки.
+    '''
+
+    def __init__(self, max_size: int, ttl: float, clock: Callable[[], float] = time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._clock = clock
+        self._data: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        expires_at, value = entry
+        if expires_at <= self._clock():
+            del self._data[key]
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        if self.max_size <= 0:
+            return
+        self._data[key] = (self._clock() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key: Hashable) -> bool:
+        return self._data.pop(key, None) is not None
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        entry = self._data.get(key)
+        return entry is not None and entry[0] > self._clock()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+async def listen_for_invalidations(
+    redis_client,
+    channel: str,
+    cache: LRUTTLCache,
+    parse_key: Callable[[str], Hashable] = str,
+    reconnect_delay: float = 1.0,
+) -> None:
+    '''Фоновая задача: удаляет из локального кэша ключи, опубликованные другими воркерами в канал Redis'''
+    while True:
+        pubsub = redis_client.pubsub()
+        try:
+            await pubsub.subscribe(channel)
+            # Пока подписки не было, сообщения могли быть пропущены
+            cache.clear()
+            async for message in pubsub.listen():
+                if message["type"] != "message":
+                    continue
+                key = message["data"]
+                cache.delete(parse_key(key.decode() if isinstance(key, bytes) else key))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Invalidation listener for %s failed, reconnecting: ", channel)
+            await asyncio.sleep(reconnect_delay)
+        finally:
+            await pubsub.aclose()
@@ -1,28 +1,78 @@
-from fastapi import FastAPI, Depends, HTTPException
+import asyncio
+from fastapi import FastAPI, Depends, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
 from collections.abc import AsyncIterator
 from contextlib import asynccontextmanager
-from auth.users import auth_backend, current_active_user, fastapi_users
+from auth.users import auth_backend, current_active_user, fastapi_users, listen_for_user_invalidations
 from auth.schemas import UserCreate, UserRead
 from auth.db import User, create_db_and_tables
 from links.models import create_links_db_and_tables
-from links.router import router as links_router
-from redis import asyncio as aioredis
+from links.router import router as links_router, link_lookups
+from links.cache import listen_for_link_invalidations, local_link_cache
+from links.warmup import warm_up
+from links.fast_lane import RedirectFastLaneMiddleware
+from src.database import pool_status
+from src.redis_pool import redis_client, close_redis
+from src.metrics import registry, MetricsMiddleware, SamplingProfiler
+from config import PROFILER_ENABLED, PROFILER_MAX_SECONDS
+from config import REDIRECT_FAST_LANE
+from config import WARMUP_ENABLED, WARMUP_TOP_N, WARMUP_RECENT_DAYS, WARMUP_TIME_BUDGET
 from fastapi_cache import FastAPICache
 from fastapi_cache.backends.redis import RedisBackend
 
 import uvicorn
 
+async def warm_up_and_mark_ready(app: FastAPI) -> None:
+    '''Прогревает кэш и после этого отмечает воркер готовым принимать трафик (/health/ready)'''
+    if WARMUP_ENABLED:
+        await warm_up(WARMUP_TOP_N, WARMUP_RECENT_DAYS, WARMUP_TIME_BUDGET)
+    app.state.ready = True
+
+
 @asynccontextmanager
-async def lifespan(_: FastAPI) -> AsyncIterator[None]:
-    redis = aioredis.from_url("redis://localhost")
-    FastAPICache.init(RedisBackend(redis), prefix="fastapi-cache")
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    FastAPICache.init(RedisBackend(redis_client), prefix="fastapi-cache")
     await create_db_and_tables()
     await create_links_db_and_tables()
+    # Слушаем инвалидации локальных кэшей (ссылки и пользователи), отправленные другими воркерами
+    invalidation_listeners = [
+        asyncio.create_task(listen_for_link_invalidations()),
+        asyncio.create_task(listen_for_user_invalidations()),
+    ]
+    # Сервер начинает слушать сразу (liveness), а балансировщик направляет трафик
+    # только после прогрева кэша (readiness)
+    app.state.ready = False
+    warmup_task = asyncio.create_task(warm_up_and_mark_ready(app))
     yield
-    await redis.aclose()
+    app.state.ready = False
+    warmup_task.cancel()
+    for listener in invalidation_listeners:
+        listener.cancel()
+    await close_redis()
 
 
 app = FastAPI(lifespan=lifespan)
+if REDIRECT_FAST_LANE:
+    # Добавляется раньше MetricsMiddleware, поэтому быстрые перенаправления тоже попадают в метрики
+    app.add_middleware(RedirectFastLaneMiddleware)
+app.add_middleware(MetricsMiddleware)
+
+registry.gauge_callback(
+    "db_pool_checked_out", "Connections checked out of the pool",
+    lambda: [({"pool": name}, stats["checked_out"]) for name, stats in pool_status().items()],
+)
+registry.gauge_callback(
+    "db_pool_saturation", "Share of the pool capacity (size + overflow) in use",
+    lambda: [({"pool": name}, stats["saturation"]) for name, stats in pool_status().items()],
+)
+registry.gauge_callback(
+    "local_link_cache", "Local short code cache size and counters",
+    lambda: [({"stat": name}, value) for name, value in local_link_cache.stats().items()],
+)
+registry.gauge_callback(
+    "link_lookup_single_flight", "Database lookups on cache misses: executed, coalesced and in flight",
+    lambda: [({"stat": name}, value) for name, value in link_lookups.stats().items()],
+)
 
 app.include_router(
     fastapi_users.get_auth_router(auth_backend), prefix="/auth/jwt", tags=["auth"]
@@ -41,6 +91,55 @@ def protected_route(user: User = Depends(current_active_user)):
     return f"Hello, {user.email}"
 
 
+@app.get("/health/live")
+def health_live():
+    '''Процесс жив и обслуживает запросы'''
+    return {"status": "alive"}
+
+
+@app.get("/health/ready")
+def health_ready(request: Request):
+    '''Воркер готов принимать трафик: прогрев кэша завершён (503, пока идёт прогрев или остановка)'''
+    if not getattr(request.app.state, "ready", False):
+        return JSONResponse(status_code=503, content={"status": "warming_up"})
+    return {"status": "ready"}
+
+
+@app.get("/cache/stats")
+def cache_stats():
+    '''Счётчики локального кэша коротких кодов текущего воркера'''
+    return local_link_cache.stats()
+
+
+@app.get("/db/pool-stats")
+def db_pool_stats():
+    '''Заполненность пулов соединений с базой данных (чтение и запись) текущего воркера'''
+    return pool_status()
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    '''Метрики воркера в текстовом формате Prometheus'''
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/debug/profile", response_class=PlainTextResponse)
+async def debug_profile(
+    seconds: float = Query(5.0, gt=0, description="Длительность профилирования"),
+    interval: float = Query(0.005, gt=0, description="Период снятия стека, секунды")
+):
+    '''Сэмплирующий профиль потока event loop в формате collapsed stacks (для flamegraph)'''
+    if not PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    # Профилировщик запускается из потока event loop и снимает именно его стек
+    profiler = SamplingProfiler(interval=interval).start()
+    try:
+        await asyncio.sleep(min(seconds, PROFILER_MAX_SECONDS))
+    finally:
+        profiler.stop()
+    return PlainTextResponse(profiler.collapsed())
+
+
 @app.get("/unprotected-route")
 def unprotected_route():
     return f"Hello, anonym"
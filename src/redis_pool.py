@@ -0,0 +1,74 @@
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+from redis import ConnectionPool as SyncConnectionPool, Redis as SyncRedis
+from redis.asyncio import ConnectionPool, Redis
+from config import REDIS_URL, REDIS_MAX_CONNECTIONS, REDIS_SOCKET_TIMEOUT, REDIS_BATCH_SIZE
+from src.metrics import instrument_redis
+
+# Один пул соединений на процесс для всех модулей приложения (кэш ссылок, счётчики
+# переходов, генератор кодов, кэш пользователей, FastAPICache). Соединения открываются
+# лениво; пул закрывается в lifespan при остановке приложения.
+pool = ConnectionPool.from_url(
+    REDIS_URL,
+    max_connections=REDIS_MAX_CONNECTIONS,
+    socket_timeout=REDIS_SOCKET_TIMEOUT,
+    socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+    health_check_interval=30,
+)
+redis_client = instrument_redis(Redis(connection_pool=pool))
+
+# Синхронный клиент для задач Celery с теми же настройками
+sync_pool = SyncConnectionPool.from_url(
+    REDIS_URL,
+    max_connections=REDIS_MAX_CONNECTIONS,
+    socket_timeout=REDIS_SOCKET_TIMEOUT,
+    socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+)
+sync_redis_client = SyncRedis(connection_pool=sync_pool)
+
+
+async def close_redis() -> None:
+    await redis_client.aclose()
+    await pool.aclose()
+
+
+def _chunks(items: Sequence, size: int) -> Iterable[Sequence]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+async def mget(keys: Sequence[str]) -> List[Optional[bytes]]:
+    '''MGET любого числа ключей: пачки по REDIS_BATCH_SIZE в одном конвейере (один round-trip)'''
+    if not keys:
+        return []
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for chunk in _chunks(keys, REDIS_BATCH_SIZE):
+            pipe.mget(chunk)
+        results = await pipe.execute()
+    return [value for chunk in results for value in chunk]
+
+
+async def set_many(items: Dict[str, Tuple[bytes, Optional[int]]]) -> None:
+    '''Запись многих ключей одним конвейером: {ключ: (значение, время жизни в мс или None)}.
+
+    У MSET нет времени жизни, поэтому ключи без TTL пишутся через MSET пачками, остальные – SET PX.
+    '''
+    if not items:
+        return
+    persistent = {key: value for key, (value, ttl_ms) in items.items() if ttl_ms is None}
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for chunk in _chunks(list(persistent.items()), REDIS_BATCH_SIZE):
+            pipe.mset(dict(chunk))
+        for key, (value, ttl_ms) in items.items():
+            if ttl_ms is not None:
+                pipe.set(key, value, px=ttl_ms)
+        await pipe.execute()
+
+
+async def delete_many(keys: Sequence[str]) -> int:
+    '''DEL любого числа ключей пачками в одном конвейере; возвращает число удалённых'''
+    if not keys:
+        return 0
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for chunk in _chunks(keys, REDIS_BATCH_SIZE):
+            pipe.delete(*chunk)
+        return sum(await pipe.execute())
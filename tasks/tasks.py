@@ -1,10 +1,30 @@
 import logging
+import time
+import uuid
 from celery import Celery
-from datetime import datetime
-from sqlalchemy import delete
-from src.links.models import Link
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from sqlalchemy import delete, select, bindparam, func
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from redis.exceptions import ResponseError
+from src.links.models import Link, LinkClickRollup, ClickFlush
+from src.links.analytics import CLICK_EVENTS_STREAM, CLICK_EVENTS_GROUP
+from src.links.analytics import aggregate_click_events as aggregate_click_events_batch
+from src.links.cache import cache_key, INVALIDATION_CHANNEL
+from src.links.clicks import PENDING_CLICKS_KEY, FLUSHING_CLICKS_KEY, FLUSH_ID_KEY, parse_clicks_buffer
+from src.links.clicks import COUNT_FIELD_PREFIX, LAST_USED_FIELD_PREFIX
+from src.links.write_behind import (
+    CREATE_QUEUE_STREAM, CREATE_QUEUE_GROUP, CREATE_DEAD_LETTER_STREAM, CREATE_ATTEMPTS_KEY, FAILED_PREFIX,
+    code_reservation_key, url_reservation_key, decode_queued_link,
+)
+from src.links.response_cache import SEARCH_GENERATION_KEY, GENERATION_TTL, stats_generation_key, new_generation
 from src.database import SyncSessionMaker
+from src.redis_pool import sync_redis_client
 from fastapi import Depends
+from config import SWEEP_BATCH_SIZE, SWEEP_MAX_BATCHES, CLICK_EVENTS_BATCH_SIZE, CLICK_EVENTS_MAX_BATCHES
+from config import TASK_LOCK_TTL, CLICK_FLUSH_HISTORY_DAYS
+from config import WRITE_BEHIND_BATCH_SIZE, WRITE_BEHIND_MAX_BATCHES, WRITE_BEHIND_MAX_ATTEMPTS, WRITE_BEHIND_RESERVATION_TTL
 import celeryconfig
 
 celery = Celery('tasks', broker='redis://localhost:6379/0')
@@ -15,17 +35,112 @@ celery.conf.broker_connection_retry_on_startup = True
 
 logger = logging.getLogger(__name__)
 
+redis_client = sync_redis_client
+
+# Размер пачки строк в одном executemany при сбросе счётчиков переходов
+CLICK_FLUSH_BATCH_SIZE = 1000
+
+# Имя потребителя в группе потока событий; постоянное, чтобы после сбоя
+# следующий запуск задачи дочитал неподтверждённые события
+CLICK_EVENTS_CONSUMER = "rollup-worker"
+# Строк в одном многострочном upsert агрегатов (ограничение на число параметров запроса)
+ROLLUP_UPSERT_CHUNK_SIZE = 5000
+# Имя потребителя очереди отложенной записи ссылок, постоянное по той же причине
+LINK_WRITER_CONSUMER = "link-writer"
+
+TASK_LOCK_PREFIX = "task_lock:"
+
+# Снимаем блокировку, только если она всё ещё наша (могла истечь и достаться другому запуску)
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# Забирает текущий буфер переходов вместе с новым идентификатором сброса или возвращает
+# идентификатор незавершённого сброса. nil – буфер пуст
+_TAKE_CLICKS_BUFFER_SCRIPT = """
+if redis.call('exists', KEYS[2]) == 0 then
+    if redis.call('exists', KEYS[1]) == 0 then
+        return false
+    end
+    redis.call('rename', KEYS[1], KEYS[2])
+    redis.call('set', KEYS[3], ARGV[1])
+end
+redis.call('set', KEYS[3], ARGV[1], 'nx')
+return redis.call('get', KEYS[3])
+"""
+
+
+@contextmanager
+def task_lock(name):
+    '''Блокировка Redis (SET NX PX), не дающая запускам одной задачи идти параллельно.
+    Возвращает True, если блокировка взята; снимается только своим токеном.'''
+    key = f"{TASK_LOCK_PREFIX}{name}"
+    token = uuid.uuid4().hex
+    acquired = redis_client.set(key, token, nx=True, px=TASK_LOCK_TTL * 1000)
+    try:
+        yield bool(acquired)
+    finally:
+        if acquired:
+            redis_client.eval(_RELEASE_LOCK_SCRIPT, 1, key, token)
+
 @celery.task
 def delete_expired_links():
+    '''Удаляет просроченные ссылки ограниченными пачками по частичному индексу ix_links_expires_at'''
     session = SyncSessionMaker()
+    started = time.monotonic()
+    deleted_count = 0
+    capped = False
     try:
         now = datetime.now()
-        query = delete(Link).where(Link.expires_at.isnot(None), Link.expires_at < now)
-        result = session.execute(query)
-        session.commit()
-        # Логируем количество удалённых строк (если поддерживается в вашей версии SQLAlchemy)
-        deleted_count = result.rowcount if result.rowcount is not None else 0
-        logger.info(f"Deleted {deleted_count} expired links at {now.isoformat()}.")
+        # Каждая пачка – отдельная короткая транзакция: блокировки держатся только на
+        # SWEEP_BATCH_SIZE строках, а уже заблокированные другими транзакциями строки пропускаются
+        # Строки выбираются по коду, а не по id: в секционированной таблице код – ключ
+        # секционирования, и удаление идёт по уникальному индексу нужной секции
+        expired_codes = (
+            select(Link.shortened_link)
+            .where(Link.expires_at.isnot(None), Link.expires_at < now)
+            .order_by(Link.expires_at)
+            .limit(SWEEP_BATCH_SIZE)
+            .with_for_update(skip_locked=True)
+            .scalar_subquery()
+        )
+        query = (
+            delete(Link)
+            .where(Link.shortened_link.in_(expired_codes))
+            .returning(Link.shortened_link)
+            .execution_options(synchronize_session=False)
+        )
+        for _ in range(SWEEP_MAX_BATCHES):
+            short_codes = session.execute(query).scalars().all()
+            session.commit()
+            if not short_codes:
+                break
+            # Удалённые ссылки не должны продолжать перенаправлять из кэша, попадать в
+            # кэшированную выдачу поиска и отдавать кэшированную статистику
+            invalidate_cached_codes(short_codes)
+            bump_response_generations(short_codes, search=True)
+            deleted_count += len(short_codes)
+            if len(short_codes) < SWEEP_BATCH_SIZE:
+                break
+        else:
+            # Все SWEEP_MAX_BATCHES пачек были полными – просроченные ссылки, скорее всего,
+            # остались; продолжаем следующим запуском, не дожидаясь расписания
+            capped = True
+
+        elapsed = time.monotonic() - started
+        rows_per_second = deleted_count / elapsed if elapsed > 0 else 0.0
+        logger.info(
+            f"Deleted {deleted_count} expired links at {now.isoformat()} "
+            f"in {elapsed:.3f}s ({rows_per_second:.1f} rows/s)."
+        )
+        if capped:
+            logger.warning(
+                f"Expired links sweep hit the limit of {SWEEP_MAX_BATCHES} batches, rescheduling."
+            )
+            delete_expired_links.delay()
         
     except Exception as e:
         logger.exception("Failed to delete expired links: ")
@@ -37,7 +152,410 @@ def delete_expired_links():
     finally:
         session.close()
 
+    return {
+        "status": 204,
+        "details": "OK",
+        "deleted": deleted_count,
+        "rows_per_second": rows_per_second,
+        "capped": capped,
+    }
+
+
+def invalidate_cached_codes(short_codes):
+    '''Удаляет записи cached_link:* и рассылает воркерам API инвалидацию локальных кэшей'''
+    with redis_client.pipeline(transaction=False) as pipe:
+        pipe.delete(*(cache_key(code) for code in short_codes))
+        for code in short_codes:
+            pipe.publish(INVALIDATION_CHANNEL, code)
+        pipe.execute()
+
+
+def bump_response_generations(short_codes, search=False):
+    '''Меняет поколения кэшированных ответов статистики кодов (и поиска): записи со старым поколением больше не читаются'''
+    generation = new_generation()
+    with redis_client.pipeline(transaction=False) as pipe:
+        if search:
+            pipe.set(SEARCH_GENERATION_KEY, generation, ex=GENERATION_TTL)
+        for code in short_codes:
+            pipe.set(stats_generation_key(code), generation, ex=GENERATION_TTL)
+        pipe.execute()
+
+
+def existing_codes(session, short_codes):
+    '''Коды из short_codes, для которых есть строка в links'''
+    existing = set()
+    for start in range(0, len(short_codes), CLICK_FLUSH_BATCH_SIZE):
+        chunk = short_codes[start:start + CLICK_FLUSH_BATCH_SIZE]
+        existing.update(session.execute(select(Link.shortened_link).where(Link.shortened_link.in_(chunk))).scalars())
+    return existing
+
+
+def unpersisted_codes(session, missing_codes):
+    '''Коды без строки в links, переходы по которым нельзя отбрасывать: ссылка стоит в очереди
+    отложенной записи (есть резервирование) или была записана уже после проверки existing_codes.
+    Резервирование снимается после коммита ссылки, поэтому коды без него проверяются в базе ещё раз.
+    Остальные коды – удалённые ссылки, их переходы отбрасываются.'''
+    if not missing_codes:
+        return []
+    with redis_client.pipeline(transaction=False) as pipe:
+        for code in missing_codes:
+            pipe.exists(code_reservation_key(code))
+        reserved = pipe.execute()
+    carried = [code for code, is_reserved in zip(missing_codes, reserved) if is_reserved]
+    released = [code for code, is_reserved in zip(missing_codes, reserved) if not is_reserved]
+    persisted = existing_codes(session, released)
+    return carried + [code for code in released if code in persisted]
+
+
+@celery.task
+def flush_click_counters():
+    '''Сбрасывает накопленные в Redis переходы в таблицу links агрегированными пачками'''
+    with task_lock("flush_click_counters") as acquired:
+        if not acquired:
+            logger.info("Click counters are being flushed by another worker.")
+            return {
+                "status": 204,
+                "details": "Skipped: another flush is running"
+            }
+        return flush_clicks_buffer()
+
+
+def flush_clicks_buffer():
+    # Если предыдущий сброс завершился ошибкой, сначала дописываем его буфер.
+    # Иначе атомарно забираем текущий буфер: новые переходы пойдут в новый хэш.
+    flush_id = redis_client.eval(
+        _TAKE_CLICKS_BUFFER_SCRIPT, 3, PENDING_CLICKS_KEY, FLUSHING_CLICKS_KEY, FLUSH_ID_KEY, uuid.uuid4().hex
+    )
+    if flush_id is None:
+        # Буфер пуст – переходов с прошлого сброса не было
+        return {
+            "status": 204,
+            "details": "OK"
+        }
+    flush_id = flush_id.decode()
+
+    clicks = parse_clicks_buffer(redis_client.hgetall(FLUSHING_CLICKS_KEY))
+    rows = [
+        {"code": short_code, "delta": count, "used_at": last_used}
+        for short_code, (count, last_used) in clicks.items()
+    ]
+    statement = (
+        Link.__table__.update()
+        .where(Link.__table__.c.shortened_link == bindparam("code"))
+        .values(
+            used_count=Link.__table__.c.used_count + bindparam("delta"),
+            last_used=func.greatest(Link.__table__.c.last_used, bindparam("used_at")),
+        )
+    )
+
+    session = SyncSessionMaker()
+    try:
+        # Идентификатор сброса пишется в одной транзакции со счётчиками: если буфер уже
+        # применён (сбой после коммита, но до удаления буфера), он только удаляется
+        now = datetime.now()
+        recorded = session.execute(
+            pg_insert(ClickFlush)
+            .values(flush_id=flush_id, flushed_at=now)
+            .on_conflict_do_nothing()
+            .returning(ClickFlush.flush_id)
+        ).scalar()
+        existing = existing_codes(session, list(clicks))
+        if recorded is not None:
+            rows = [row for row in rows if row["code"] in existing]
+            for start in range(0, len(rows), CLICK_FLUSH_BATCH_SIZE):
+                session.execute(statement, rows[start:start + CLICK_FLUSH_BATCH_SIZE])
+            session.execute(
+                delete(ClickFlush).where(ClickFlush.flushed_at < now - timedelta(days=CLICK_FLUSH_HISTORY_DAYS))
+            )
+        carried = unpersisted_codes(session, [code for code in clicks if code not in existing])
+        session.commit()
+        # Поколения меняются до удаления буфера: пока он не удалён, статистика из старой
+        # записи кэша и буфера сходится со значениями в базе
+        bump_response_generations(clicks.keys(), search=True)
+        # Переходы по ссылкам, которых ещё нет в базе, возвращаются в текущий буфер в той же
+        # транзакции Redis, что удаляет сбрасываемый: они применятся, когда строка появится
+        with redis_client.pipeline(transaction=True) as pipe:
+            for code in carried:
+                count, last_used = clicks[code]
+                pipe.hincrby(PENDING_CLICKS_KEY, f"{COUNT_FIELD_PREFIX}{code}", count)
+                # Время переходов в текущем буфере новее, поэтому пишем только в пустое поле
+                pipe.hsetnx(PENDING_CLICKS_KEY, f"{LAST_USED_FIELD_PREFIX}{code}", last_used.timestamp())
+            pipe.delete(FLUSHING_CLICKS_KEY, FLUSH_ID_KEY)
+            pipe.execute()
+        if recorded is None:
+            logger.warning(f"Click buffer {flush_id} was already flushed, discarded it.")
+        else:
+            logger.info(f"Flushed {sum(row['delta'] for row in rows)} clicks for {len(rows)} links.")
+        if carried:
+            logger.info(f"Kept clicks for {len(carried)} links that are not persisted yet.")
+
+    except Exception as e:
+        logger.exception("Failed to flush click counters: ")
+        session.rollback()
+        return {
+            "status": 503,
+            "details": str(e),
+        }
+    finally:
+        session.close()
+
     return {
         "status": 204,
         "details": "OK"
-    }
\ No newline at end of file
+    }
+
+
+@celery.task
+def aggregate_click_events():
+    '''Сворачивает события переходов из потока Redis в таблицу link_click_rollups'''
+    # Все запуски читают поток одним потребителем CLICK_EVENTS_CONSUMER: без блокировки два
+    # запуска дочитали бы одни и те же неподтверждённые события и учли их дважды
+    with task_lock("aggregate_click_events") as acquired:
+        if not acquired:
+            logger.info("Click events are being aggregated by another worker.")
+            return {
+                "status": 204,
+                "details": "Skipped: another aggregation is running",
+                "processed": 0,
+            }
+        return aggregate_click_events_stream()
+
+
+def aggregate_click_events_stream():
+    try:
+        redis_client.xgroup_create(CLICK_EVENTS_STREAM, CLICK_EVENTS_GROUP, id="0", mkstream=True)
+    except ResponseError:
+        pass  # группа уже создана
+
+    session = SyncSessionMaker()
+    processed = 0
+    try:
+        # Сначала дочитываем события, выданные прошлому запуску, но не подтверждённые
+        # (например, если он упал до XACK), затем – новые события
+        stream_id = "0"
+        for _ in range(CLICK_EVENTS_MAX_BATCHES):
+            response = redis_client.xreadgroup(
+                CLICK_EVENTS_GROUP, CLICK_EVENTS_CONSUMER,
+                {CLICK_EVENTS_STREAM: stream_id}, count=CLICK_EVENTS_BATCH_SIZE
+            )
+            entries = response[0][1] if response else []
+            if not entries:
+                if stream_id == "0":
+                    stream_id = ">"
+                    continue
+                break
+
+            rollups = aggregate_click_events_batch(fields for _, fields in entries if fields)
+            rows = [
+                {
+                    "short_code": short_code, "granularity": granularity, "bucket_start": start,
+                    "dimension": dimension, "value": value, "clicks": clicks,
+                }
+                for (short_code, granularity, start, dimension, value), clicks in rollups.items()
+            ]
+            for chunk_start in range(0, len(rows), ROLLUP_UPSERT_CHUNK_SIZE):
+                statement = pg_insert(LinkClickRollup).values(rows[chunk_start:chunk_start + ROLLUP_UPSERT_CHUNK_SIZE])
+                statement = statement.on_conflict_do_update(
+                    index_elements=["short_code", "granularity", "bucket_start", "dimension", "value"],
+                    set_={"clicks": LinkClickRollup.clicks + statement.excluded.clicks},
+                )
+                session.execute(statement)
+            session.commit()
+            bump_response_generations({key[0] for key in rollups})
+            redis_client.xack(CLICK_EVENTS_STREAM, CLICK_EVENTS_GROUP, *(entry_id for entry_id, _ in entries))
+            processed += len(entries)
+
+        logger.info(f"Aggregated {processed} click events.")
+
+    except Exception as e:
+        logger.exception("Failed to aggregate click events: ")
+        session.rollback()
+        return {
+            "status": 503,
+            "details": str(e),
+        }
+    finally:
+        session.close()
+
+    return {
+        "status": 204,
+        "details": "OK",
+        "processed": processed,
+    }
+
+
+def persist_links(session, links):
+    '''Пишет пачку ссылок одним INSERT ... ON CONFLICT DO NOTHING; возвращает записанные коды.
+
+    Ссылка, которая уже есть в базе с тем же кодом и URL, считается записанной: так бывает,
+    когда прошлый запуск задачи закоммитил пачку, но упал до XACK.
+    '''
+    statement = (
+        pg_insert(Link)
+        .values([link.model_dump() for link in links])
+        .on_conflict_do_nothing()
+        .returning(Link.shortened_link)
+    )
+    written = set(session.execute(statement).scalars())
+    rest = [link for link in links if link.shortened_link not in written]
+    if rest:
+        query = select(Link.shortened_link, Link.original_link_hash).where(
+            Link.shortened_link.in_([link.shortened_link for link in rest])
+        )
+        existing = {row.shortened_link: row.original_link_hash for row in session.execute(query)}
+        written.update(link.shortened_link for link in rest if existing.get(link.shortened_link) == link.original_link_hash)
+    session.commit()
+    return written
+
+
+def ack_queued_links(entry_ids):
+    '''Подтверждает и удаляет обработанные записи очереди'''
+    if not entry_ids:
+        return
+    with redis_client.pipeline(transaction=False) as pipe:
+        pipe.xack(CREATE_QUEUE_STREAM, CREATE_QUEUE_GROUP, *entry_ids)
+        pipe.xdel(CREATE_QUEUE_STREAM, *entry_ids)
+        pipe.hdel(CREATE_ATTEMPTS_KEY, *entry_ids)
+        pipe.execute()
+
+
+def release_reservations(links):
+    with redis_client.pipeline(transaction=False) as pipe:
+        for link in links:
+            pipe.delete(code_reservation_key(link.shortened_link), url_reservation_key(link.original_link_hash))
+        pipe.execute()
+
+
+def dead_letter_links(entries, reason):
+    '''Переносит записи очереди в поток ошибок: резервирование снимается, ссылка убирается из кэша'''
+    links = [link for _, _, link in entries if link is not None]
+    with redis_client.pipeline(transaction=False) as pipe:
+        for entry_id, fields, link in entries:
+            pipe.xadd(CREATE_DEAD_LETTER_STREAM, {**fields, "entry_id": entry_id, "error": reason})
+            if link is not None:
+                pipe.set(f"{FAILED_PREFIX}{link.shortened_link}", reason, ex=WRITE_BEHIND_RESERVATION_TTL)
+        pipe.execute()
+    if links:
+        release_reservations(links)
+        invalidate_cached_codes([link.shortened_link for link in links])
+    ack_queued_links([entry_id for entry_id, _, _ in entries])
+    logger.warning(f"Moved {len(entries)} queued links to the dead letter stream: {reason}")
+
+
+def count_failed_attempt(entries, reason):
+    '''Учитывает неудачную попытку записи; записи, исчерпавшие попытки, уходят в поток ошибок.
+    Остальные остаются неподтверждёнными и будут прочитаны следующим запуском.'''
+    with redis_client.pipeline(transaction=False) as pipe:
+        for entry_id, _, _ in entries:
+            pipe.hincrby(CREATE_ATTEMPTS_KEY, entry_id, 1)
+        attempts = pipe.execute()
+    exhausted = [entry for entry, attempt in zip(entries, attempts) if attempt >= WRITE_BEHIND_MAX_ATTEMPTS]
+    if exhausted:
+        dead_letter_links(exhausted, reason)
+    return len(exhausted)
+
+
+@celery.task
+def persist_queued_links():
+    '''Записывает в таблицу links пачками ссылки из очереди отложенной записи (WRITE_BEHIND_ENABLED)'''
+    # Как и в aggregate_click_events, все запуски читают поток одним потребителем: медленный
+    # запуск, перекрытый следующим, повторно прочитал бы те же записи, дважды учёл попытки
+    # и мог перенести в поток ошибок ссылку, которую другой запуск ещё записывает
+    with task_lock("persist_queued_links") as acquired:
+        if not acquired:
+            logger.info("Queued links are being persisted by another worker.")
+            return {
+                "status": 204,
+                "details": "Skipped: another run is persisting queued links",
+                "persisted": 0,
+                "failed": 0,
+            }
+        return persist_queued_links_stream()
+
+
+def persist_queued_links_stream():
+    try:
+        redis_client.xgroup_create(CREATE_QUEUE_STREAM, CREATE_QUEUE_GROUP, id="0", mkstream=True)
+    except ResponseError:
+        pass  # группа уже создана
+
+    session = SyncSessionMaker()
+    persisted = failed = 0
+    try:
+        # Как и в aggregate_click_events: сначала записи, выданные прошлому запуску, затем новые
+        stream_id = "0"
+        for _ in range(WRITE_BEHIND_MAX_BATCHES):
+            response = redis_client.xreadgroup(
+                CREATE_QUEUE_GROUP, LINK_WRITER_CONSUMER,
+                {CREATE_QUEUE_STREAM: stream_id}, count=WRITE_BEHIND_BATCH_SIZE
+            )
+            entries = response[0][1] if response else []
+            if not entries:
+                if stream_id == "0":
+                    stream_id = ">"
+                    continue
+                break
+
+            queued, malformed = [], []
+            for entry_id, fields in entries:
+                try:
+                    queued.append((entry_id, fields, decode_queued_link(fields)))
+                except (KeyError, ValueError):
+                    malformed.append((entry_id, fields or {}, None))
+            if malformed:
+                dead_letter_links(malformed, "malformed queue entry")
+                failed += len(malformed)
+            if not queued:
+                continue
+
+            try:
+                written = persist_links(session, [link for _, _, link in queued])
+            except (DataError, IntegrityError):
+                # Пачку отвергла одна из ссылок – пишем по одной, отвергнутые сразу в поток ошибок
+                session.rollback()
+                written, accepted = set(), []
+                for entry in queued:
+                    try:
+                        written |= persist_links(session, [entry[2]])
+                        accepted.append(entry)
+                    except (DataError, IntegrityError) as e:
+                        session.rollback()
+                        dead_letter_links([entry], str(e.orig))
+                        failed += 1
+                queued = accepted
+            except Exception as e:
+                # База недоступна: записи остаются в очереди до следующего запуска
+                session.rollback()
+                logger.exception("Failed to persist queued links: ")
+                failed += count_failed_attempt(queued, str(e))
+                break
+
+            done = [entry for entry in queued if entry[2].shortened_link in written]
+            conflicting = [entry for entry in queued if entry[2].shortened_link not in written]
+            if conflicting:
+                dead_letter_links(conflicting, "conflicts with an existing link")
+                failed += len(conflicting)
+            if done:
+                release_reservations([link for _, _, link in done])
+                ack_queued_links([entry_id for entry_id, _, _ in done])
+                bump_response_generations([], search=True)
+                persisted += len(done)
+
+        logger.info(f"Persisted {persisted} queued links, {failed} moved to the dead letter stream.")
+
+    except Exception as e:
+        logger.exception("Failed to persist queued links: ")
+        session.rollback()
+        return {
+            "status": 503,
+            "details": str(e),
+        }
+    finally:
+        session.close()
+
+    return {
+        "status": 204,
+        "details": "OK",
+        "persisted": persisted,
+        "failed": failed,
+    }
@@ -12,12 +12,15 @@ import asyncio
 import pytest_asyncio
 from src.auth.users import current_active_user, get_optional_current_user
 from src.auth.db import get_async_session
+from src.database import get_read_session
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.asyncio import AsyncSession
 from httpx import AsyncClient, ASGITransport
 from typing import AsyncGenerator
 from config import DB_USER, DB_PASS, DB_HOST, DB_PORT, DB_NAME, TEST_DB_NAME
 from sqlalchemy import text
+from sqlalchemy.pool import NullPool
+import links.router as links_router
 
 # Фиктивный пользователь для тестов, требующих авторизации
 class DummyUser:
@@ -41,9 +44,10 @@ async def test_engine():
 
 @pytest_asyncio.fixture(scope="function")
 async def create_drop_test_links_db_and_tables(test_engine):
-    from src.links.models import Link
+    from src.links.models import Link, short_code_sequence_ddl
     async with test_engine.begin() as conn:
         await conn.run_sync(Link.metadata.create_all)
+        await conn.execute(text(short_code_sequence_ddl()))
     yield test_engine
     async with test_engine.begin() as conn:
         await conn.run_sync(Link.metadata.drop_all)
@@ -60,6 +64,13 @@ async def override_get_async_session_override():
     await engine.dispose()
 
 app.dependency_overrides[get_async_session] = override_get_async_session_override
+app.dependency_overrides[get_read_session] = override_get_async_session_override
+
+# Загрузка ссылки при промахе кэша открывает свою сессию, минуя зависимости, –
+# направляем её в тестовую базу (NullPool: у каждого теста свой event loop)
+links_router.read_session_maker = async_sessionmaker(
+    create_async_engine(TEST_DATABASE_URL, poolclass=NullPool), expire_on_commit=False
+)
 
 @pytest.fixture
 def mock_redis():
@@ -224,6 +235,21 @@ async def test_get_stats_success(create_drop_test_links_db_and_tables):
         assert data["used_count"] >= 3
         assert "last_used" in data
 
+@pytest.mark.asyncio
+async def test_get_stats_not_modified_until_new_click(create_drop_test_links_db_and_tables):
+    custom_alias = "etag1"
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        await client.post("/links/shorten", params={"original_link": "https://example.com/etag", "custom_alias": custom_alias})
+        res1 = await client.get(f"/links/{custom_alias}/stats")
+        etag = res1.headers["etag"]
+        res2 = await client.get(f"/links/{custom_alias}/stats", headers={"If-None-Match": etag})
+        assert res2.status_code == 304
+        assert res2.content == b""
+        await client.get(f"/links/{custom_alias}", follow_redirects=False)
+        res3 = await client.get(f"/links/{custom_alias}/stats", headers={"If-None-Match": etag})
+        assert res3.status_code == 200
+        assert res3.json()["used_count"] == res1.json()["used_count"] + 1
+
 @pytest.mark.asyncio
 async def test_shorten_url_with_expiration(create_drop_test_links_db_and_tables):
     original_link = "https://example.com/expire"
@@ -293,4 +319,73 @@ async def test_search_links_fail_empty_original_url(create_drop_test_links_db_an
          assert res.status_code == 422
          data = res.json()
          assert "detail" in data
-         assert data["detail"][0]["msg"] == "ensure this value has at least 1 characters"
\ No newline at end of file
+         assert data["detail"][0]["msg"] == "ensure this value has at least 1 characters"
+@pytest.mark.asyncio
+async def test_shorten_urls_batch_reports_per_item_results(create_drop_test_links_db_and_tables):
+    items = [
+        {"original_link": "https://example.com/batch1"},
+        {"original_link": "https://example.com/batch2", "custom_alias": "batchalias"},
+        {"original_link": "https://example.com/batch1"},
+        {"custom_alias": "noorigin"},
+    ]
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        res = await client.post("/links/shorten/batch", json=items)
+        assert res.status_code == 200
+        data = res.json()
+        assert [item["status"] for item in data] == ["created", "created", "conflict", "invalid"]
+        assert data[1]["short_url"] == "batchalias"
+        res2 = await client.post(
+            "/links/shorten/batch",
+            content=json.dumps({"original_link": "https://example.com/batch2"}) + "\n",
+            headers={"content-type": "application/x-ndjson"}
+        )
+        assert res2.status_code == 200
+        assert res2.json()[0]["status"] == "conflict"
+        assert res2.json()[0]["short_url"] == "batchalias"
+
+@pytest.mark.asyncio
+async def test_list_my_links_paginates_with_cursor(create_drop_test_links_db_and_tables):
+    items = [{"original_link": f"https://example.com/mine{index}"} for index in range(5)]
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        res = await client.post("/links/shorten/batch", json=items)
+        assert res.status_code == 200
+        res1 = await client.get("/links/mine", params={"limit": 3})
+        assert res1.status_code == 200
+        page1 = res1.json()
+        assert len(page1["items"]) == 3
+        assert page1["next_cursor"]
+        res2 = await client.get("/links/mine", params={"limit": 3, "cursor": page1["next_cursor"]})
+        page2 = res2.json()
+        assert len(page2["items"]) == 2
+        assert page2["next_cursor"] is None
+        codes = {item["shortened_link"] for item in page1["items"] + page2["items"]}
+        assert len(codes) == 5
+        res3 = await client.get("/links/mine", params={"cursor": "broken"})
+        assert res3.status_code == 422
+
+@pytest.mark.asyncio
+async def test_search_links_by_domain_and_prefix(create_drop_test_links_db_and_tables):
+    items = [
+        {"original_link": "https://example.com/promo/spring"},
+        {"original_link": "https://shop.example.com/promo/summer"},
+        {"original_link": "https://example.community/promo"},
+    ]
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        res = await client.post("/links/shorten/batch", json=items)
+        assert res.status_code == 200
+        res1 = await client.get("/links/search", params={"original_url": "example.com", "mode": "domain"})
+        assert res1.status_code == 200
+        assert {item["original_link"] for item in res1.json()} == {items[0]["original_link"], items[1]["original_link"]}
+        res2 = await client.get("/links/search", params={"original_url": "example.com/promo", "mode": "prefix"})
+        assert [item["original_link"] for item in res2.json()] == [items[0]["original_link"]]
+
+
+@pytest.mark.asyncio
+async def test_search_prefix_ignores_host_case_and_allows_long_urls(create_drop_test_links_db_and_tables):
+    long_link = "https://Docs.Example.org/" + "a" * 5000
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        res = await client.post("/links/shorten", params={"original_link": long_link})
+        assert res.status_code == 200
+        res1 = await client.get("/links/search", params={"original_url": "docs.example.org/aaa", "mode": "prefix"})
+        assert res1.status_code == 200
+        assert [item["original_link"] for item in res1.json()] == [long_link]
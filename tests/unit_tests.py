@@ -1,6 +1,43 @@
+import pytest
+import csv
+import io
+import json
 import re
+from collections import namedtuple
+import time
+import asyncio
+from datetime import datetime, timedelta, timezone
+from fastapi import FastAPI, HTTPException
+from httpx import AsyncClient, ASGITransport
 from links.router import generate_short_url
-from auth.users import get_jwt_strategy
+from links.clicks import parse_clicks_buffer
+from src.local_cache import LRUTTLCache
+from src.single_flight import SingleFlight
+from links.admission import CountMinSketch, HotLinkAdmission
+from links.codegen import base62_encode, counter_to_code, CounterCodeGenerator
+from links.urls import normalize_url, url_digest, domain_key
+from links.search import escape_like, prefix_candidates, prefix_condition
+from sqlalchemy.dialects import postgresql
+from links.cache import CachedLink, MISSING_LINK, ttl_until_expiry, encode_cached_link, decode_cached_link
+from links.listing import encode_cursor, decode_cursor
+from links.response_cache import conditional_response, http_date
+from links.write_behind import encode_queued_link, decode_queued_link
+from links.schemas import LinkCreate
+from links.models import partitioned_links_ddl, partitioned_index_ddl
+from links.partitioning import COLUMNS, mirror_function_ddl, swap_statements
+from links.deduplicate import plan_merges
+from starlette.requests import Request
+from links.transfer import EXPORT_COLUMNS, format_rows, row_to_record
+import links.warmup
+import links.fast_lane
+from links.cache import local_link_cache
+from links.analytics import aggregate_click_events, click_event, to_local_naive
+from src.metrics import MetricsRegistry, MetricsMiddleware, SamplingProfiler, HTTP_REQUESTS, HTTP_REQUEST_DURATION
+import uuid
+from fastapi_users.jwt import generate_jwt
+from auth.users import get_jwt_strategy, verify_token, verified_tokens
+from benchmarks.bench_links import ZipfSampler, compare_results, percentile
+import tasks.tasks
 
 def test_generate_short_url_unique():
     # Генерируем 100 коротких URL и проверяем, что все они уникальны
@@ -17,4 +54,548 @@ def test_generate_short_url_alphanumeric():
 def test_get_jwt_strategy_instance():
     strategy = get_jwt_strategy()
     # Проверяем, что возвращённая стратегия имеет, например, атрибут secret
-    assert hasattr(strategy, "secret"), "JWT strategy should have a secret attribute."
\ No newline at end of file
+    assert hasattr(strategy, "secret"), "JWT strategy should have a secret attribute."
+
+def test_parse_clicks_buffer_aggregates_counts_and_last_used():
+    buffer = {
+        b"c:abc123": b"3",
+        b"t:abc123": b"1700000000.5",
+        b"c:zero00": b"0",
+    }
+    clicks = parse_clicks_buffer(buffer)
+    # Коды без переходов не попадают в пачку обновления
+    assert set(clicks) == {"abc123"}
+    count, last_used = clicks["abc123"]
+    assert count == 3
+    assert last_used == datetime.fromtimestamp(1700000000.5)
+
+
+def test_lru_ttl_cache_evicts_least_recently_used():
+    cache = LRUTTLCache(max_size=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1  # "a" становится самым свежим
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["hits"] == 3
+    assert cache.stats()["misses"] == 1
+
+
+def test_lru_ttl_cache_expires_entries():
+    now = [0.0]
+    cache = LRUTTLCache(max_size=10, ttl=5, clock=lambda: now[0])
+    cache.set("a", 1)
+    now[0] = 4.9
+    assert cache.get("a") == 1
+    now[0] = 5.0
+    assert cache.get("a") is None
+    assert cache.stats()["expirations"] == 1
+    assert len(cache) == 0
+
+
+def test_count_min_sketch_admits_frequent_codes_and_ages():
+    admission = HotLinkAdmission(CountMinSketch(width=256, depth=4, reset_after=1000), threshold=5)
+    for _ in range(4):
+        admission.record("hot123")
+    assert not admission.should_admit("hot123")
+    assert admission.record("hot123") == 5
+    assert admission.should_admit("hot123")
+    assert not admission.should_admit("cold12")
+    # После старения частоты делятся пополам и ссылка перестаёт считаться горячей
+    admission.sketch._age()
+    assert admission.sketch.estimate("hot123") == 2
+    assert not admission.should_admit("hot123")
+
+
+def test_counter_to_code_is_unique_and_grows_in_length():
+    # Все номера первой длины дают разные коды длины 2, следующий номер – код длины 3
+    codes = [counter_to_code(counter, min_length=2) for counter in range(62 ** 2 + 1)]
+    assert len(set(codes)) == len(codes)
+    assert all(len(code) == 2 for code in codes[:-1])
+    assert len(codes[-1]) == 3
+    assert all(re.match(r'^[A-Za-z0-9]+$', code) for code in codes)
+
+
+def test_counter_generator_skips_rest_of_block_after_conflict(monkeypatch):
+    generator = CounterCodeGenerator(block_size=10, min_length=2)
+    blocks = iter([range(0, 10), range(10, 20)])
+
+    sessions = []
+
+    async def next_block(session):
+        sessions.append(session)
+        return next(blocks)
+
+    monkeypatch.setattr(generator, "_next_block", next_block)
+
+    async def run():
+        first = await generator.next_code("session")
+        await generator.discard_block()
+        return first, await generator.next_code("session"), await generator.next_codes("session", 3)
+
+    first, after_conflict, following = asyncio.run(run())
+    assert first == counter_to_code(0, 2)
+    assert after_conflict == counter_to_code(10, 2)
+    assert following == [counter_to_code(counter, 2) for counter in (11, 12, 13)]
+    # Блоки выделяются в сессии, переданной вызывающим кодом
+    assert sessions == ["session", "session"]
+
+
+def test_base62_encode_pads_to_length():
+    assert base62_encode(0, 6) == "000000"
+    assert base62_encode(61, 1) == "Z"
+    assert base62_encode(62, 1) == "10"
+
+
+def test_url_digest_uses_normalized_url():
+    assert normalize_url("HTTPS://Example.COM:443") == "https://example.com/"
+    assert normalize_url("http://example.com:8080/Path?q=1#frag") == "http://example.com:8080/Path?q=1#frag"
+    assert url_digest("https://EXAMPLE.com") == url_digest("https://example.com/")
+    assert url_digest("https://example.com/a") != url_digest("https://example.com/A")
+    assert len(url_digest("https://example.com/" + "x" * 10000)) == 32
+
+
+def test_plan_merges_groups_urls_equal_after_normalization():
+    Row = namedtuple("Row", "id original_link_hash shortened_link original_link created_at last_used used_count")
+    created = datetime(2024, 1, 1)
+    urls = [("old001", "HTTP://A.com:80"), ("new001", "http://a.com/"), ("other1", "http://b.com/")]
+    rows = [
+        Row(uuid.uuid4(), url_digest(url), code, url, created + timedelta(days=day), created, 1)
+        for day, (code, url) in enumerate(urls)
+    ]
+    # Разные строки, которые раньше проходили ограничение уникальности, дают один хэш
+    assert rows[0].original_link_hash == rows[1].original_link_hash
+
+    merges = plan_merges(list(reversed(rows)))
+    assert [(survivor.shortened_link, [row.shortened_link for row in duplicates]) for survivor, duplicates in merges] == [
+        ("old001", ["new001"])
+    ]
+
+
+def test_cache_ttl_is_aligned_with_link_expiry():
+    now = datetime(2025, 1, 1, 12, 0, 0)
+    assert ttl_until_expiry(None, 3600, now) == 3600
+    assert ttl_until_expiry(now + timedelta(seconds=90), 3600, now) == 90
+    assert ttl_until_expiry(now - timedelta(seconds=1), 3600, now) < 0
+    assert CachedLink("https://example.com", now).is_expired(now)
+    assert not CachedLink("https://example.com", None).is_expired(now)
+
+
+def test_aggregate_click_events_builds_hour_and_day_buckets():
+    moment = datetime(2025, 3, 1, 14, 35, 10)
+    events = [
+        click_event("abc123", moment, "https://t.co/x", "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0) Mobile"),
+        click_event("abc123", moment, None, "curl/8.0"),
+    ]
+    rollups = aggregate_click_events([{k.encode(): v.encode() for k, v in event.items()} for event in events])
+    hour = datetime(2025, 3, 1, 14)
+    day = datetime(2025, 3, 1)
+    assert rollups[("abc123", "hour", hour, "total", "")] == 2
+    assert rollups[("abc123", "day", day, "total", "")] == 2
+    assert rollups[("abc123", "hour", hour, "referrer", "t.co")] == 1
+    assert rollups[("abc123", "hour", hour, "referrer", "direct")] == 1
+    assert rollups[("abc123", "day", day, "agent", "mobile")] == 1
+    assert rollups[("abc123", "day", day, "agent", "bot")] == 1
+
+
+def test_to_local_naive_converts_aware_datetimes_to_server_time():
+    naive = datetime(2024, 5, 1, 10, 0)
+    assert to_local_naive(naive) is naive
+    assert to_local_naive(None) is None
+
+    aware = datetime(2024, 5, 1, 10, 0, tzinfo=timezone.utc)
+    converted = to_local_naive(aware)
+    assert converted.tzinfo is None
+    assert converted.astimezone(timezone.utc) == aware
+
+
+def test_metrics_registry_renders_prometheus_text():
+    test_registry = MetricsRegistry()
+    requests_total = test_registry.counter("demo_requests", "Demo requests", ("route",))
+    latency = test_registry.histogram("demo_latency_seconds", "Demo latency", ("route",), buckets=(0.1, 1.0))
+    requests_total.inc(route="/links/{short_code}")
+    latency.observe(0.05, route="/a")
+    latency.observe(0.5, route="/a")
+    text = test_registry.render()
+    assert "# TYPE demo_requests counter" in text
+    assert 'demo_requests_total{route="/links/{short_code}"} 1' in text
+    assert 'demo_latency_seconds_bucket{route="/a",le="0.1"} 1' in text
+    assert 'demo_latency_seconds_bucket{route="/a",le="+Inf"} 2' in text
+    assert 'demo_latency_seconds_count{route="/a"} 2' in text
+
+
+def test_metrics_middleware_labels_requests_by_route_template():
+    demo_app = FastAPI()
+    demo_app.add_middleware(MetricsMiddleware)
+
+    @demo_app.get("/demo/{item_id}")
+    def demo_item(item_id: str):
+        return {"item_id": item_id}
+
+    async def call():
+        async with AsyncClient(transport=ASGITransport(app=demo_app), base_url="http://test") as client:
+            for item_id in ("a", "b"):
+                assert (await client.get(f"/demo/{item_id}")).status_code == 200
+
+    before = HTTP_REQUESTS.value(method="GET", route="/demo/{item_id}", status="200")
+    asyncio.run(call())
+    assert HTTP_REQUESTS.value(method="GET", route="/demo/{item_id}", status="200") == before + 2
+    assert HTTP_REQUEST_DURATION.count(method="GET", route="/demo/{item_id}") >= 2
+
+
+def test_sampling_profiler_collects_stacks():
+    profiler = SamplingProfiler(interval=0.001).start()
+    deadline = time.perf_counter() + 0.1
+    while time.perf_counter() < deadline:
+        sum(range(1000))
+    profiler.stop()
+    assert "test_sampling_profiler_collects_stacks" in profiler.collapsed()
+
+
+def test_benchmark_percentile_uses_nearest_rank():
+    values = [float(v) for v in range(1, 101)]
+    assert percentile(values, 0.50) == 50.0
+    assert percentile(values, 0.95) == 95.0
+    assert percentile(values, 0.99) == 99.0
+    assert percentile([], 0.5) == 0.0
+
+
+def test_benchmark_zipf_sampler_prefers_low_ranks():
+    sampler = ZipfSampler(100, s=1.1, seed=1)
+    samples = [sampler.sample() for _ in range(5000)]
+    assert all(0 <= sample < 100 for sample in samples)
+    assert samples.count(0) > samples.count(10) > samples.count(90)
+
+
+def test_benchmark_compare_results_flags_regressions():
+    baseline = {"scenarios": {"redirect_hot": {"p95_ms": 10.0, "throughput_rps": 1000.0}}}
+    ok = {"scenarios": {"redirect_hot": {"p95_ms": 11.0, "throughput_rps": 950.0}}}
+    slow = {"scenarios": {"redirect_hot": {"p95_ms": 13.0, "throughput_rps": 700.0}}}
+    assert compare_results(ok, baseline, tolerance=0.15) == []
+    assert len(compare_results(slow, baseline, tolerance=0.15)) == 2
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    group = SingleFlight()
+    calls = []
+
+    async def load():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "value"
+
+    async def run():
+        return await asyncio.gather(*(group.do("abc123", load) for _ in range(10)))
+
+    assert asyncio.run(run()) == ["value"] * 10
+    assert len(calls) == 1
+    assert group.stats() == {"calls": 1, "coalesced": 9, "in_flight": 0}
+
+
+def test_single_flight_shares_exceptions_and_retries_afterwards():
+    group = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0)
+        raise ValueError("boom")
+
+    async def run():
+        results = await asyncio.gather(*(group.do("key", fail) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+
+        async def succeed():
+            return 42
+        return await group.do("key", succeed)
+
+    assert asyncio.run(run()) == 42
+
+
+def test_verify_token_caches_valid_tokens_only():
+    strategy = get_jwt_strategy()
+    user_id = uuid.uuid4()
+    token = generate_jwt(
+        {"sub": str(user_id), "aud": strategy.token_audience}, strategy.encode_key, lifetime_seconds=60
+    )
+    assert verify_token(token) == user_id
+    assert token in verified_tokens
+    assert verify_token(token + "x") is None
+    assert token + "x" not in verified_tokens
+
+
+def test_listing_cursor_round_trips_and_is_bound_to_sort_order():
+    link_id = uuid.uuid4()
+    created_at = datetime(2024, 5, 1, 12, 30)
+    cursor = encode_cursor("created_at", "desc", created_at, link_id)
+    assert decode_cursor(cursor, "created_at", "desc") == (created_at, link_id)
+    assert decode_cursor(encode_cursor("used_count", "asc", 7, link_id), "used_count", "asc") == (7, link_id)
+    with pytest.raises(HTTPException):
+        decode_cursor(cursor, "used_count", "desc")
+
+
+def test_transfer_rows_round_trip_through_ndjson_and_csv():
+    Row = namedtuple("Row", EXPORT_COLUMNS)
+    row = Row(uuid.uuid4(), None, "https://example.com/a", "abc123", datetime(2024, 1, 1, 10), datetime(2024, 1, 2, 11),
+              True, None, 42)
+    expected = (row.id, None, row.original_link, "abc123", row.created_at, row.last_used, True, None, 42,
+                url_digest(row.original_link), "com.example.")
+
+    ndjson_line = format_rows([row], "ndjson")
+    assert row_to_record(json.loads(ndjson_line)) == expected
+
+    csv_text = ",".join(EXPORT_COLUMNS) + "\r\n" + format_rows([row], "csv")
+    assert row_to_record(next(csv.DictReader(io.StringIO(csv_text)))) == expected
+
+
+def test_domain_key_groups_subdomains_under_a_common_prefix():
+    assert domain_key("https://www.Example.com/promo") == "com.example.www."
+    assert domain_key("example.com") == "com.example."
+    assert domain_key("https://example.community/").startswith("com.example.") is False
+    assert domain_key("not a url") == ""
+
+
+def test_search_prefix_candidates_and_like_escaping():
+    assert prefix_candidates("Example.com/Promo") == ["https://example.com/Promo", "http://example.com/Promo"]
+    assert prefix_candidates("HTTPS://Example.com") == ["https://example.com"]
+    assert escape_like("50%_off\\") == "50\\%\\_off\\\\"
+
+
+def test_search_prefix_condition_uses_indexed_lowercase_head():
+    short = str(prefix_condition("https://Example.com/Promo").compile(dialect=postgresql.dialect()))
+    assert short.startswith("lower(left(links.original_link, 255)) LIKE")
+    assert "ILIKE" not in short
+    # Префикс длиннее индексированного начала проверяется и целиком
+    long = str(prefix_condition("https://example.com/" + "a" * 300).compile(dialect=postgresql.dialect()))
+    assert "lower(left(links.original_link, 255)) LIKE" in long
+    assert "links.original_link ILIKE" in long
+
+
+def test_warm_up_gives_up_after_time_budget(monkeypatch):
+    async def slow_warm_top_links(*args, **kwargs):
+        await asyncio.sleep(1)
+        return 0
+
+    monkeypatch.setattr(links.warmup, "warm_top_links", slow_warm_top_links)
+    started = time.perf_counter()
+    assert asyncio.run(links.warmup.warm_up(limit=10, recent_days=1, time_budget=0.05)) is False
+    assert time.perf_counter() - started < 0.5
+
+
+def test_redirect_is_served_from_cache_without_touching_the_database(monkeypatch):
+    import links.router
+    cached = {
+        "cached01": CachedLink("https://example.com/cached", None),
+        "expired1": CachedLink("https://example.com/old", datetime.now() - timedelta(minutes=1)),
+        "missing1": MISSING_LINK,
+    }
+    loaded, clicks = [], []
+
+    async def fake_get_cached_link(short_code):
+        return cached.get(short_code)
+
+    async def fake_load_link(short_code, fill_cache):
+        loaded.append(short_code)
+        return CachedLink("https://example.com/from-db", None)
+
+    async def fake_record_click(short_code, referrer=None, user_agent=None):
+        clicks.append(short_code)
+        return 1
+
+    monkeypatch.setattr(links.router, "get_cached_link", fake_get_cached_link)
+    monkeypatch.setattr(links.router, "load_link", fake_load_link)
+    monkeypatch.setattr(links.router, "record_click", fake_record_click)
+    app = FastAPI()
+    app.include_router(links.router.router)
+
+    async def call():
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            return [await client.get(f"/links/{code}") for code in ("cached01", "expired1", "missing1", "dbonly01")]
+
+    hit, expired, missing, miss = asyncio.run(call())
+    assert hit.status_code == 307
+    assert hit.headers["location"] == "https://example.com/cached"
+    # Просроченная и отсутствующая ссылки отклоняются по записи кэша, без запроса к базе
+    assert expired.status_code == 404
+    assert missing.status_code == 404
+    assert miss.status_code == 307
+    assert miss.headers["location"] == "https://example.com/from-db"
+    assert loaded == ["dbonly01"]
+    assert clicks == ["cached01", "dbonly01"]
+
+
+def test_redirect_fast_lane_miss_is_not_looked_up_twice(monkeypatch):
+    import links.router
+    lookups, loaded = [], []
+
+    async def fake_get_cached_link(short_code):
+        lookups.append(short_code)
+        return None
+
+    async def fake_load_link(short_code, fill_cache):
+        loaded.append(short_code)
+        return CachedLink("https://example.com/from-db", None)
+
+    async def fake_record_click(short_code, referrer=None, user_agent=None):
+        return 1
+
+    monkeypatch.setattr(links.fast_lane, "get_cached_link", fake_get_cached_link)
+    monkeypatch.setattr(links.router, "get_cached_link", fake_get_cached_link)
+    monkeypatch.setattr(links.router, "load_link", fake_load_link)
+    monkeypatch.setattr(links.router, "record_click", fake_record_click)
+    inner = FastAPI()
+    inner.include_router(links.router.router)
+    app = links.fast_lane.RedirectFastLaneMiddleware(inner)
+
+    async def call():
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            return await client.get("/links/cold01")
+
+    response = asyncio.run(call())
+    assert response.status_code == 307
+    assert response.headers["location"] == "https://example.com/from-db"
+    # Промах быстрого пути передан обработчику, второго обращения к кэшу нет
+    assert lookups == ["cold01"]
+    assert loaded == ["cold01"]
+
+
+def test_redirect_fast_lane_serves_cached_codes_and_falls_through_otherwise(monkeypatch):
+    clicks = []
+
+    async def fake_record_click(short_code, referrer=None, user_agent=None):
+        clicks.append((short_code, referrer))
+        return 1
+
+    monkeypatch.setattr(links.fast_lane, "record_click", fake_record_click)
+    local_link_cache.set("fast01", CachedLink("https://example.com/a b", None))
+    inner = FastAPI()
+
+    @inner.get("/links/search")
+    def search():
+        return {"inner": True}
+
+    app = links.fast_lane.RedirectFastLaneMiddleware(inner)
+
+    async def call():
+        async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+            redirect = await client.get("/links/fast01", headers={"referer": "https://ref.example/"})
+            passed = await client.get("/links/search")
+            return redirect, passed
+
+    try:
+        redirect, passed = asyncio.run(call())
+    finally:
+        local_link_cache.delete("fast01")
+    assert redirect.status_code == 307
+    assert redirect.headers["location"] == "https://example.com/a%20b"
+    assert clicks == [("fast01", "https://ref.example/")]
+    assert passed.json() == {"inner": True}
+
+
+def test_cached_link_binary_encoding_round_trips_and_reads_legacy_json():
+    expires_at = datetime(2030, 1, 1, 12, 0)
+    url = "https://example.com/путь?q=1"
+    encoded = encode_cached_link(url, expires_at)
+    assert decode_cached_link(encoded) == CachedLink(url, expires_at)
+    assert decode_cached_link(encode_cached_link(url, None)) == CachedLink(url, None)
+    legacy = json.dumps({"original_link": url, "expires_at": expires_at.isoformat()}).encode()
+    assert decode_cached_link(legacy) == CachedLink(url, expires_at)
+    assert decode_cached_link(b"\x00") is MISSING_LINK
+    assert len(encoded) < len(legacy)
+
+
+def test_conditional_response_returns_304_for_matching_etag_or_date():
+    def request(**headers):
+        raw = [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()]
+        return Request({"type": "http", "method": "GET", "headers": raw})
+
+    last_modified = datetime(2026, 3, 1, 12, 30, 15, 500000)
+    full = conditional_response(request(), '{"used_count":3}', last_modified)
+    assert full.status_code == 200
+    assert full.body == b'{"used_count":3}'
+    etag = full.headers["etag"]
+    assert full.headers["last-modified"] == http_date(last_modified)
+
+    assert conditional_response(request(if_none_match=etag), '{"used_count":3}', last_modified).status_code == 304
+    assert conditional_response(request(if_none_match=etag), '{"used_count":4}', last_modified).status_code == 200
+    since = full.headers["last-modified"]
+    assert conditional_response(request(if_modified_since=since), '{"used_count":3}', last_modified).status_code == 304
+    later = last_modified + timedelta(seconds=1)
+    assert conditional_response(request(if_modified_since=since), '{"used_count":4}', later).status_code == 200
+
+
+def test_queued_link_round_trips_and_recomputes_derived_columns():
+    link = LinkCreate(
+        user_id=uuid.uuid4(),
+        original_link="https://Example.com/promo",
+        shortened_link="promo1",
+        custom_alias=True,
+        expires_at=datetime(2030, 1, 1, 12, 0),
+    )
+    fields = encode_queued_link(link)
+    assert "original_link_hash" not in fields["link"]
+    decoded = decode_queued_link({key.encode(): value.encode() for key, value in fields.items()})
+    assert decoded == link
+    assert decoded.original_link_hash == url_digest(link.original_link)
+
+
+def test_partitioned_links_ddl_keeps_unique_keys_within_the_partition_key():
+    statements = partitioned_links_ddl("links_partitioned", 4)
+    table, partitions = statements[0], statements[1:]
+    assert "PARTITION BY HASH (shortened_link)" in table
+    assert "PRIMARY KEY (id, shortened_link)" in table
+    assert all(f"    {column} " in table for column in COLUMNS)
+    assert partitions[-1].endswith("FOR VALUES WITH (MODULUS 4, REMAINDER 3)")
+    indexes = partitioned_index_ddl("links_partitioned", "_new")
+    assert not any("UNIQUE" in statement for statement in indexes)
+    assert "CREATE INDEX IF NOT EXISTS ix_links_original_link_hash_new ON links_partitioned (original_link_hash)" in indexes
+    assert "ON CONFLICT DO NOTHING" in mirror_function_ddl()
+
+
+def test_swap_renames_partitioned_table_indexes_and_partitions():
+    statements = swap_statements(["links_partitioned_p0", "links_partitioned_p1"])
+    assert statements.index("ALTER TABLE links RENAME TO links_unpartitioned") < statements.index(
+        "ALTER TABLE links_partitioned RENAME TO links"
+    )
+    assert "ALTER INDEX IF EXISTS ix_links_expires_at_new RENAME TO ix_links_expires_at" in statements
+    assert statements[-1] == "ALTER TABLE links_partitioned_p1 RENAME TO links_p1"
+
+
+class FakeLockRedis:
+    '''Только то, что нужно task_lock: SET NX PX и снятие блокировки скриптом по токену'''
+
+    def __init__(self):
+        self.values = {}
+
+    def set(self, key, value, nx=False, px=None):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value
+        return True
+
+    def eval(self, script, numkeys, key, token):
+        if self.values.get(key) == token:
+            del self.values[key]
+            return 1
+        return 0
+
+
+def test_persist_queued_links_skips_a_run_overlapping_the_previous_one(monkeypatch):
+    fake_redis = FakeLockRedis()
+    monkeypatch.setattr(tasks.tasks, "redis_client", fake_redis)
+    runs = []
+
+    def persist_stream():
+        runs.append("outer")
+        # Следующий тик beat приходит, пока идёт предыдущий запуск
+        overlapping = tasks.tasks.persist_queued_links()
+        assert overlapping["details"].startswith("Skipped")
+        return {"status": 204, "details": "OK", "persisted": 1, "failed": 0}
+
+    monkeypatch.setattr(tasks.tasks, "persist_queued_links_stream", persist_stream)
+    assert tasks.tasks.persist_queued_links()["persisted"] == 1
+    assert runs == ["outer"]
+    # Блокировка снята: следующий запуск выполняется
+    monkeypatch.setattr(tasks.tasks, "persist_queued_links_stream", lambda: {"persisted": 0})
+    assert tasks.tasks.persist_queued_links() == {"persisted": 0}
+    assert fake_redis.values == {}